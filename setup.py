@@ -16,6 +16,13 @@ setup(name='azur650_serial',
     packages=find_packages('src'),
     include_package_data=True,
     install_requires=['pyserial'],
+    extras_require={
+        'fleet': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': ['azur650 = azur650.cli:main'],
+    },
+    test_suite='azur650.tests',
     zip_safe=False,
 )
 
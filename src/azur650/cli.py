@@ -0,0 +1,196 @@
+"""
+The azur650 command. If a daemon is running (see daemon.py) the command is
+passed to it; otherwise the serial port is opened directly.
+
+Examples:
+
+    azur650 volume -30
+    azur650 mute
+    azur650 input bd
+    azur650 status --json
+    azur650 daemon
+    azur650 gateway 0.0.0.0:8650
+"""
+
+# Python modules
+import json
+import sys
+from optparse import OptionParser
+
+# Local modules; command (with pyserial) and gateway (with BaseHTTPServer) are
+# only imported where needed, as a command passed to the daemon needs neither.
+from daemon import DaemonClient, DaemonError, serve
+
+
+USAGE = """%prog [options] COMMAND [ARGS]
+
+Commands:
+  power on|off          Switch the amplifier on or to standby
+  volume [LEVEL|up|down]
+                        Show or set the volume (-90 to 0 dB)
+  mute, unmute          Mute or unmute the audio output
+  input [INPUT]         Show or select the input, by ID or name (e.g. bd)
+  status [--json]       Show the known state of the amplifier
+  daemon                Run the daemon in the foreground
+  gateway [[HOST:]PORT] Run the HTTP gateway in the foreground (default
+                        127.0.0.1:8650)"""
+
+# Short names for the inputs; see Azur650R.input_names.
+input_aliases = {
+    'tuner': '00',
+    'bd': '01',
+    'dvd': '01',
+    'video1': '02',
+    'video2': '03',
+    'video3': '04',
+    'rec1': '05',
+    'aux': '06',
+    'cd': '07',
+    'rec2': '08',
+    'direct': '10',
+}
+
+
+# How a DirectClient finds out state fields, by the commands it sends. The
+# volume is stepped down and back up (so at worst it ends up at -89dB rather
+# than -90dB, instead of -1dB rather than 0dB), and the input moved on and
+# back.
+probes = {
+    'volume': ('volume_down', 'volume_up'),
+    'active_input': ('input_select_next', 'input_select_previous'),
+    'signal_processing_mode': ('get_digital_processing_mode',),
+    'signal_codec': ('get_codec',),
+    'main_software_version': ('get_main_software_version',),
+    'protocol_version': ('get_protocol_version',),
+}
+
+
+class DirectClient(object):
+    """
+    Stands in for DaemonClient when no daemon is running, by calling the
+    amplifier directly. As the amplifier's state isn't known to begin with,
+    the fields asked for are found out first where they can be (see
+    probes); the rest (such as the power and mute state, which can't be
+    asked without changing them) stay unknown.
+    """
+
+    def __init__(self, serial_port):
+        from command import Azur650R
+        self.__amplifier = Azur650R(serial_port)
+
+    def call(self, method, *args):
+        amplifier = self.__amplifier
+        if method == 'get_state': fields = sorted(probes.keys())
+        else: fields = [method]
+        state = amplifier.get_state()
+        for field in fields:
+            if field in probes and state[field] is None:
+                for probe in probes[field]: getattr(amplifier, probe)()
+        value = getattr(amplifier, method)
+        if callable(value): return value(*args)
+        return value
+
+    def close(self):
+        self.__amplifier.disconnect()
+
+
+def run(client, command, args, as_json=False):
+    """
+    Runs a single command using client (a DaemonClient or DirectClient);
+    returns the text to print.
+    """
+    if command == 'power' and args in (['on'], ['off']):
+        client.call('power_%s' % args[0])
+        return ''
+
+    if command == 'volume':
+        if not args:
+            volume = client.call('volume')
+            if volume is None: raise IOError("The volume isn't known")
+            return str(volume)
+        if args[0] == 'up': return str(client.call('volume_up'))
+        if args[0] == 'down': return str(client.call('volume_down'))
+        return str(client.call('set_volume', int(args[0])))
+
+    if command in ('mute', 'unmute') and not args:
+        client.call('set_mute', command == 'mute')
+        return ''
+
+    if command == 'input':
+        if args:
+            input_id = input_aliases.get(args[0].lower(), args[0])
+            client.call('input_select', input_id)
+        input_id, input_name = client.call('active_input')
+        if input_id is None: raise IOError("The input isn't known")
+        return '%s %s' % (input_id, input_name)
+
+    if command == 'status':
+        state = client.call('get_state')
+        if as_json: return json.dumps(state, sort_keys=True, indent=2)
+        lines = []
+        for name in sorted(state.keys()):
+            if isinstance(state[name], dict): continue
+            if state[name] is None: lines.append('%s: unknown' % name)
+            else: lines.append('%s: %s' % (name, state[name]))
+        return '\n'.join(lines)
+
+    raise ValueError("Unknown command '%s'; see --help" % \
+                     ' '.join([command] + args))
+
+
+def main(argv=None):
+    """
+    Entry point for the azur650 command.
+    """
+    parser = OptionParser(usage=USAGE)
+    parser.disable_interspersed_args() # Allow 'volume -30'
+    parser.add_option('-p', '--port', default='/dev/ttyS0',
+                      help="serial port, if no daemon is running "
+                           "[default: %default]")
+    parser.add_option('-s', '--socket', default=None,
+                      help="daemon socket [default: $AZUR650_SOCKET, or "
+                           "azur650.sock in $XDG_RUNTIME_DIR]")
+    parser.add_option('-d', '--direct', action='store_true', default=False,
+                      help="open the serial port even if a daemon is running")
+    options, args = parser.parse_args(argv)
+    if not args: parser.error("No command given")
+    command, args = args[0], args[1:]
+
+    if command == 'daemon':
+        try:
+            serve(options.port, options.socket)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if command == 'gateway':
+        import gateway
+        host, port = gateway.DEFAULT_ADDRESS
+        if args:
+            if ':' in args[0]: host, port = args[0].rsplit(':', 1)
+            else: port = args[0]
+        try:
+            gateway.serve(options.port, (host, int(port)), verbose=True)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    as_json = '--json' in args
+    if as_json: args.remove('--json')
+
+    client = None
+    try:
+        if not options.direct: client = DaemonClient.connect(options.socket)
+        if client is None: client = DirectClient(options.port)
+        output = run(client, command, args, as_json)
+    except (IOError, DaemonError, KeyError, ValueError, TypeError), exception:
+        sys.stderr.write('azur650: %s\n' % exception)
+        return 1
+    finally:
+        if client is not None: client.close()
+    if output: print output
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
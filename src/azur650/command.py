@@ -20,11 +20,19 @@ TODO: Instantiation instructions
 """
 
 # Python modules
-from time import sleep
-from sys import exit
+import json
+from time import sleep, time
+from sys import exit, stderr
+import threading
+import traceback
+from contextlib import contextmanager
+from types import FunctionType
 
-# Third-party modules
-import serial
+# Local modules
+import protocol
+from shared import SharedSession, default_path, not_shared
+from state import StateStore
+from tracing import null_span, traced
 
 
 class CommandGroupError(KeyError):
@@ -46,6 +54,57 @@ class CommandDataError(ValueError):
     pass
 
 
+class PendingReply(object):
+    """
+    Handle for a command sent in write-behind mode (see
+    Azur650R.enable_write_behind). Indexing it like a reply tuple waits for
+    the reply, so methods such as volume_up() still return the right value.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.sent = time()
+        self.response = None
+        self.error = None
+        self.optimistic = {} # Field -> (value before, value assumed)
+        self.__event = threading.Event()
+
+    def _resolve(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.__event.set()
+
+    def done(self):
+        """
+        Returns True once the command has been confirmed or has failed.
+        """
+        return self.__event.isSet()
+
+    def join(self, timeout=None):
+        """
+        Waits for the command to be confirmed or fail, without raising;
+        returns done().
+        """
+        self.__event.wait(timeout)
+        return self.__event.isSet()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the reply and returns it; raises the error if the command
+        failed, or IOError if there is still no reply after timeout seconds.
+        """
+        if not self.join(timeout):
+            raise IOError("No reply to '%s' yet" % ','.join(self.command))
+        if self.error is not None: raise self.error
+        return self.response
+
+    def __getitem__(self, index): return self.wait()[index]
+
+    def __len__(self): return len(self.wait())
+
+    def __iter__(self): return iter(self.wait())
+
+
 class Azur650R(object):
     """
     Class for controlling a Cambridge Audio Azur 650R model amplifier.
@@ -61,10 +120,13 @@ class Azur650R(object):
         '06': 'Aux',
         '07': 'CD',
         '08': 'Rec 2',
-        '09': 'Tuner', # TODO: Confusing, why does this differ from set?
+        '09': 'Tuner', # Selected as '00', but reported by the amp as '09'
         '10': '7.1 Direct In',
     }
 
+    # Input IDs which refer to the tuner; see input_names above.
+    tuner_inputs = ('00', '09')
+
     audio_input_source = {
         '0': 'analogue',
         '1': 'digital',
@@ -83,12 +145,78 @@ class Azur650R(object):
         '01': 'Stereo + Subwoofer',
     }
 
-    def __init__(self, serial_port='/dev/ttyS0'):
+    tuner_bands = {
+        '0': 'FM',
+        '1': 'AM',
+    }
+
+    tuner_modes = {
+        '0': 'Mono',
+        '1': 'Stereo',
+    }
+
+    # Presets are numbered '01' to '30'; see also protocol.py.
+    tuner_preset_count = 30
+
+    # Default tuning steps (MHz for FM, kHz for AM). These vary by region, so
+    # they are replaced by the observed step whenever the frequency is moved.
+    tuner_frequency_steps = {
+        '0': 0.05,
+        '1': 9.0,
+    }
+
+    # Names of the private attributes making up the state snapshot returned
+    # by get_state(); see also __getstate__().
+    state_fields = (
+        'power_state', 'volume', 'bass', 'treble', 'subwoofer', 'lfe_trim',
+        'mute_state', 'dynamic_range', 'osd_on', 'lip_sync', 'active_input',
+        'audio_source_for_input', 'video_source_for_input', 'tuner_band',
+        'tuner_frequency', 'tuner_preset', 'tuner_mode', 'tuner_presets',
+        'tuner_steps', 'stereo_audio_mode', 'signal_processing_mode',
+        'signal_codec', 'processing_mode_cycles', 'codec_cycles',
+        'main_software_version', 'protocol_version', 'step_model',
+    )
+
+    # Controls which are set by stepping up and down; the command numbers
+    # (group 1) for up and down, and the state field. See _set_value().
+    step_controls = {
+        'volume': ('02', '03', 'volume'),
+        'bass': ('04', '05', 'bass'),
+        'treble': ('06', '07', 'treble'),
+        'lip_sync': ('21', '20', 'lip_sync'),
+    }
+
+    # Replies which _parse_response handles by hand rather than as the
+    # protocol table says: steps of the step_controls, which are learned (see
+    # _record_step), and the tuner, whose fields depend on each other.
+    hand_parsed_replies = frozenset(
+        ('6', number) for up, down, field in step_controls.values()
+        for number in (up, down)) | frozenset(
+        spec.reply for spec in protocol.commands if spec.group == '3')
+
+    # Largest believable single step of any of the step_controls, and how
+    # many times in a row a step which isn't the usual size must be seen
+    # before it is believed.
+    max_step_size = 20
+    step_agreement = 2
+
+    # After power on, how long (in seconds) to wait for the amplifier to
+    # answer, and the first and longest intervals between probes.
+    power_on_timeout = 15.0
+    ready_probe_intervals = (0.05, 1.0)
+
+    # Longest DSP mode or CODEC cycle we expect; anything longer means the
+    # cycle never returns to where it started.
+    max_cycle_length = 24
+
+    def __init__(self, serial_port='/dev/ttyS0', state_values=None,
+                 tracer=None, pacer=None):
         """
         Creates a new Azur650R communication instance on the specified
         serial_port. You can either pass a string as a reference to the
         device node (e.g. '/dev/ttyS1' for the second serial port) or an
-        integer (e.g. 1).
+        integer (e.g. 1), or an already-open port object with the pyserial
+        interface (e.g. a simulator.SimulatedSerial).
 
         Since the constructor opens the serial port, you should remember to
         call the close() method when you are done to release the port.
@@ -100,27 +228,52 @@ class Azur650R(object):
         Although some values may be modified externally (such as input
         section, volume, etc.) these are adjusted often and will be
         resynchronized frequently with updated information.
+
+        The state is normally kept in a dictionary of its own; pass a mapping
+        as state_values to keep it there instead (e.g. a row of a
+        fleet.FleetStateTable). Anything the mapping already knows is kept.
+        If the mapping has an attach() method (as fleet rows do), it is given
+        the state store, so that changes made to it from outside (such as
+        FleetStateTable.apply_replies) are seen by subscribers too.
+
+        Pass a tracing.Tracer as tracer to record a span for every public
+        call, and for every exchange on the serial port within it.
+
+        Pass a pacing.Pacer as pacer to space out commands so that the
+        amplifier doesn't drop any; see pacing.calibrate().
         """
-        # Creates an (active) serial connection.
-        self.__conn = serial.Serial(port=serial_port, baudrate=9600,
-                                    bytesize=8, parity='N', stopbits=1,
-                                    timeout=0.08)
+        self.tracer = tracer
+        self.pacer = pacer
+
+        # Creates an (active) serial connection. Pyserial is only imported
+        # here, so that importing this module (e.g. for the azur650 command,
+        # which usually talks to the daemon instead) stays quick.
+        if hasattr(serial_port, 'write'):
+            self.__conn = serial_port
+        else:
+            import serial
+            self.__conn = serial.Serial(port=serial_port, baudrate=9600,
+                                        bytesize=8, parity='N', stopbits=1,
+                                        timeout=0.08)
+
+        # All state is kept in an observable store; see the state property.
+        state = StateStore(self.state_fields)
 
         # Group 6: Amplifier commands
-        self.__power_state = None
-        self.__volume = None
-        self.__bass = None
-        self.__treble = None
-        self.__subwoofer = None
-        self.__lfe_trim = None
-        self.__mute_state = None
-        self.__dynamic_range = None
-        self.__osd_on = None
-        self.__lip_sync = None
+        state['power_state'] = None
+        state['volume'] = None
+        state['bass'] = None
+        state['treble'] = None
+        state['subwoofer'] = None
+        state['lfe_trim'] = None
+        state['mute_state'] = None
+        state['dynamic_range'] = None
+        state['osd_on'] = None
+        state['lip_sync'] = None
 
         # Group 7: Source commands
-        self.__active_input = None
-        self.__audio_source_for_input = {
+        state['active_input'] = None
+        state['audio_source_for_input'] = {
             '01': None,
             '02': None,
             '03': None,
@@ -131,7 +284,7 @@ class Azur650R(object):
             '08': None,
             '09': None,
         }
-        self.__video_source_for_input = {
+        state['video_source_for_input'] = {
             '01': None,
             '02': None,
             '03': None,
@@ -144,16 +297,65 @@ class Azur650R(object):
         }
 
         # Group 8: Tuner commands
-        # TODO
+        state['tuner_band'] = None
+        state['tuner_frequency'] = None
+        state['tuner_preset'] = None
+        state['tuner_mode'] = None
+        state['tuner_presets'] = None # Preset index; see scan_tuner_presets()
+        state['tuner_steps'] = dict(self.tuner_frequency_steps)
 
         # Group 9: Audio processing commands
-        self.__stereo_audio_mode = None
-        self.__signal_processing_mode = None
-        self.__signal_codec = None
+        state['stereo_audio_mode'] = None
+        state['signal_processing_mode'] = None
+        state['signal_codec'] = None
+
+        # Learned cycle order of the DSP modes (keyed by input and CODEC) and
+        # CODECs (keyed by input); see _set_cycled_value().
+        state['processing_mode_cycles'] = {}
+        state['codec_cycles'] = {}
 
         # Group 10: Version commands
-        self.__main_software_version = None
-        self.__protocol_version = None
+        state['main_software_version'] = None
+        state['protocol_version'] = None
+
+        # Learned step sizes of the step_controls; see _record_step().
+        state['step_model'] = {}
+
+        # Fill in anything the given state_values don't know yet.
+        if state_values is not None:
+            defaults = state.snapshot()
+            state = StateStore(self.state_fields, state_values)
+            for field in self.state_fields:
+                if state[field] is None: state[field] = defaults[field]
+            if hasattr(state_values, 'attach'): state_values.attach(state)
+        self.__state = state
+
+        # Write-behind mode; see enable_write_behind().
+        self.__write_behind = False
+        self.__pending = []
+        self.__pending_lock = threading.RLock()
+        self.__reader = None
+        self.__error_callback = None
+        self.__reply_timeout = None
+        self.__reader_error = None # Why the reader thread stopped, if it did
+        self.__held = [] # (handle, frame) held until ready after power on
+
+        # Shared mode; see enable_sharing().
+        self.__shared = None
+
+        # Power-on readiness; see _wait_until_ready().
+        self.__warming = None # When powered on, until the amplifier answers
+        self.__next_probe = None
+        self.__probe_interval = None
+
+        # Command elision; see enable_elision().
+        self.__elision = None # (default freshness, {field: freshness})
+        self.__forced = 0
+        self.elided = 0 # Number of commands not sent
+
+        # Step learning; see _confirming() and _record_step().
+        self.__confirmed = None # Control -> level reported, while confirming
+        self.__step_candidates = {} # Unusual steps seen, not yet believed
 
     def _cmd(self, command_group, command_number, command_data=None):
         """
@@ -166,147 +368,518 @@ class Azur650R(object):
         returned as strings because some commands use leading zeros and
         some don't, and some commands return strings by default.
         """
-        # Compose the command sequence
+        spec = self._validate(command_group, command_number, command_data)
+        with self._sharing():
+            if self.__elision is not None and not self.__forced:
+                reply = self._elide(spec, command_data)
+                if reply is not None: return reply
+            if self.__write_behind:
+                return self._submit(command_group, command_number,
+                                    command_data)
+            if self.__warming is not None: self._wait_until_ready()
+            powering_on = self._powering_on((command_group, command_number,
+                                             command_data))
+
+            # Compose the command sequence
+            command = self._encode(command_group, command_number, command_data)
+
+            with self._span('_cmd', command=command.strip()) as span:
+                # Write the command and flush the buffer
+                if self.pacer is not None: self.pacer.pace()
+                self.__conn.write(command)
+                self.__conn.flush()
+                span.set('bytes_written', len(command))
+
+                # Retrieve the command response.
+                started = time()
+                response = self.__conn.read(50)
+                span.set('wait_time', time() - started)
+                span.set('timed_out', not response)
+
+                # How many unique replies are present in the response?
+                responses = set( response.strip('\r').split('\r') )
+                span.set('frames_parsed', len(responses))
+                for response in responses:
+
+                    # Parse the response into a tuple
+                    response = tuple(response[1:].split(','))
+
+                    # If the response command group is 11, raise an appropriate
+                    # exception
+                    self._raise_for_error(response, command_group,
+                                          command_number, command_data)
+
+                    # Process the response code.
+                    self._parse_response(response)
+
+            if powering_on: self._warm_up()
+
+        # No exceptions encountered; return a human-readable string
+        return response
+
+    def _sharing(self):
+        """
+        Returns the SharedSession to hold around an exchange in shared mode,
+        or a stand-in which does nothing if not; see enable_sharing().
+        """
+        if self.__shared is None: return not_shared
+        return self.__shared
+
+    def _span(self, name, **attributes):
+        """
+        Returns a tracing span (to be used in a with statement) if there is
+        a tracer, or a span which does nothing if not.
+        """
+        if self.tracer is None: return null_span
+        return self.tracer.span(name, **attributes)
+
+    def _validate(self, command_group, command_number, command_data=None):
+        """
+        Checks a command against the protocol table before it is sent,
+        raising the same exception the amplifier's error reply would; returns
+        the protocol.Command.
+        """
+        group, number = str(command_group), str(command_number)
+        if command_data == '': command_data = None
+        if group not in protocol.groups:
+            raise CommandGroupError("Unknown command group '%s'" % group)
+        spec = protocol.by_code.get((group, number))
+        if spec is None:
+            raise CommandNumberError("Unknown command number '%s' in group "
+                                     "'%s'" % (number, group))
+        if not spec.accepts(command_data):
+            if spec.data is None:
+                raise CommandDataError("Command '%s' takes no data" % \
+                                       spec.name)
+            if command_data is None:
+                raise CommandDataError("Command '%s' needs data" % spec.name)
+            raise CommandDataError("Invalid data '%s' for command '%s'; "
+                                   "expected one of %s" % (command_data,
+                                   spec.name, ', '.join(spec.data)))
+        return spec
+
+    def _elide(self, spec, command_data):
+        """
+        Returns the reply the command would get if it can be skipped, as its
+        effect is already in fresh state (see enable_elision), or None if it
+        must be sent.
+        """
+        if not spec.idempotent or spec.predict is None or spec.field is None:
+            return None
+        default, fields = self.__elision
+        updated = self.__state.updated(spec.field)
+        if updated is None or time() - updated > fields.get(spec.field,
+                                                            default):
+            return None
+        if self.__pending: return None # Not confirmed yet
+
+        if command_data is not None: command_data = str(command_data)
+        data = spec.predict(command_data)
+        if spec.decode(data) != self.__state[spec.field]: return None
+        self.elided += 1
+        if data: return spec.reply + (data,)
+        return spec.reply
+
+    def _encode(self, command_group, command_number, command_data=None):
+        """
+        Returns the command as it is written to the serial port.
+        """
         command = '#%s,%s' % (command_group, command_number)
         if command_data: command = "%s,%s" % (command, command_data)
+        return "%s\r" % command
 
-        # Write the command and flush the buffer
-        self.__conn.write("%s\r" % command)
-        self.__conn.flush()
-
-        # Retrieve the command response.
-        response = self.__conn.read(50)
-
-        # How many unique replies are present in the response?
-        responses = set( response.strip('\r').split('\r') )
-        for response in responses:
-
-            # Parse the response into a tuple
-            response = tuple(response[1:].split(','))
-
-            # If the response command group is 11, raise an appropriate exception
-            if response[0] == '11':
-                if response[1] == '01':
-                    raise CommandGroupError("Unknown command group '%s'" % \
-                                            command_group)
-                elif response[1] == '02':
-                    raise CommandNumberError("Unknown command number '%s'" % \
-                                             command_number)
-                elif response[1] == '03':
-                    raise CommandDataError("Invalid command data '%s'" % \
-                                           command_data)
-                else:
-                    raise ValueError("Invalid command '%s' [unknown error]" % \
+    def _frame(self, frame):
+        """
+        Parses a frame read from the amplifier (without its carriage return)
+        into a reply tuple; returns None if it isn't a reply, or is too
+        damaged (e.g. by a lost byte) to tell what it replies to.
+        """
+        if not frame.startswith('#'): return None
+        response = tuple(frame[1:].split(','))
+        if len(response) < 2: return None
+        return response
+
+    def _raise_for_error(self, response, command_group, command_number,
+                         command_data=None):
+        """
+        Raises the appropriate exception if the (parsed) response is a group
+        11 error reply to the given command; otherwise does nothing.
+        """
+        if response[0] != '11': return
+        command = self._encode(command_group, command_number,
+                               command_data).strip()
+        if response[1] == '01':
+            raise CommandGroupError("Unknown command group in '%s'" % command)
+        elif response[1] == '02':
+            raise CommandNumberError("Unknown command number in '%s'" % \
                                      command)
+        elif response[1] == '03':
+            raise CommandDataError("Invalid command data in '%s'" % command)
+        else:
+            raise ValueError("Invalid command '%s' [unknown error]" % command)
+
+    def _is_reply_to(self, response, command):
+        """
+        Returns True if the (parsed) response could be the reply to command,
+        a (group, number[, data]) tuple. Replies are in the command group + 5
+        with the same number; an error reply could belong to any command.
+        """
+        if response[0] == '11': return True
+        spec = protocol.by_code[(str(command[0]), str(command[1]))]
+        return (response[0], response[1]) == spec.reply
+
+    def _exchange(self, commands, encoded=None):
+        """
+        Sends several commands in a single write and collects the replies;
+        commands is a list of (group, number[, data]) tuples. Returns a list
+        with the reply tuple for each command, in the same order, or None
+        where no reply was received before the line went quiet.
+
+        Unlike _cmd, every reply is parsed in the order it arrives, so
+        repeated commands (e.g. five volume_up steps) are all accounted for.
+        Replies are matched to commands by their group (command group + 5)
+        and number; an error reply belongs to the oldest unanswered command.
+        If any command fails, the first error is raised once all replies have
+        been read. After a command which switches the amplifier on, the rest
+        wait until it answers (see _wait_until_ready).
+
+        If the commands have already been validated and encoded (see
+        macros.Macro), pass the encoded string as encoded to write it as-is.
+        """
+        commands = [tuple(command) for command in commands]
+        if not commands: return []
+        if encoded is None:
+            for command in commands: self._validate(*command)
+
+        # Levels reported in reply to these commands follow on from each
+        # other, so the steps between them can be learned.
+        with self._confirming():
+            # In write-behind mode the reader thread collects the replies.
+            if self.__write_behind:
+                pending = [self._submit(*command) for command in commands]
+                replies = []
+                error = None
+                for handle in pending:
+                    try:
+                        replies.append(handle.wait(self.__reply_timeout))
+                    except IOError:
+                        replies.append(None)
+                    except (KeyError, ValueError), exception:
+                        replies.append(handle.response)
+                        if error is None: error = exception
+                if error is not None: raise error
+                return replies
+
+            with self._sharing():
+                return self._exchange_bursts(commands, encoded)
+
+    def _exchange_bursts(self, commands, encoded=None):
+        """
+        The blocking half of _exchange: sends the commands in bursts, each
+        ending at a command which switches the amplifier on, so that the
+        commands after it wait until it has warmed up. If a burst fails,
+        nothing more is sent.
+        """
+        if encoded is not None:
+            frames = ['%s\r' % frame for frame in encoded.split('\r')[:-1]]
+        replies = []
+        start = 0
+        while start < len(commands):
+            end = start
+            while end < len(commands):
+                end += 1
+                if self._powering_on(commands[end - 1]): break
+            powering_on = self._powering_on(commands[end - 1])
+
+            if self.__warming is not None: self._wait_until_ready()
+            burst = commands[start:end]
+            if encoded is not None: encoded = ''.join(frames[start:end])
+            with self._span('_exchange', commands=len(burst)) as span:
+                replies.extend(self._write_and_collect(burst, span, encoded))
+            if powering_on: self._warm_up()
+            start = end
+        return replies
+
+    def _write_and_collect(self, commands, span, encoded=None):
+        """
+        The blocking half of _exchange: writes the commands, then reads and
+        parses the replies, recording what happened on the tracing span.
+
+        Without a pacer everything is written at once. With one, commands
+        are written as the pacer allows, in between reading replies; a
+        command whose reply doesn't come while others wait to be sent is
+        given up on, to make room.
+        """
+        pacer = self.pacer
+        if pacer is None:
+            # Write everything at once.
+            if encoded is None:
+                encoded = ''.join([self._encode(*command)
+                                   for command in commands])
+            self.__conn.write(encoded)
+            self.__conn.flush()
+            sent = len(commands)
+            written = len(encoded)
+        else:
+            separate = [self._encode(*command) for command in commands]
+            sent = 0
+            written = 0
+
+        replies = [None] * len(commands)
+        unanswered = range(len(commands))
+        error = None
+        buffered = ''
+        frames = 0
+        started = time()
+        while unanswered:
+            if sent < len(commands):
+                # Write as much as the pacer allows.
+                while sent < len(commands) and pacer.allows(
+                        len([index for index in unanswered if index < sent])):
+                    pacer.pace()
+                    self.__conn.write(separate[sent])
+                    self.__conn.flush()
+                    written += len(separate[sent])
+                    sent += 1
+
+            if sent < len(commands):
+                # Wait for a reply to make room for the rest.
+                chunk = self.__conn.read(1)
+                if not chunk:
+                    unanswered.remove(min(unanswered))
+                    continue
+                chunk += self.__conn.read(self.__conn.inWaiting())
+            else:
+                chunk = self.__conn.read(50)
+                if not chunk: break # Timed out; the rest aren't coming.
+            buffered += chunk
+            while '\r' in buffered:
+                frame, buffered = buffered.split('\r', 1)
+                response = self._frame(frame)
+                if response is None: continue
+                frames += 1
+
+                # Which command is this a reply to?
+                for index in unanswered:
+                    if self._is_reply_to(response, commands[index]):
+                        unanswered.remove(index)
+                        replies[index] = response
+                        break
+                else:
+                    index = None
 
-            # Process the response code.
-            self._parse_response(response)
+                if response[0] == '11':
+                    if index is not None and error is None:
+                        try:
+                            self._raise_for_error(response, *commands[index])
+                        except (KeyError, ValueError), exception:
+                            error = exception
+                    continue
 
-        # No exceptions encountered; return a human-readable string
-        return response
+                self._parse_response(response)
+
+        span.set('bytes_written', written)
+        span.set('wait_time', time() - started)
+        span.set('frames_parsed', frames)
+        span.set('timed_out', bool(unanswered))
+        span.set('unanswered', len(unanswered))
+        if error is not None: raise error
+        return replies
+
+    def _powering_on(self, command):
+        """
+        Returns True if command, a (group, number[, data]) tuple, switches on
+        an amplifier which isn't known to be on already; it won't answer
+        anything else until it has warmed up (see _wait_until_ready).
+        """
+        return tuple([str(part) for part in command
+                      if part is not None]) == ('1', '01', '1') and \
+               not self.__state['power_state']
+
+    def _warm_up(self):
+        """
+        Notes that the amplifier has just been switched on, and won't answer
+        for a while.
+        """
+        self.__warming = time()
+        self.__next_probe = self.__warming
+        self.__probe_interval = self.ready_probe_intervals[0]
+
+    def _probe_due(self):
+        """
+        Returns True if it's time to probe a warming-up amplifier again,
+        scheduling the probe after (with exponential backoff).
+        """
+        now = time()
+        if now < self.__next_probe: return False
+        self.__next_probe = now + self.__probe_interval
+        self.__probe_interval = min(self.__probe_interval * 2,
+                                    self.ready_probe_intervals[1])
+        return True
+
+    def _wait_until_ready(self):
+        """
+        After power on, holds up the caller until the amplifier answers a
+        probe (a request for the protocol version), probing with exponential
+        backoff. Raises IOError if the amplifier doesn't answer within
+        power_on_timeout seconds.
+        """
+        probe = self._encode('5', '02')
+        with self._span('_wait_until_ready') as span:
+            try:
+                probes = 0
+                while True:
+                    if self._probe_due():
+                        probes += 1
+                        if self.pacer is not None: self.pacer.pace()
+                        self.__conn.write(probe)
+                        self.__conn.flush()
+                    answered = False
+                    for frame in self.__conn.read(50).split('\r'):
+                        response = self._frame(frame)
+                        if response is None or response[0] == '11': continue
+                        self._parse_response(response)
+                        if response[:2] == ('10', '02'): answered = True
+                    if answered: break
+                    if time() - self.__warming > self.power_on_timeout:
+                        raise IOError("No answer from the amplifier %ss "
+                                      "after power on" % \
+                                      self.power_on_timeout)
+                    sleep(max(0, self.__next_probe - time()))
+            finally:
+                span.set('probes', probes)
+                self.__warming = None
+
+    def _drain(self):
+        """
+        Reads until the line goes quiet, applying any replies which arrive
+        (such as late replies to commands already given up on).
+        """
+        buffered = ''
+        while True:
+            chunk = self.__conn.read(50)
+            if not chunk: break
+            buffered += chunk
+        for frame in buffered.split('\r'):
+            response = self._frame(frame)
+            if response is not None and response[0] != '11':
+                self._parse_response(response)
 
     def _parse_response(self, response):
         """
         Parses the response from the amplifier, modifying internal state
         accordingly.
 
-        Yes, this is a very long method but it is easier to read than some
-        strange mapping format.
+        Replies which simply set one state field are decoded as the protocol
+        table says (see protocol.py); a value the decoder doesn't understand
+        is ignored. The rest (see hand_parsed_replies, and the per-input
+        sources) need more than that, and are handled here by hand.
         """
+        state = self.__state
+        if len(response) < 2: return
+
+        spec = protocol.by_reply.get(response[:2])
+        if spec is not None and spec.field is not None and \
+           response[:2] not in self.hand_parsed_replies:
+            try:
+                value = spec.decode(len(response) > 2 and response[2] or '')
+            except (KeyError, ValueError):
+                return
+            state[spec.field] = value
+            return
+
         # Amplifier commands
         if response[0] == '6':
 
-            # Power state
-            if response[1] == '01':
-                if response[2] == '0': self.__power_state = False
-                elif response[2] == '1': self.__power_state = True
-
             # Volume
-            if response[1] in ['02', '03']: self.__volume = int(response[2])
+            if response[1] in ['02', '03']:
+                volume = self._level(response[2])
+                self._stepped('volume', response[1] == '02', volume)
+                state['volume'] = volume
 
             # Bass
-            if response[1] in ['04', '05']: self.__bass = int(response[2])
+            if response[1] in ['04', '05']:
+                bass = self._level(response[2])
+                self._stepped('bass', response[1] == '04', bass)
+                state['bass'] = bass
 
             # Treble
-            if response[1] in ['06', '07']: self.__treble = int(response[2])
-
-            # Subwoofer (on/off)
-            if response[1] == '08': self.__subwoofer = True
-            elif response[1] == '09': self.__subwoofer = False
-
-            # LFE trim; values are from 0 to -10dB.
-            if response[1] == '10': self.__lfe_trim = -1 * int(response[2])
-
-            # Mute
-            if response[1] == '11':
-                if response[2] == '1': self.__mute_state = True
-                elif response[2] == '0': self.__mute_state = False
-
-            # Dynamic Range (store as float)
-            if response[1] == '12':
-                if response[2] == '0': self.__dynamic_range = 0.0
-                elif response[2] == '1': self.__dynamic_range = 0.25
-                elif response[2] == '2': self.__dynamic_range = 0.5
-                elif response[2] == '3': self.__dynamic_range = 0.75
-                elif response[2] == '4': self.__dynamic_range = 1.0
-
-            # OSD
-            if response[1] == '13': self.__osd_on = True
-            if response[1] == '14': self.__osd_on = False
+            if response[1] in ['06', '07']:
+                treble = self._level(response[2])
+                self._stepped('treble', response[1] == '06', treble)
+                state['treble'] = treble
 
             # Lip sync
-            if response[1] in ['20', '21']: self.__lip_sync = int(response[2])
+            if response[1] in ['20', '21']:
+                lip_sync = self._level(response[2])
+                self._stepped('lip_sync', response[1] == '21', lip_sync)
+                state['lip_sync'] = lip_sync
 
         # Source commands
         if response[0] == '7':
 
-            # Input selection
-            if response[1] == '01': self.__active_input = response[2]
-
             # Audio source
-            if response[1] == '04' and self.__active_input is not None:
-                self.__audio_source_for_input[self.__active_input] = \
-                                                                response[2]
+            if response[1] == '04' and state['active_input'] is not None:
+                state.set_item('audio_source_for_input',
+                               state['active_input'], response[2])
 
             # Video source
-            if response[1] == '05' and self.__active_input is not None:
-                self.__video_source_for_input[self.__active_input] = \
-                                                                response[2]
+            if response[1] == '05' and state['active_input'] is not None:
+                state.set_item('video_source_for_input',
+                               state['active_input'], response[2])
 
         # Tuner commands
-        # TODO
-
-        # Audio processing commands
-        if response[0] == '9':
-
-            # Stereo mode
-            if response[1] == '01': self.__stereo_audio_mode = response[2]
-
-            # Digital processing mode
-            if response[1] in ['02', '04']:
-                self.__signal_processing_mode = response[2]
-
-            # Signal CODEC
-            if response[1] in ['03', '05']:
-                self.__signal_codec = response[2]
-
-
-        # Version commands
-        if response[0] == '10':
-
-            # Main software version
-            if response[1] == '01': self.__main_software_version = response[2]
-
-            # Protocol version
-            if response[1] == '02': self.__protocol_version = response[2]
+        if response[0] == '8':
+
+            # Preset selection; the preset index tells us where we are now.
+            if response[1] in ['01', '02', '03']:
+                state['tuner_preset'] = response[2]
+                if state['tuner_presets'] and \
+                   response[2] in state['tuner_presets']:
+                    frequency = state['tuner_presets'][response[2]]
+                    state['tuner_frequency'] = frequency
+                    state['tuner_band'] = self._tuner_band_for(frequency)
+                else:
+                    state['tuner_frequency'] = None
+
+            # Frequency; moving the frequency leaves the current preset.
+            if response[1] in ['04', '05', '07']:
+                frequency = response[2].strip()
+                band = self._tuner_band_for(frequency)
+                previous = state['tuner_frequency']
+                if response[1] in ['04', '05'] and previous is not None and \
+                   self._tuner_band_for(previous) == band:
+                    step = abs(float(frequency) - float(previous))
+                    if step: state.set_item('tuner_steps', band,
+                                            round(step, 2))
+                if response[1] != '07': state['tuner_preset'] = None
+                state['tuner_frequency'] = frequency
+                state['tuner_band'] = band
+
+            # Band
+            if response[1] == '06':
+                if response[2] != state['tuner_band']:
+                    state['tuner_frequency'] = None
+                    state['tuner_preset'] = None
+                state['tuner_band'] = response[2]
+
+            # Mono/stereo reception
+            if response[1] == '08': state['tuner_mode'] = response[2]
 
     def _set_value(self, set_level, set_pointer, increment_callback,
-                   decrement_callback, min, max):
+                   decrement_callback, min, max, control=None):
         """
         A private method for setting an internal value to an explicit value
         (as opposed to merely raising or lowering the value).
 
-        This
+        If control names one of the step_controls, the learned step model is
+        used to work out up front how many steps are needed (and the nearest
+        level that can actually be reached); the steps are then sent in one
+        burst. Any shortfall is made up one step at a time, as is everything
+        when the model can't help.
+
+        Returns the level reached: set_level, or if the control can't be set
+        to exactly that, the nearest level it steps to.
         """
         # Sanity checks
         if not isinstance(set_level, (int, long)):
@@ -318,39 +891,622 @@ class Azur650R(object):
         if set_level > max or set_level < min: raise ValueError("set_level " \
                         "must be a value between '%s' and '%s'" % (min, max))
 
-        # If no current value known, change it experimentally to find out.
+        with self._confirming():
+            # If no current value known, change it experimentally to find
+            # out.
+            reported = set_pointer is None
+            try:
+                if set_pointer is None: set_pointer = decrement_callback()
+            except CommandDataError:
+                set_pointer = increment_callback()
+            set_pointer = self._level(set_pointer)
+
+            # Plan the whole adjustment from the step model and send it at
+            # once.
+            plan = None
+            if control is not None:
+                plan = self._plan_steps(control, set_pointer, set_level, min,
+                                        max)
+            if plan is not None:
+                steps, reachable = plan
+                if steps:
+                    up_number, down_number, field = self.step_controls[control]
+                    if steps > 0: number = up_number
+                    else: number = down_number
+                    self._exchange([('1', number)] * abs(steps))
+                    set_pointer = self.__state[field]
+                    reported = True
+                # Done if the steps got there; with no steps to take, the
+                # current level is already the nearest that can be reached.
+                if set_pointer == reachable: return set_pointer
+
+            if set_level == set_pointer: return set_pointer # Already there
+
+            # Change the value one step at a time until it is correct. The
+            # level reported after each step decides the direction of the
+            # next, so a level which was changed on the amplifier itself is
+            # caught up with. Because not all levels increment in steps of 1
+            # unit, stop once a step goes past the target (or goes nowhere),
+            # as long as it was taken from a level we can trust: one the
+            # amplifier reported, or one the step led on from as expected.
+            while set_pointer != set_level:
+                ascending = set_level > set_pointer
+                if ascending: action = increment_callback
+                else: action = decrement_callback
+                expected = self._expected_step(control, ascending, set_pointer)
+                following = self._level(action())
+                trusted = reported or expected is None or following == expected
+                if not trusted:
+                    # Either the level had changed or the model is wrong;
+                    # without a reported level we can't learn which, but the
+                    # model shouldn't be relied on for this step again.
+                    self._forget_step(control, ascending, set_pointer)
+                past = (following - set_level) * (set_pointer - set_level) < 0
+                stuck = following == set_pointer
+                set_pointer = following
+                reported = True
+                if trusted and (past or stuck): break
+
+        return set_pointer
+
+    def _level(self, value):
+        """
+        Converts a level as reported by the amplifier (e.g. "+ 4", " 0" or
+        "- 4" for treble) to an integer.
+        """
+        if isinstance(value, (int, long)): return value
+        return int(value.replace(' ', ''))
+
+    @contextmanager
+    def _confirming(self):
+        """
+        Context manager around an operation (an exchange, or all the steps of
+        _set_value) within which each level the amplifier reports for the
+        step_controls is taken as confirmed, so that the step from it to the
+        next level reported can be learned. Levels known from before the
+        operation (which may have been changed on the amplifier since) are
+        never used for learning.
+        """
+        outermost = self.__confirmed is None
+        if outermost: self.__confirmed = {}
         try:
-            if set_pointer is None: set_pointer = decrement_callback()
-        except CommandDataError:
-            set_pointer = increment_callback()
-
-        # Does the value need to go up or down?
-        if set_level < set_pointer:
-            action = decrement_callback
-            ascending = False
-        elif set_level > set_pointer:
-            action = increment_callback
-            ascending = True
-        elif set_level == set_pointer: return # Current value is OK!
-
-        # Change the volume until it is correct.
-        while set_pointer != set_level:
-            # Because not all levels increment in steps of 1 unit, make sure
-            # we haven't overshot before executing.
-            if (ascending and set_pointer < set_level) or \
-               (not ascending and set_pointer > set_level):
-                set_pointer = int(action())
-            else:
+            yield
+        finally:
+            if outermost: self.__confirmed = None
+
+    def _stepped(self, control, ascending, level):
+        """
+        Notes the level reported after a step of a control; if the level
+        before it was confirmed in the same operation (see _confirming), the
+        step is recorded in the step model.
+        """
+        confirmed = self.__confirmed
+        if confirmed is None: return
+        self._record_step(control, ascending, confirmed.get(control), level)
+        confirmed[control] = level
+
+    def _record_step(self, control, ascending, before, after):
+        """
+        Notes an observed step of a control in the step model. Steps which
+        don't look like a single step (in the wrong direction, or too big,
+        e.g. because the level was changed on the amplifier in the meantime)
+        are ignored, and a step which isn't the usual size (e.g. because a
+        reply was lost in between) is only believed once it has been seen
+        step_agreement times in a row. A step which is believed replaces
+        whatever was known about that level before.
+        """
+        if before is None or before == after: return
+        if (after > before) != ascending or \
+           abs(after - before) > self.max_step_size: return
+        direction = ascending and 'up' or 'down'
+        model = self.__state['step_model'].get(control,
+                                               {'up': {}, 'down': {}})
+        key = (control, direction, str(before))
+        if model[direction].get(str(before)) == after:
+            self.__step_candidates.pop(key, None)
+            return
+
+        usual = self._usual_step(model[direction])
+        if usual is not None and abs(after - before) != usual:
+            seen, count = self.__step_candidates.get(key, (None, 0))
+            if seen != after: count = 0
+            if count + 1 < self.step_agreement:
+                self.__step_candidates[key] = (after, count + 1)
+                return
+        self.__step_candidates.pop(key, None)
+
+        # Replace rather than change the model, so subscribers see it change.
+        step_model = dict(self.__state['step_model'])
+        model = step_model[control] = {'up': dict(model['up']),
+                                       'down': dict(model['down'])}
+        model[direction][str(before)] = after
+        self.__state['step_model'] = step_model
+
+    def _forget_step(self, control, ascending, level):
+        """
+        Removes whatever the step model holds about the step up or down from
+        level, so that the usual step is assumed there until it is learned
+        again.
+        """
+        direction = ascending and 'up' or 'down'
+        model = self.__state['step_model'].get(control)
+        if model is None or str(level) not in model[direction]: return
+        step_model = dict(self.__state['step_model'])
+        model = step_model[control] = {'up': dict(model['up']),
+                                       'down': dict(model['down'])}
+        del model[direction][str(level)]
+        self.__state['step_model'] = step_model
+
+    def _usual_step(self, transitions):
+        """
+        Returns the most common step size among the transitions (levels to
+        the level the next step leads to) of one control and direction, or
+        None if there are none.
+        """
+        if not transitions: return None
+        sizes = {}
+        for before, after in transitions.items():
+            size = abs(after - int(before))
+            sizes[size] = sizes.get(size, 0) + 1
+        return sorted(sizes.items(), key=lambda item: -item[1])[0][0]
+
+    def _expected_step(self, control, ascending, level):
+        """
+        Returns the level the step model expects a step up or down from level
+        to lead to, or None if it can't say.
+        """
+        if control is None: return None
+        direction = ascending and 'up' or 'down'
+        model = self.__state['step_model'].get(control, {})
+        transitions = model.get(direction, {})
+        if str(level) in transitions: return transitions[str(level)]
+        usual = self._usual_step(transitions)
+        if usual is None: return None
+        return level + (ascending and usual or -usual)
+
+    def _plan_steps(self, control, current, target, min, max):
+        """
+        Uses the step model to work out how to get from current to (or as
+        close as possible to) target. Returns the number of steps (negative
+        for down) and the level they lead to, or None if nothing is known
+        about steps yet.
+
+        Levels which haven't been stepped from before are assumed to move by
+        the most common step seen in that direction (or, before any has been
+        seen, in the other direction).
+        """
+        if target == current: return 0, current
+        model = self.__state['step_model'].get(control,
+                                               {'up': {}, 'down': {}})
+        if target > current:
+            direction, sign, limit = 'up', 1, max
+        else:
+            direction, sign, limit = 'down', -1, min
+        transitions = model[direction]
+
+        # The usual step size, for levels we know nothing about.
+        usual = self._usual_step(transitions)
+        if usual is None:
+            usual = self._usual_step(model[sign > 0 and 'down' or 'up'])
+        if usual is None: return None
+
+        steps = 0
+        level = current
+        while (level - target) * sign < 0:
+            following = transitions.get(str(level), level + sign * usual)
+            if following == level or (following - limit) * sign > 0:
+                break # Can't go any further.
+            # Stop short if overshooting takes us further from the target.
+            if (following - target) * sign > 0 and \
+               abs(following - target) >= abs(level - target):
                 break
+            level = following
+            steps += 1
+        return sign * steps, level
 
+    def get_step_model(self):
+        """
+        Returns a copy of the learned step model: for each control, a mapping
+        of levels to the level the next step up or down leads to.
+        """
+        return json.loads(json.dumps(self.__state['step_model']))
 
-        return set_level
+    def save_step_model(self, path):
+        """
+        Saves the learned step model to a JSON file.
+        """
+        step_model = open(path, 'w')
+        try:
+            json.dump(self.__state['step_model'], step_model, indent=2,
+                      sort_keys=True)
+        finally:
+            step_model.close()
+
+    def load_step_model(self, path):
+        """
+        Loads a step model saved by save_step_model, merging it with what has
+        been learned so far (which takes precedence).
+        """
+        step_model = open(path)
+        try:
+            loaded = json.load(step_model)
+        finally:
+            step_model.close()
+        step_model = self.get_step_model()
+        for control, directions in loaded.items():
+            for direction, transitions in directions.items():
+                known = step_model.setdefault(control, {'up': {}, 'down': {}})
+                for before, after in transitions.items():
+                    known[direction].setdefault(str(before), after)
+        self.__state['step_model'] = step_model
+
+    def _tuner_band_for(self, frequency):
+        """
+        Returns the band ID for a frequency as reported by the amplifier; FM
+        frequencies are reported in MHz and AM frequencies in kHz, so the
+        magnitude alone is enough to tell them apart.
+        """
+        if float(frequency) < 200: return '0'
+        return '1'
+
+    def get_state(self):
+        """
+        Returns a snapshot of the known state of the amplifier as a
+        dictionary, suitable for storing between sessions. Nothing is queried
+        from the amplifier.
+        """
+        return self.__state.snapshot()
+
+    def set_state(self, state):
+        """
+        Restores a snapshot previously returned by get_state(). Unknown keys
+        are ignored, so snapshots from older versions can still be loaded.
+        """
+        self.__state.update(state)
+
+    def __getstate__(self):
+        """
+        Pickle support; the serial connection itself cannot be pickled, so
+        only the port and the state snapshot are stored.
+        """
+        return {'serial_port': self.__conn.port, 'state': self.get_state()}
+
+    def __setstate__(self, pickled):
+        """
+        Unpickle support; re-opens the serial port and restores the state.
+        """
+        self.__init__(pickled['serial_port'])
+        self.set_state(pickled['state'])
+
+    def enable_write_behind(self, error_callback=None, reply_timeout=1.0):
+        """
+        Switches to write-behind mode: commands are written without waiting
+        for the reply, and return a PendingReply handle (methods that return
+        a fixed value, such as show_osd(), return it immediately). Where the
+        outcome is obvious from the command (see protocol.Command.predict) the
+        state is updated straight away. Replies are read by a background
+        thread, which applies them to the state as usual.
+
+        If a command fails, or isn't confirmed within reply_timeout seconds,
+        the state it assumed is rolled back and error_callback (if any) is
+        called with the PendingReply handle; the exception is its error.
+        """
+        if self.__write_behind: return
+        if self.__shared is not None:
+            raise ValueError("Write-behind mode can't be used in shared mode")
+        self.__error_callback = error_callback
+        self.__reply_timeout = reply_timeout
+        self.__reader_error = None
+        self.__write_behind = True
+        self.__reader = threading.Thread(target=self._read_behind)
+        self.__reader.setDaemon(True)
+        self.__reader.start()
+
+    def disable_write_behind(self, timeout=None):
+        """
+        Waits for outstanding commands (see wait_pending) and returns to
+        normal, blocking, mode.
+        """
+        if not self.__write_behind: return
+        self.wait_pending(timeout)
+        self.__write_behind = False
+        self.__reader.join()
+        self.__reader = None
+
+    def enable_sharing(self, path=None, watch=None):
+        """
+        Switches to shared mode, for when several processes use the same
+        amplifier (see shared.py): each exchange is made holding an advisory
+        lock on path + '.lock', and the state is shared through the
+        memory-mapped file path + '.state', so every process sees what the
+        others have learnt and a new process starts with it. By default the
+        files are kept in a directory of the user's own (see
+        shared.default_path), and only processes of the same user can share
+        them.
+
+        The shared state is loaded straight away, and from then on before
+        each exchange; processes which only read the state can instead have
+        it checked for changes every watch seconds. Write-behind mode can't
+        be used in shared mode.
+        """
+        if self.__shared is not None: return
+        if self.__write_behind:
+            raise ValueError("Shared mode can't be used in write-behind mode")
+        if path is None:
+            path = default_path(getattr(self.__conn, 'port', 'port'))
+        self.__shared = SharedSession(self.__state, path, watch)
+
+    def disable_sharing(self):
+        """
+        Leaves shared mode; the state is kept, but no longer shared.
+        """
+        if self.__shared is None: return
+        self.__shared.close()
+        self.__shared = None
+
+    def enable_elision(self, freshness=30.0, fields=None):
+        """
+        Skips sending idempotent commands (such as mute(), sub_on() or
+        input_select()) whose effect is already in the state, provided the
+        amplifier reported it within the last freshness seconds; fields may
+        map state fields to a freshness of their own (0 to always send). A
+        skipped command returns the reply it would have got. Use forced() to
+        send commands regardless.
+
+        Only commands sent one at a time are skipped, not those sent
+        together (e.g. by configure_inputs).
+        """
+        self.__elision = (freshness, dict(fields or {}))
+
+    def disable_elision(self):
+        """
+        Sends every command again.
+        """
+        self.__elision = None
+
+    @contextmanager
+    def forced(self):
+        """
+        Context manager in which commands are always sent, even if elision
+        is enabled:
+
+            with amp.forced():
+                amp.mute()
+        """
+        self.__forced += 1
+        try:
+            yield self
+        finally:
+            self.__forced -= 1
+
+    def wait_pending(self, timeout=None):
+        """
+        Waits until every command sent in write-behind mode has been
+        confirmed or has failed; returns False if some are still outstanding
+        after timeout seconds.
+        """
+        if timeout is not None: deadline = time() + timeout
+        while True:
+            with self.__pending_lock:
+                if self.__held: handle = self.__held[-1][0]
+                elif self.__pending: handle = self.__pending[-1]
+                else: return True
+            if timeout is None:
+                handle.join()
+            else:
+                remaining = deadline - time()
+                if remaining <= 0: return False
+                handle.join(remaining)
+
+    def _submit(self, command_group, command_number, command_data=None):
+        """
+        Sends a command in write-behind mode, and returns its PendingReply.
+        """
+        command = tuple([str(part) for part in
+                         (command_group, command_number, command_data)
+                         if part is not None])
+
+        # Keep within the pacer's limits; see pacing.py.
+        if self.pacer is not None:
+            while True:
+                with self.__pending_lock:
+                    if self.pacer.allows(len(self.__pending)): break
+                    oldest = self.__pending[0]
+                oldest.join(self.__reply_timeout)
+            self.pacer.pace()
+
+        handle = PendingReply(command)
+
+        with self.__pending_lock:
+            if self.__reader_error is not None:
+                raise IOError("Write-behind mode has stopped reading replies: "
+                              "%s" % self.__reader_error)
+
+            powering_on = self._powering_on(command)
+
+            # Assume the command works, noting what it changes.
+            spec = protocol.by_code.get((command[0], command[1]))
+            if spec is not None and spec.predict is not None:
+                data = spec.predict(len(command) > 2 and command[2] or None)
+                before = self.get_state()
+                self._parse_response(spec.reply + (data,))
+                handle.optimistic = self._state_changes(before,
+                                                        self.get_state())
+
+            # Hold the command if the amplifier is still warming up.
+            frame = self._encode(*command)
+            if self.__warming is not None:
+                self.__held.append((handle, frame))
+                return handle
+
+            with self._span('_submit', command=','.join(command)) as span:
+                self.__conn.write(frame)
+                self.__conn.flush()
+                span.set('bytes_written', len(frame))
+            self.__pending.append(handle)
+            if powering_on: self._warm_up()
+        return handle
+
+    def _state_changes(self, before, after):
+        """
+        Compares two state snapshots; returns a dictionary mapping each field
+        which changed (or (field, key) for the per-input dictionaries) to
+        its (before, after) values.
+        """
+        changes = {}
+        for name, value in after.items():
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    if before[name].get(key) != item:
+                        changes[(name, key)] = (before[name].get(key), item)
+            elif before[name] != value:
+                changes[name] = (before[name], value)
+        return changes
+
+    def _roll_back(self, handle):
+        """
+        Undoes the state assumed for a failed write-behind command, unless
+        something has changed it since.
+        """
+        state = self.__state
+        for field, (before, after) in handle.optimistic.items():
+            if isinstance(field, tuple):
+                if state[field[0]].get(field[1]) == after:
+                    state.set_item(field[0], field[1], before)
+            elif state[field] == after:
+                state[field] = before
+
+    def _read_behind(self):
+        """
+        Body of the reader thread for write-behind mode; matches replies to
+        pending commands, oldest first.
+
+        While the amplifier is warming up after power on, this thread also
+        probes it, and once it answers sends the commands held meanwhile, in
+        order. Error replies while warming up are taken to be to the probes.
+
+        Should the thread stop (e.g. because the port has gone), every
+        command still pending or held fails, and so does anything sent
+        afterwards.
+        """
+        try:
+            buffered = ''
+            while self.__write_behind or self.__pending or self.__held:
+                buffered = self._read_behind_once(buffered)
+        except Exception, exception:
+            with self.__pending_lock:
+                self.__reader_error = exception
+                failed = self.__pending + [handle for handle, frame in
+                                           self.__held]
+                self.__pending = []
+                self.__held = []
+                for handle in failed:
+                    self._roll_back(handle)
+                    handle._resolve(error=IOError("Stopped reading replies: "
+                                                  "%s" % exception))
+            if self.__error_callback is not None:
+                for handle in failed: self.__error_callback(handle)
+            raise
+
+    def _read_behind_once(self, buffered):
+        """
+        One round of the reader thread: probes if due, reads what has
+        arrived and applies every complete frame, then gives up on commands
+        which have waited too long. Returns what is left of the last
+        (incomplete) frame.
+        """
+        if self.__warming is not None and self._probe_due():
+            self.__conn.write(self._encode('5', '02'))
+            self.__conn.flush()
+        chunk = self.__conn.read(50)
+        failed = []
+        with self.__pending_lock:
+            buffered += chunk
+            while '\r' in buffered:
+                frame, buffered = buffered.split('\r', 1)
+                response = self._frame(frame)
+                if response is None: continue # Damaged beyond use
+                try:
+                    self._apply_reply(response, failed)
+                except Exception:
+                    # A damaged reply; its command (if any) is left to time
+                    # out, and the reader carries on.
+                    traceback.print_exc(file=stderr)
+
+            # Give up on anything which has waited too long.
+            now = time()
+            for handle in list(self.__pending):
+                if now - handle.sent > self.__reply_timeout:
+                    self.__pending.remove(handle)
+                    self._roll_back(handle)
+                    handle._resolve(error=IOError("No reply to '%s'" % \
+                                            ','.join(handle.command)))
+                    failed.append(handle)
+
+            # Once warmed up, send what was held (or give up on it).
+            if self.__warming is not None and \
+               now - self.__warming > self.power_on_timeout:
+                self.__warming = None
+                for handle, frame in self.__held:
+                    self._roll_back(handle)
+                    handle._resolve(error=IOError("No answer from the "
+                                                  "amplifier after power "
+                                                  "on"))
+                    failed.append(handle)
+                self.__held = []
+            if self.__warming is None:
+                while self.__held:
+                    handle, frame = self.__held.pop(0)
+                    self.__pending.append(handle)
+                    if self.pacer is not None: self.pacer.pace()
+                    self.__conn.write(frame)
+                    self.__conn.flush()
+                    handle.sent = time()
+
+        if self.__error_callback is not None:
+            for handle in failed: self.__error_callback(handle)
+        return buffered
+
+    def _apply_reply(self, response, failed):
+        """
+        Applies one reply read in write-behind mode, resolving the pending
+        command it answers (if any); commands which failed are added to
+        failed. Called holding the pending lock.
+        """
+        if self.__warming is not None:
+            if response[0] == '11': return
+            if response[:2] == ('10', '02'): self.__warming = None
+
+        for handle in self.__pending:
+            if self._is_reply_to(response, handle.command): break
+        else:
+            handle = None
+
+        if response[0] == '11':
+            if handle is None: return
+            self.__pending.remove(handle)
+            try:
+                self._raise_for_error(response, *handle.command)
+            except (KeyError, ValueError), exception:
+                self._roll_back(handle)
+                handle._resolve(response, exception)
+                failed.append(handle)
+            return
+
+        # Parsed before the command is taken off the pending list, so that
+        # if the reply is too damaged to parse the command times out.
+        self._parse_response(response)
+        if handle is not None:
+            self.__pending.remove(handle)
+            handle._resolve(response)
 
     def disconnect(self):
         """
         Closes the connection to the amplifier by closing the serial port.
         No further communication will be possible until connect() is called.
         """
+        self.disable_write_behind()
+        self.disable_sharing()
         self.__conn.close()
 
     def connect(self):
@@ -359,6 +1515,30 @@ class Azur650R(object):
         """
         self.__conn.open()
 
+    def command(self, name, data=None):
+        """
+        Sends any command in the protocol table by name (see protocol.py),
+        e.g. command('osd_cursor_up') or command('mute', '01'), and returns
+        the reply as _cmd() does. Unlike the named methods, nothing is done
+        besides sending the command and applying its reply to the state.
+        """
+        spec = protocol.by_name.get(name)
+        if spec is None: raise KeyError("No command named '%s'" % name)
+        return self._cmd(spec.group, spec.number, data)
+
+    def run_macro(self, macro):
+        """
+        Sends a compiled macro (see macros.py) in a single write, or paced
+        if there is a pacer, and returns the replies; raises IOError if any
+        step didn't get the reply expected.
+        """
+        replies = self._exchange(macro.commands, macro.encoded)
+        unanswered = macro.unanswered(replies)
+        if unanswered:
+            raise IOError("Macro '%s' got no reply to: %s" % \
+                          (macro.name, ', '.join(unanswered)))
+        return replies
+
     # Group 1: Amplifier commands --------------------------------------------
 
     def power_on(self):
@@ -366,6 +1546,11 @@ class Azur650R(object):
         Turn the amplifier from 'standby' to 'on'. The amplifier replies with
         the currently-selected input, and a response that the power has been
         enabled.
+
+        The amplifier then takes a while to start answering commands; until
+        it does, commands are held up (or, in write-behind mode, held back)
+        rather than lost; see power_on_timeout. The same goes for switching
+        on by any other means, such as command('power', '1') or a macro.
         """
         return self._cmd('1', '01', '1')
 
@@ -393,10 +1578,12 @@ class Azur650R(object):
         measured in "-db", the same units as the amplifer. -90db is equivalent
         to muted, and 0db will destroy your speakers.
 
-        Unlike other methods, it returns only the volume you define.
+        Unlike other methods, it returns the volume as an integer: the level
+        reached, which is the one you define unless the amplifier can't be
+        stepped to exactly that.
         """
-        return self._set_value(level, self.__volume, self.volume_up,
-                               self.volume_down, -90, 0)
+        return self._set_value(level, self.__state['volume'], self.volume_up,
+                               self.volume_down, -90, 0, 'volume')
 
     def bass_up(self):
         """
@@ -413,10 +1600,11 @@ class Azur650R(object):
     def set_bass(self, level):
         """
         Sets the bass to the desired level; Acceptable values are from
-        between -10 and 10 (db).
+        between -10 and 10 (db). Returns the level reached, as set_volume
+        does.
         """
-        return self._set_value(level, self.__bass, self.bass_up,
-                               self.bass_down, -10, 10)
+        return self._set_value(level, self.__state['bass'], self.bass_up,
+                               self.bass_down, -10, 10, 'bass')
 
     def treble_up(self):
         """
@@ -424,7 +1612,7 @@ class Azur650R(object):
         a string) in format "+ 4", " 0", or "- 4" up to an integer of 10
         in 2-value increments.
         """
-        return int(self._cmd('1', '06')[2])
+        return self._level(self._cmd('1', '06')[2])
 
     def treble_down(self):
         """
@@ -432,14 +1620,16 @@ class Azur650R(object):
         a string) in format "+ 4", " 0", or "- 4" up to an integer of 10
         in 2-value increments.
         """
-        return int(self._cmd('1', '07')[2])
+        return self._level(self._cmd('1', '07')[2])
 
     def set_treble(self, level):
         """
-        Like set_bass, but for treble response.
+        Like set_bass, but for treble response. The treble moves in steps of
+        2, so an odd level ends up on the nearest even one (which is
+        returned) without a step past it and back.
         """
-        return self._set_value(level, self.__treble, self.treble_up,
-                               self.treble_down, -10, 10)
+        return self._set_value(level, self.__state['treble'], self.treble_up,
+                               self.treble_down, -10, 10, 'treble')
 
     def sub_on(self):
         """
@@ -484,6 +1674,16 @@ class Azur650R(object):
         result = self._cmd('1', '11', '00')
         return False
 
+    def set_mute(self, state):
+        """
+        Mutes (True) or unmutes (False) the audio output; returns the state.
+        Use this rather than mute(), which is hidden by the mute property.
+        """
+        if state:
+            result = self._cmd('1', '11', '01')
+            return True
+        return self.unmute()
+
     def show_osd(self):
         """
         Show the on-screen-display; returns True
@@ -540,6 +1740,16 @@ class Azur650R(object):
         """
         return int(self._cmd('1', '21')[2])
 
+    def set_lip_sync_delay(self, level):
+        """
+        Sets the lip sync delay to the desired level (0 to 200ms); the step
+        size is learned as the delay is changed, and the nearest reachable
+        level is used. Returns the level reached.
+        """
+        return self._set_value(level, self.__state['lip_sync'],
+                               self.lip_sync_increase, self.lip_sync_decrease,
+                               0, 200, 'lip_sync')
+
     # Group 2: Source Commands -----------------------------------------------
 
     def input_select(self, input_id):
@@ -628,14 +1838,15 @@ class Azur650R(object):
         digital ('01'), or HDMI ('02').
         """
         # Do we know what the current input actually is?
-        if self.__active_input is None:
+        if self.__state['active_input'] is None:
             self.input_select_next()
             self.input_select_previous()
 
         # Sanity checks
-        if self.__active_input not in self.__audio_source_for_input.keys():
+        if self.__state['active_input'] not in \
+           self.__state['audio_source_for_input'].keys():
             raise TypeError("Cannot set audio source for input '%s'" \
-                            % self.__active_input)
+                            % self.__state['active_input'])
         if isinstance(value, (int, long)):
             value = '0%s' % value
         if value not in ['00', '01', '02']:
@@ -649,14 +1860,15 @@ class Azur650R(object):
         component ('01'), composite ('02'), or HDMI ('03').
         """
         # Do we know what the current input actually is?
-        if self.__active_input is None:
+        if self.__state['active_input'] is None:
             self.input_select_next()
             self.input_select_previous()
 
         # Sanity checks
-        if self.__active_input not in self.__video_source_for_input.keys():
+        if self.__state['active_input'] not in \
+           self.__state['video_source_for_input'].keys():
             raise TypeError("Cannot set video source for input '%s'" \
-                            % self.__active_input)
+                            % self.__state['active_input'])
         if isinstance(value, (int, long)):
             value = '0%s' % value
         if value not in ['00', '01', '02', '03']:
@@ -664,9 +1876,244 @@ class Azur650R(object):
 
         return self._cmd('2', '05', value)
 
+    def configure_inputs(self, sources):
+        """
+        Sets the audio and video sources of several inputs at once; sources
+        maps input IDs to (audio source, video source) tuples, using the same
+        values as set_audio_source_for_input and set_video_source_for_input.
+        Either source may be None to leave it alone, e.g.:
+
+            amp.configure_inputs({'01': ('02', '03'), '07': ('01', None)})
+
+        Sources already known to be correct are skipped, and the remaining
+        commands are sent in one burst: the active input first, then the
+        others, then the original input is selected again. Returns a
+        dictionary of the inputs which were changed with their new sources.
+        """
+        state = self.__state
+
+        # Sanity checks, before anything is sent
+        changes = {}
+        for input_id, (audio, video) in sources.items():
+            if input_id not in state['audio_source_for_input'].keys():
+                raise TypeError("Cannot set sources for input '%s'" \
+                                % input_id)
+            commands = []
+            if audio is not None:
+                if isinstance(audio, (int, long)):
+                    audio = '0%s' % audio
+                if audio not in ['00', '01', '02']:
+                    raise ValueError("Audio source must be '00', '01', "
+                                     "or '02'")
+                known = state['audio_source_for_input'][input_id]
+                if known is None or int(known) != int(audio):
+                    commands.append(('2', '04', audio))
+            if video is not None:
+                if isinstance(video, (int, long)):
+                    video = '0%s' % video
+                if video not in ['00', '01', '02', '03']:
+                    raise ValueError("Video source must be '00', '01', '02', "
+                                     "or '03'")
+                known = state['video_source_for_input'][input_id]
+                if known is None or int(known) != int(video):
+                    commands.append(('2', '05', video))
+            if commands: changes[input_id] = commands
+        if not changes: return {}
+
+        # We need to know the current input to put it back afterwards.
+        if state['active_input'] is None:
+            self.input_select_next()
+            self.input_select_previous()
+        original_input = state['active_input']
+
+        # Plan the sequence, starting with the input we're already on.
+        commands = []
+        selected = original_input
+        for input_id in sorted(changes.keys(),
+                               key=lambda input_id: input_id != selected):
+            if input_id != selected:
+                commands.append(('2', '01', input_id))
+                selected = input_id
+            commands.extend(changes[input_id])
+        if selected != original_input:
+            commands.append(('2', '01', original_input))
+        self._exchange(commands)
+
+        # Check that everything was applied.
+        result = {}
+        for input_id, input_commands in changes.items():
+            for command_group, command_number, value in input_commands:
+                if command_number == '04':
+                    known = state['audio_source_for_input'][input_id]
+                else:
+                    known = state['video_source_for_input'][input_id]
+                if known is None or int(known) != int(value):
+                    raise IOError("Source for input '%s' was not set" \
+                                  % input_id)
+            result[input_id] = (state['audio_source_for_input'][input_id],
+                                state['video_source_for_input'][input_id])
+        return result
+
     # Group 3: Tuner Commands ------------------------------------------------
 
-    # TODO
+    def tuner_preset_up(self):
+        """
+        Selects the next tuner preset; returns the preset number as a string.
+        """
+        return self._cmd('3', '01')[2]
+
+    def tuner_preset_down(self):
+        """
+        Selects the previous tuner preset; returns the preset number as a
+        string.
+        """
+        return self._cmd('3', '02')[2]
+
+    def tuner_select_preset(self, preset):
+        """
+        Selects a tuner preset directly by its number (1 to 30); returns the
+        preset number as a string.
+        """
+        if isinstance(preset, (str, unicode)):
+            preset = int(preset)
+        if preset < 1 or preset > self.tuner_preset_count:
+            raise ValueError("preset must be a value between '1' and '%s'" \
+                             % self.tuner_preset_count)
+        return self._cmd('3', '03', '%02d' % preset)[2]
+
+    def tuner_frequency_up(self):
+        """
+        Tunes up by one step; returns the frequency as a string (MHz for FM,
+        kHz for AM).
+        """
+        return self._cmd('3', '04')[2].strip()
+
+    def tuner_frequency_down(self):
+        """
+        Tunes down by one step; returns the frequency as a string (MHz for FM,
+        kHz for AM).
+        """
+        return self._cmd('3', '05')[2].strip()
+
+    def tuner_select_band(self, band):
+        """
+        Selects the tuner band by ID ('0' or '1') or name ('FM' or 'AM').
+        """
+        for band_id, band_name in self.tuner_bands.items():
+            if band in (band_id, band_name): break
+        else:
+            raise ValueError("Tuner band must be '0' (FM) or '1' (AM)")
+        return self._cmd('3', '06', '0%s' % band_id)[2]
+
+    def get_tuner_frequency(self):
+        """
+        Returns the frequency the tuner is tuned to. This queries the device
+        and does not depend on the internal register.
+        """
+        return self._cmd('3', '07')[2].strip()
+
+    def tuner_mono(self):
+        """
+        Switches FM reception to mono; returns False.
+        """
+        result = self._cmd('3', '08', '00')
+        return False
+
+    def tuner_stereo(self):
+        """
+        Switches FM reception to stereo; returns True.
+        """
+        result = self._cmd('3', '08', '01')
+        return True
+
+    def scan_tuner_presets(self):
+        """
+        Builds the preset index by visiting every preset and noting its
+        frequency, then returns to the preset that was selected beforehand.
+        Empty presets (rejected by the amplifier) are left out.
+
+        This is slow (two commands per preset) but only needs doing once; the
+        index is part of the state snapshot, so store it with get_state() and
+        it will be used by tune() from then on. Re-scan after changing the
+        presets on the amplifier itself.
+        """
+        original_preset = self.__state['tuner_preset']
+        original_frequency = self.__state['tuner_frequency']
+
+        # Discard the old index first, so _parse_response doesn't use it.
+        self.__state['tuner_presets'] = None
+        presets = {}
+        for preset in range(1, self.tuner_preset_count + 1):
+            try:
+                self.tuner_select_preset(preset)
+            except CommandDataError:
+                continue
+            presets['%02d' % preset] = self.get_tuner_frequency()
+        self.__state['tuner_presets'] = presets
+
+        # Put things back the way they were.
+        if original_preset in presets:
+            self.tuner_select_preset(original_preset)
+        elif original_frequency is not None:
+            self.tune(original_frequency)
+
+        return dict(presets)
+
+    def _tuner_steps_between(self, start, target, band):
+        """
+        Returns the number of frequency up (positive) or down (negative)
+        commands required to move from the start to the target frequency.
+        """
+        step = self.__state['tuner_steps'].get(band) or \
+               self.tuner_frequency_steps[band]
+        return int(round((float(target) - float(start)) / step))
+
+    def tune(self, frequency):
+        """
+        Tunes to the given frequency (MHz for FM, kHz for AM; the band is
+        implied) using as few commands as possible. If the frequency is held
+        in a preset it is selected directly; otherwise the tuner is stepped
+        from whichever is closer, the current frequency or the nearest preset
+        in the preset index, with the steps sent in one burst. Returns the
+        frequency as a string; raises ValueError if the tuner doesn't end up
+        on it (e.g. because it isn't a whole number of steps away).
+        """
+        state = self.__state
+        target = float(frequency)
+        band = self._tuner_band_for(target)
+
+        # Candidate starting points: (number of commands, preset to select,
+        # frequency to step from).
+        plans = []
+        if state['tuner_frequency'] is not None and \
+           state['tuner_band'] == band:
+            steps = self._tuner_steps_between(state['tuner_frequency'], target,
+                                              band)
+            plans.append((abs(steps), None, state['tuner_frequency']))
+        for preset, preset_frequency in (state['tuner_presets'] or {}).items():
+            if self._tuner_band_for(preset_frequency) != band: continue
+            steps = self._tuner_steps_between(preset_frequency, target, band)
+            plans.append((abs(steps) + 1, preset, preset_frequency))
+
+        if plans:
+            cost, preset, start = min(plans)
+            if preset is not None: self.tuner_select_preset(preset)
+        else:
+            # Nothing to go on; change band if needed, then ask.
+            if state['tuner_band'] != band: self.tuner_select_band(band)
+            start = self.get_tuner_frequency()
+
+        # Step the rest of the way, in one burst, then check where we are.
+        steps = self._tuner_steps_between(start, target, band)
+        if steps:
+            self._exchange([('3', steps > 0 and '04' or '05')] * abs(steps))
+        reached = state['tuner_frequency']
+        if reached is None or float(reached) != target:
+            reached = self.get_tuner_frequency()
+        if float(reached) != target:
+            raise ValueError("Could not tune to '%s' (tuned to '%s')" % \
+                             (frequency, reached))
+        return reached
 
     # Group 4: Audio Processing Commands -------------------------------------
 
@@ -712,6 +2159,82 @@ class Azur650R(object):
         """
         return self._cmd('4', '05')[2].strip()
 
+    def _learn_cycle(self, next_number, start):
+        """
+        Steps through a cycle (DSP modes or CODECs) one command at a time
+        until it returns to the start, and returns the values in cycle order
+        beginning with start. The amplifier is left where it was.
+        """
+        cycle = [start]
+        while True:
+            value = self._cmd('4', next_number)[2].strip()
+            if value == start: return cycle
+            if value in cycle or len(cycle) >= self.max_cycle_length:
+                raise ValueError("Cycle from '%s' does not return to its " \
+                                 "start: %s" % (start, ', '.join(cycle)))
+            cycle.append(value)
+
+    def _set_cycled_value(self, target, next_number, get_number, field,
+                          key_for):
+        """
+        A private method for selecting a value which can only be cycled
+        through (DSP modes and CODECs), rather than set directly.
+
+        The cycle order is learned once per key (see key_for, which is given
+        the current values of both the DSP mode and CODEC) and cached in the
+        named state field; after that, the right number of 'next' commands is
+        sent in one burst and only the final value is checked. If the check
+        fails, the cycle is learned again and the attempt repeated once.
+        """
+        target = target.strip()
+        for attempt in range(2):
+            mode, codec = self._exchange([('4', '04'), ('4', '05')])
+            if mode is None or codec is None:
+                raise IOError("No reply from the amplifier")
+            if get_number == '04': current = mode[2].strip()
+            else: current = codec[2].strip()
+            if current == target: return current
+
+            key = key_for(mode[2].strip(), codec[2].strip())
+            cycle = self.__state[field].get(key)
+            if attempt or cycle is None or current not in cycle:
+                cycle = self._learn_cycle(next_number, current)
+                self.__state.set_item(field, key, cycle)
+            if target not in cycle:
+                raise ValueError("'%s' is not reachable from '%s' (cycle: %s)"
+                                 % (target, current, ', '.join(cycle)))
+
+            steps = (cycle.index(target) - cycle.index(current)) % len(cycle)
+            replies = self._exchange([('4', next_number)] * steps)
+            if replies[-1] is not None and replies[-1][2].strip() == target:
+                return target
+            if self._cmd('4', get_number)[2].strip() == target:
+                return target
+
+        raise ValueError("Could not select '%s'" % target)
+
+    def set_digital_processing_mode(self, mode):
+        """
+        Selects a DSP mode by name (as returned by get_digital_processing_mode)
+        by cycling through the modes. The modes on offer depend on the input
+        and the incoming signal, so their order is learned (and cached) for
+        each input and CODEC the first time it is needed. Raises ValueError
+        if the mode isn't available.
+        """
+        key_for = lambda mode, codec: '%s/%s' % (self.__state['active_input'],
+                                                 codec)
+        return self._set_cycled_value(mode, '02', '04',
+                                      'processing_mode_cycles', key_for)
+
+    def set_codec(self, codec):
+        """
+        Like set_digital_processing_mode, but for the CODEC; the order is
+        learned for each input.
+        """
+        key_for = lambda mode, codec: '%s' % self.__state['active_input']
+        return self._set_cycled_value(codec, '03', '05', 'codec_cycles',
+                                      key_for)
+
     # Group 5: Version Commands ----------------------------------------------
 
     def get_main_software_version(self):
@@ -728,56 +2251,93 @@ class Azur650R(object):
         return self._cmd('5', '02')[2]
 
     @property
-    def power(self): return self.__power_state
+    def state(self):
+        """
+        The StateStore holding the amplifier state; subscribe to it to be
+        told about changes.
+        """
+        return self.__state
+
+    @property
+    def power(self): return self.__state['power_state']
 
     @property
-    def volume(self): return self.__volume
+    def volume(self): return self.__state['volume']
 
     @property
-    def bass(self): return self.__bass
+    def bass(self): return self.__state['bass']
 
     @property
-    def treble(self): return self.__treble
+    def treble(self): return self.__state['treble']
 
     @property
-    def subwoofer(self): return self.__subwoofer
+    def subwoofer(self): return self.__state['subwoofer']
 
     @property
-    def lfe_trim(self): return self.__lfe_trim
+    def lfe_trim(self): return self.__state['lfe_trim']
 
     @property
-    def mute(self): return self.__mute_state
+    def mute(self): return self.__state['mute_state']
 
     @property
-    def dynamic_range(self): return self.__dynamic_range
+    def dynamic_range(self): return self.__state['dynamic_range']
 
     @property
-    def osd(self): return self.__osd_on
+    def osd(self): return self.__state['osd_on']
 
     @property
-    def lip_sync_delay(self): return self.__lip_sync
+    def lip_sync_delay(self): return self.__state['lip_sync']
 
     @property
     def active_input(self):
-        source_id = self.__active_input
+        source_id = self.__state['active_input']
         source_name = self.input_names.get(source_id)
         return source_id, source_name
 
     @property
     def audio_source_for_input(self):
-        source_id = self.__audio_source_for_input.get(self.__active_input)
+        source_id = self.__state['audio_source_for_input'].get(
+                                                self.__state['active_input'])
         source_name = self.audio_input_source.get(source_id)
         return source_id, source_name
 
     @property
     def video_source_for_input(self):
-        source_id = self.__video_source_for_input.get(self.__active_input)
+        source_id = self.__state['video_source_for_input'].get(
+                                                self.__state['active_input'])
         source_name = self.video_input_source.get(source_id)
         return source_id, source_name
 
+    @property
+    def tuner_active(self):
+        return self.__state['active_input'] in self.tuner_inputs
+
+    @property
+    def tuner_band(self):
+        band_id = self.__state['tuner_band']
+        band_name = self.tuner_bands.get(band_id)
+        return band_id, band_name
+
+    @property
+    def tuner_frequency(self): return self.__state['tuner_frequency']
+
+    @property
+    def tuner_preset(self): return self.__state['tuner_preset']
+
+    @property
+    def tuner_mode(self):
+        mode_id = self.__state['tuner_mode']
+        mode_name = self.tuner_modes.get(mode_id)
+        return mode_id, mode_name
+
+    @property
+    def tuner_presets(self):
+        if self.__state['tuner_presets'] is None: return None
+        return dict(self.__state['tuner_presets'])
+
     @property
     def stereo_audio_mode(self):
-        mode_id = self.__stereo_audio_mode
+        mode_id = self.__state['stereo_audio_mode']
         mode_name = self.stereo_audio_modes.get(mode_id)
         return mode_id, mode_name
 
@@ -798,3 +2358,12 @@ class Azur650R(object):
         return self.get_protocol_version()
 
 
+# Presets are selected by number, '01' up to tuner_preset_count.
+protocol.by_name['tuner_select_preset'].data = tuple(
+    ['%02d' % preset for preset in range(1, Azur650R.tuner_preset_count + 1)])
+
+# Every public method is traced when the instance has a tracer; see tracing.
+for _name, _method in Azur650R.__dict__.items():
+    if not _name.startswith('_') and isinstance(_method, FunctionType):
+        setattr(Azur650R, _name, traced(_method))
+del _name, _method
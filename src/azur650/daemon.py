@@ -0,0 +1,238 @@
+"""
+A resident daemon which keeps the serial port (and the amplifier state) open
+between invocations, so short-lived clients such as the azur650 command don't
+pay for opening the port and re-learning state every time.
+
+The daemon listens on a UNIX socket. Each request is a single line of JSON,
+e.g. {"method": "set_volume", "args": [-30]}, and each reply is a single line
+of JSON with either a "result" or an "error" (with the exception "type").
+The amplifier commands and read-only properties listed below are available;
+anything else (such as reading or writing files, or changing how the daemon
+talks to the amplifier) is left to the process which owns the port.
+
+The socket is kept in a directory of the user's own (see
+shared.private_directory) and is only open to the user, and clients check
+that it belongs to the user before connecting, so no one else can stand in
+for the daemon.
+"""
+
+# Python modules
+import errno
+import json
+import os
+import signal
+import socket
+import SocketServer
+import stat
+import sys
+import threading
+
+# Local modules
+from shared import private_directory
+
+
+def default_socket():
+    """
+    Returns the path of the daemon's socket unless another is given:
+    $AZUR650_SOCKET if set, otherwise azur650.sock in the user's own
+    directory (see shared.private_directory).
+    """
+    return os.environ.get('AZUR650_SOCKET') or \
+           os.path.join(private_directory(), 'azur650.sock')
+
+
+# The Azur650R methods clients may call.
+public_methods = frozenset([
+    # Amplifier commands
+    'power_on', 'power_off', 'volume_up', 'volume_down', 'set_volume',
+    'bass_up', 'bass_down', 'set_bass', 'treble_up', 'treble_down',
+    'set_treble', 'sub_on', 'sub_off', 'set_lfe_trim', 'unmute', 'set_mute',
+    'show_osd', 'hide_osd', 'osd_cursor_up', 'osd_cursor_down',
+    'osd_cursor_left', 'osd_cursor_right', 'osd_enter', 'lip_sync_decrease',
+    'lip_sync_increase', 'set_lip_sync_delay',
+
+    # Source commands
+    'input_select', 'select_tuner_input', 'select_bddvd_input',
+    'select_video1_input', 'select_video2_input', 'select_video3_input',
+    'select_rec1_input', 'select_aux_input', 'select_cd_input',
+    'select_rec2_input', 'select_direct_input', 'input_select_previous',
+    'input_select_next', 'set_audio_source_for_input',
+    'set_video_source_for_input', 'configure_inputs',
+
+    # Tuner commands
+    'tuner_preset_up', 'tuner_preset_down', 'tuner_select_preset',
+    'tuner_frequency_up', 'tuner_frequency_down', 'tuner_select_band',
+    'get_tuner_frequency', 'tuner_mono', 'tuner_stereo',
+    'scan_tuner_presets', 'tune',
+
+    # Audio processing commands
+    'set_stereo_mode_no_subwoofer', 'set_stereo_mode_use_subwoofer',
+    'next_digital_processing_mode', 'next_codec',
+    'get_digital_processing_mode', 'get_codec',
+    'set_digital_processing_mode', 'set_codec',
+
+    # Version commands
+    'get_main_software_version', 'get_protocol_version',
+
+    # Any command in the protocol table, and the known state
+    'command', 'get_state', 'get_step_model',
+])
+
+# The Azur650R properties clients may read.
+public_properties = frozenset([
+    'power', 'volume', 'bass', 'treble', 'subwoofer', 'lfe_trim', 'mute',
+    'dynamic_range', 'osd', 'lip_sync_delay', 'active_input',
+    'audio_source_for_input', 'video_source_for_input', 'tuner_active',
+    'tuner_band', 'tuner_frequency', 'tuner_preset', 'tuner_mode',
+    'tuner_presets', 'stereo_audio_mode', 'signal_processing_mode',
+    'signal_codec', 'main_software_version', 'protocol_version',
+])
+
+
+class DaemonError(Exception):
+    """
+    An error raised by the amplifier (or the daemon) while handling a request
+    """
+    def __init__(self, message, type=None):
+        Exception.__init__(self, message)
+        self.type = type
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Handles one client connection; a client may send any number of requests.
+    """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line: break
+            try:
+                request = json.loads(line)
+                reply = {'result': self.server.call(request['method'],
+                                                    request.get('args', []))}
+            except Exception, exception:
+                reply = {'error': str(exception),
+                         'type': exception.__class__.__name__}
+            self.wfile.write('%s\n' % json.dumps(reply))
+            self.wfile.flush()
+
+
+class Azur650Daemon(SocketServer.ThreadingMixIn,
+                    SocketServer.UnixStreamServer):
+    """
+    Serves a single Azur650R instance over a UNIX socket. Requests from
+    different clients are handled one at a time, as the serial port would
+    otherwise interleave their frames.
+    """
+    daemon_threads = True
+
+    def __init__(self, amplifier, socket_path=None):
+        if socket_path is None: socket_path = default_socket()
+        self.amplifier = amplifier
+        self.lock = threading.Lock()
+
+        # Clear up after a daemon which didn't exit cleanly, but don't steal
+        # the socket from one which is still running.
+        if os.path.exists(socket_path):
+            if DaemonClient.connect(socket_path) is not None:
+                raise IOError("A daemon is already listening on '%s'" \
+                              % socket_path)
+            os.unlink(socket_path)
+
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               RequestHandler)
+        os.chmod(socket_path, 0600)
+
+    def call(self, method, args):
+        """
+        Calls the named method (or reads the named property) of the
+        amplifier, returning the result; see public_methods and
+        public_properties.
+        """
+        if method not in public_methods and method not in public_properties:
+            raise AttributeError("Method '%s' is not available" % method)
+        # JSON strings arrive as unicode; the amplifier expects plain strings.
+        args = [str(arg) if isinstance(arg, unicode) else arg for arg in args]
+        with self.lock:
+            if method in public_properties:
+                if args: raise TypeError("'%s' takes no arguments" % method)
+                return getattr(self.amplifier, method)
+            return getattr(self.amplifier, method)(*args)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class DaemonClient(object):
+    """
+    Client for talking to a running Azur650Daemon. Use connect() to get an
+    instance; it returns None if no daemon is running.
+    """
+
+    def __init__(self, sock):
+        self.__sock = sock
+        self.__file = sock.makefile('r+b')
+
+    @classmethod
+    def connect(cls, socket_path=None, timeout=30):
+        """
+        Returns a client connected to the daemon, or None if there is no
+        daemon listening on socket_path (by default, see default_socket).
+        Raises IOError if the socket belongs to another user.
+        """
+        if socket_path is None: socket_path = default_socket()
+        try:
+            info = os.lstat(socket_path)
+        except OSError, exception:
+            if exception.errno == errno.ENOENT: return None
+            raise
+        if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+            raise IOError("'%s' isn't a socket of the user's own" % \
+                          socket_path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except socket.error, exception:
+            sock.close()
+            if exception.args[0] in (errno.ENOENT, errno.ECONNREFUSED):
+                return None
+            raise
+        return cls(sock)
+
+    def call(self, method, *args):
+        """
+        Calls a method of the amplifier in the daemon; returns the result or
+        raises DaemonError.
+        """
+        self.__file.write('%s\n' % json.dumps({'method': method,
+                                               'args': list(args)}))
+        self.__file.flush()
+        line = self.__file.readline()
+        if not line: raise DaemonError("The daemon closed the connection")
+        reply = json.loads(line)
+        if 'error' in reply: raise DaemonError(reply['error'], reply['type'])
+        return reply['result']
+
+    def close(self):
+        self.__file.close()
+        self.__sock.close()
+
+
+def serve(serial_port='/dev/ttyS0', socket_path=None):
+    """
+    Opens the serial port and serves it until interrupted.
+    """
+    from command import Azur650R
+    amplifier = Azur650R(serial_port)
+    server = Azur650Daemon(amplifier, socket_path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        amplifier.disconnect()
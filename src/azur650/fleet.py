@@ -0,0 +1,304 @@
+"""
+A compact, columnar table of the state of many amplifiers, for services which
+keep track of a whole fleet of them. Requires NumPy.
+
+Each amplifier is a row, and each of the commonly-queried state fields is a
+fixed-width NumPy column, so questions about the whole fleet are answered
+with vectorised operations rather than by visiting hundreds of objects:
+
+    table = FleetStateTable()
+    lounge = table.add_row('lounge')
+    ...
+    table.find(power_state=True, volume__gt=-20)
+
+Replies from many amplifiers can be applied in bulk (see apply_replies), and
+an Azur650R can keep its state in a row of the table instead of its own
+dictionary, by passing state_values=table.row(row_id) to the constructor.
+Fields without a column (the sources for each input, learned step sizes,
+etc.) are kept alongside, in a dictionary per row.
+
+A row used by an Azur650R is attached to its state store, and bulk updates of
+that row go through the store, so its subscribers and listeners (history,
+shared mode, the gateway...) see them as they would a reply.
+"""
+
+# Third-party modules
+import numpy
+
+# Local modules
+import protocol
+
+
+# Kinds of column, by the Python values they hold: boolean, integer, float,
+# or 'enum' for strings (stored as codes; see FleetStateTable.code).
+columns = (
+    ('power_state', 'bool', numpy.int8),
+    ('volume', 'int', numpy.int16),
+    ('bass', 'int', numpy.int8),
+    ('treble', 'int', numpy.int8),
+    ('subwoofer', 'bool', numpy.int8),
+    ('lfe_trim', 'int', numpy.int8),
+    ('mute_state', 'bool', numpy.int8),
+    ('dynamic_range', 'float', numpy.float32),
+    ('osd_on', 'bool', numpy.int8),
+    ('lip_sync', 'int', numpy.int16),
+    ('active_input', 'enum', numpy.int16),
+    ('tuner_band', 'enum', numpy.int16),
+    ('tuner_frequency', 'enum', numpy.int16),
+    ('tuner_preset', 'enum', numpy.int16),
+    ('stereo_audio_mode', 'enum', numpy.int16),
+    ('signal_processing_mode', 'enum', numpy.int16),
+    ('signal_codec', 'enum', numpy.int16),
+)
+
+def unknown_value(kind, dtype):
+    """
+    Returns the value stored for 'unknown' (None) in a kind of column; NaN
+    for float columns, otherwise the lowest value of the column type.
+    """
+    if kind == 'float': return numpy.nan
+    return numpy.iinfo(dtype).min
+
+# Replies which update a column: (reply group, number) -> (field, decoder),
+# taken from the protocol table. Any other replies are ignored by
+# apply_replies().
+column_names = frozenset([name for name, kind, dtype in columns])
+reply_columns = dict([(command.reply, (command.field, command.decode))
+                      for command in protocol.commands
+                      if command.field in column_names])
+
+# Query operators, as accepted by FleetStateTable.mask().
+operators = {
+    'eq': numpy.equal,
+    'ne': numpy.not_equal,
+    'lt': numpy.less,
+    'le': numpy.less_equal,
+    'gt': numpy.greater,
+    'ge': numpy.greater_equal,
+}
+
+
+class FleetStateTable(object):
+    """
+    Columnar state of many amplifiers, one row each.
+    """
+
+    def __init__(self, capacity=256):
+        """
+        Creates an empty table with room for capacity rows; it grows as
+        needed.
+        """
+        self.kinds = dict([(name, kind) for name, kind, dtype in columns])
+        self.names = [] # Row names
+        self.extras = [] # Dictionary of other fields, per row
+        self.stores = {} # Row -> StateStore of the Azur650R using it
+        self.__columns = {}
+        self.__unknown = {}
+        for name, kind, dtype in columns:
+            self.__unknown[name] = unknown_value(kind, dtype)
+            self.__columns[name] = numpy.empty(capacity, dtype=dtype)
+            self.__columns[name].fill(self.__unknown[name])
+        self.__codes = dict([(name, {}) for name, kind, dtype in columns
+                             if kind == 'enum'])
+        self.__strings = dict([(name, []) for name in self.__codes])
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_row(self, name=None):
+        """
+        Adds a row (with everything unknown) and returns its ID.
+        """
+        row = len(self.names)
+        capacity = len(self.__columns['volume'])
+        if row == capacity:
+            for column, values in self.__columns.items():
+                grown = numpy.empty(capacity * 2, dtype=values.dtype)
+                grown[:capacity] = values
+                grown[capacity:] = self.__unknown[column]
+                self.__columns[column] = grown
+        self.names.append(name)
+        self.extras.append({})
+        return row
+
+    def row(self, row):
+        """
+        Returns a FleetRow, a dictionary-like view of a row.
+        """
+        if row >= len(self.names): raise IndexError("No row %s" % row)
+        return FleetRow(self, row)
+
+    def attach(self, row, store):
+        """
+        Notes that a row holds the state of store (a state.StateStore), so
+        that update() and apply_replies() change it through the store.
+        """
+        self.stores[row] = store
+
+    def detach(self, row):
+        """
+        Stops updating a row through its store; see attach().
+        """
+        self.stores.pop(row, None)
+
+    def column(self, name):
+        """
+        Returns the raw column (as a NumPy array view) for the rows in use;
+        see code() for how strings and unknown values are stored.
+        """
+        return self.__columns[name][:len(self.names)]
+
+    def code(self, name, value, add=False):
+        """
+        Returns the number a value is stored as in the named column: 0 or 1
+        for booleans, and an arbitrary code for strings (None if the string
+        has never been stored, unless add is True).
+        """
+        if value is None: return self.__unknown[name]
+        kind = self.kinds[name]
+        if kind == 'bool': return int(bool(value))
+        if kind != 'enum': return value
+        code = self.__codes[name].get(value)
+        if code is None and add:
+            code = self.__codes[name][value] = len(self.__strings[name])
+            self.__strings[name].append(value)
+        return code
+
+    def known(self, name):
+        """
+        Returns a boolean array, True for rows where the field is known.
+        """
+        values = self.column(name)
+        if self.kinds[name] == 'float': return ~numpy.isnan(values)
+        return values != self.__unknown[name]
+
+    def get(self, row, name):
+        """
+        Returns the value of a field for one row, as Azur650R would hold it.
+        """
+        if name not in self.__columns: return self.extras[row].get(name)
+        value = self.__columns[name][row]
+        kind = self.kinds[name]
+        if kind == 'float':
+            if numpy.isnan(value): return None
+            return float(value)
+        if value == self.__unknown[name]: return None
+        if kind == 'bool': return bool(value)
+        if kind == 'enum': return self.__strings[name][value]
+        return int(value)
+
+    def set(self, row, name, value):
+        """
+        Sets the value of a field for one row, directly (even if the row is
+        attached to a store; this is how the store itself sets it).
+        """
+        if name not in self.__columns:
+            self.extras[row][name] = value
+        else:
+            self.__columns[name][row] = self.code(name, value, add=True)
+
+    def update(self, rows, name, values):
+        """
+        Sets a field for many rows at once; rows and values are sequences of
+        the same length. Rows attached to a store are set through it (one by
+        one), the rest all at once.
+        """
+        if self.stores:
+            unattached = []
+            for row, value in zip(rows, values):
+                if row in self.stores: self.stores[row][name] = value
+                else: unattached.append((row, value))
+            rows = [row for row, value in unattached]
+            values = [value for row, value in unattached]
+        codes = [self.code(name, value, add=True) for value in values]
+        self.__columns[name][numpy.asarray(rows, dtype=numpy.intp)] = codes
+
+    def apply_replies(self, rows, replies):
+        """
+        Applies parsed replies (tuples, as returned by Azur650R._cmd) from
+        many amplifiers at once; rows[i] is the row replies[i] came from.
+        Only replies which update a column are applied (replies whose data
+        can't be decoded are skipped), and where a row has several replies for
+        the same field the last one wins.
+        """
+        updates = {} # Field -> {row: value}
+        for row, reply in zip(rows, replies):
+            decoder = reply_columns.get((reply[0], reply[1]))
+            if decoder is None: continue
+            field, decode = decoder
+            try:
+                value = decode(len(reply) > 2 and reply[2] or '')
+            except (KeyError, ValueError):
+                continue # Not a value we understand.
+            updates.setdefault(field, {})[row] = value
+        for field, values in updates.items():
+            self.update(values.keys(), field, values.values())
+
+    def mask(self, **conditions):
+        """
+        Returns a boolean array selecting the rows which meet every
+        condition. Conditions are given as field=value, or field__op=value
+        where op is one of eq, ne, lt, le, gt, ge or 'in' (value being a
+        sequence); e.g. mask(power_state=True, volume__gt=-20). Rows where a
+        field is unknown never meet a condition on it. As strings are
+        stored as arbitrary codes, lt, le, gt and ge can't be used on them.
+        """
+        selected = numpy.ones(len(self.names), dtype=bool)
+        for condition, value in conditions.items():
+            if '__' in condition: name, op = condition.split('__', 1)
+            else: name, op = condition, 'eq'
+            if name not in self.__columns:
+                raise KeyError("No column '%s'" % name)
+
+            values = self.column(name)
+            if op in ('lt', 'le', 'gt', 'ge') and \
+               self.kinds[name] == 'enum':
+                raise ValueError("Column '%s' can't be ordered" % name)
+            if op == 'in':
+                codes = [self.code(name, item) for item in value]
+                codes = [code for code in codes if code is not None]
+                matched = numpy.in1d(values, codes)
+            elif op in operators:
+                code = self.code(name, value)
+                if code is None: # A string never stored
+                    matched = numpy.zeros(len(values), dtype=bool)
+                    if op == 'ne': matched = ~matched
+                else:
+                    matched = operators[op](values, code)
+            else:
+                raise ValueError("Unknown operator '%s'" % op)
+            selected &= matched & self.known(name)
+        return selected
+
+    def find(self, **conditions):
+        """
+        Returns the IDs of the rows meeting the conditions; see mask().
+        """
+        return numpy.nonzero(self.mask(**conditions))[0]
+
+
+class FleetRow(object):
+    """
+    A dictionary-like view of one row of a FleetStateTable, which can hold
+    the state of an Azur650R (see the state_values constructor argument).
+    """
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, name):
+        return self.table.get(self.row, name)
+
+    def __setitem__(self, name, value):
+        self.table.set(self.row, name, value)
+
+    def attach(self, store):
+        self.table.attach(self.row, store)
+
+    def setdefault(self, name, value=None):
+        current = self.table.get(self.row, name)
+        if current is None and value is not None:
+            self.table.set(self.row, name, value)
+            return value
+        return current
@@ -0,0 +1,231 @@
+"""
+An HTTP/JSON gateway to one amplifier, for dashboards, phone widgets and
+anything else which would rather speak HTTP than open the serial port.
+
+    GET  /state            The known state, as JSON
+    GET  /state?wait=30    Long poll: waits up to 30 seconds for the state to
+                           differ from the If-None-Match ETag
+    POST /power            {"power": true}
+    POST /volume           {"level": -30}, or {"step": "up"} / {"step": "down"}
+    POST /mute             {"mute": true}
+    POST /input            {"input": "03"}
+    POST /command          {"name": "osd_cursor_up", "data": null}; any
+                           command in the protocol table
+
+GET requests are answered from the state held in memory, never from the
+serial port, and carry an ETag which changes whenever the state does; send it
+back as If-None-Match to get a 304 when nothing has changed. POST replies are
+{"result": ...}, or {"error": ..., "type": ...} with a 4xx or 5xx status.
+
+Run it with the azur650 command (azur650 gateway [HOST:]PORT), or call
+serve().
+"""
+
+# Python modules
+import BaseHTTPServer
+import json
+import signal
+import SocketServer
+import sys
+import threading
+from time import time
+from urlparse import parse_qs, urlparse
+
+# Local modules
+from command import Azur650R
+
+
+DEFAULT_ADDRESS = ('127.0.0.1', 8650)
+
+# Longest a long poll may wait, in seconds.
+max_wait = 300
+
+# POST paths: the method called, and the JSON body field holding its
+# argument.
+actions = {
+    '/power': ('set_power', 'power'),
+    '/volume': ('set_volume', 'level'),
+    '/mute': ('set_mute', 'mute'),
+    '/input': ('input_select', 'input'),
+}
+
+
+class GatewayHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handles the requests of one HTTP connection.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/state':
+            return self.send_json(404, {'error': "No such resource",
+                                        'type': 'NotFound'})
+        try:
+            wait = float(parse_qs(url.query).get('wait', ['0'])[0])
+        except ValueError:
+            return self.send_json(400, {'error': "wait must be a number",
+                                        'type': 'ValueError'})
+
+        etag = self.headers.getheader('If-None-Match')
+        if wait > 0 and etag:
+            self.server.wait_for_change(etag, min(wait, max_wait))
+        current, body = self.server.state_body()
+        if etag == current:
+            self.send_response(304)
+            self.send_header('ETag', current)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(200, body, current)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.getheader('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or '{}')
+            if not isinstance(request, dict): raise ValueError
+        except ValueError:
+            return self.send_json(400, {'error': "Expected a JSON object",
+                                        'type': 'ValueError'})
+
+        path = urlparse(self.path).path
+        if path == '/command':
+            method, args = 'command', [request.get('name'),
+                                       request.get('data')]
+        elif path == '/volume' and 'step' in request:
+            if request['step'] not in ('up', 'down'):
+                return self.send_json(400, {'error': "step must be 'up' or "
+                                            "'down'", 'type': 'ValueError'})
+            method, args = 'volume_%s' % request['step'], []
+        elif path in actions:
+            method, field = actions[path]
+            if field not in request:
+                return self.send_json(400, {'error': "Missing '%s'" % field,
+                                            'type': 'KeyError'})
+            args = [request[field]]
+        else:
+            return self.send_json(404, {'error': "No such resource",
+                                        'type': 'NotFound'})
+
+        try:
+            result = self.server.call(method, args)
+        except IOError, exception:
+            status = 502 # The amplifier didn't answer.
+        except (KeyError, ValueError, TypeError), exception:
+            status = 400
+        else:
+            return self.send_json(200, {'result': result})
+        self.send_json(status, {'error': str(exception),
+                                'type': exception.__class__.__name__})
+
+    def send_json(self, status, value):
+        self.send_body(status, json.dumps(value))
+
+    def send_body(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        if etag is not None: self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+
+class Gateway(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves a single Azur650R over HTTP. Commands from different clients are
+    sent one at a time; the state is watched through the amplifier's state
+    store, so GET requests never wait for the serial port.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, amplifier, address=DEFAULT_ADDRESS, verbose=False):
+        self.amplifier = amplifier
+        self.verbose = verbose
+        self.lock = threading.Lock()
+
+        # The ETag is the number of changes seen, qualified by when the
+        # gateway started so that tags from an earlier run never match.
+        self.__epoch = '%x' % int(time() * 1000)
+        self.__version = 0
+        self.__body = None # (ETag, JSON) of the current state, once asked
+        self.__changed = threading.Condition()
+        amplifier.state.add_listener(self._state_changed)
+
+        BaseHTTPServer.HTTPServer.__init__(self, address, GatewayHandler)
+
+    def _state_changed(self, field, old, new):
+        """
+        State store listener; invalidates the cached state and wakes up
+        long polls.
+        """
+        with self.__changed:
+            self.__version += 1
+            self.__body = None
+            self.__changed.notifyAll()
+
+    def etag(self):
+        return '"%s-%s"' % (self.__epoch, self.__version)
+
+    def state_body(self):
+        """
+        Returns the current ETag and the state as JSON; the JSON is only
+        rebuilt when the state has changed.
+        """
+        with self.__changed:
+            if self.__body is not None: return self.__body
+            etag = self.etag()
+
+        # Not holding the condition here: the listener which takes it is
+        # called with the state store's lock held.
+        body = json.dumps(self.amplifier.get_state(), sort_keys=True)
+        with self.__changed:
+            if self.etag() == etag: self.__body = (etag, body)
+        return etag, body
+
+    def wait_for_change(self, etag, timeout):
+        """
+        Waits up to timeout seconds for the ETag to differ from etag.
+        """
+        deadline = time() + timeout
+        with self.__changed:
+            while self.etag() == etag:
+                remaining = deadline - time()
+                if remaining <= 0: break
+                self.__changed.wait(remaining)
+
+    def call(self, method, args):
+        """
+        Calls a method of the amplifier, returning the result.
+        """
+        # JSON strings arrive as unicode; the amplifier expects plain strings.
+        args = [str(arg) if isinstance(arg, unicode) else arg for arg in args]
+        with self.lock:
+            if method == 'set_power':
+                if args[0]: return self.amplifier.power_on()
+                return self.amplifier.power_off()
+            return getattr(self.amplifier, method)(*args)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.amplifier.state.remove_listener(self._state_changed)
+
+
+def serve(serial_port='/dev/ttyS0', address=DEFAULT_ADDRESS, verbose=False):
+    """
+    Opens the serial port and serves it over HTTP until interrupted.
+    """
+    amplifier = Azur650R(serial_port)
+    server = Gateway(amplifier, address, verbose)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        amplifier.disconnect()
@@ -0,0 +1,227 @@
+"""
+A bounded history of amplifier state changes, for answering questions like
+"who changed the volume at 2am?" after the fact.
+
+Changes are kept in a ring buffer of typed arrays (a timestamp, field and
+value per change) allocated up front, so the memory used is fixed however
+long the history runs, and recording a change is a handful of array stores.
+Once full, the oldest changes are overwritten.
+
+Attach a history to an amplifier's state store to record every change:
+
+    history = StateHistory()
+    history.attach(amp.state)
+    ...
+    history.value_at('volume', time.time() - 3600)
+"""
+
+# Python modules
+import threading
+from array import array
+from time import time
+
+
+# Kinds of value, as stored in the kind array.
+NONE, BOOLEAN, INTEGER, FLOAT, STRING, OTHER = range(6)
+
+
+class StateHistory(object):
+    """
+    Ring buffer of state changes. Changes to dictionary fields (such as the
+    audio source for each input) are recorded per item, as 'field[key]'.
+    Values which are neither None, numbers nor strings (e.g. the learned
+    step model) are recorded as having changed, but not what to.
+    """
+
+    def __init__(self, capacity=65536, max_strings=4096, exclude=None):
+        """
+        Creates a history holding up to capacity changes, and up to
+        max_strings distinct string values (further strings are recorded
+        like other unrecordable values). Fields named in exclude are not
+        recorded at all.
+        """
+        self.capacity = capacity
+        self.max_strings = max_strings
+        self.exclude = frozenset(exclude or ())
+        self.__times = array('d', [0.0]) * capacity
+        self.__fields = array('H', [0]) * capacity
+        self.__kinds = array('b', [0]) * capacity
+        self.__values = array('d', [0.0]) * capacity
+        self.__next = 0 # Index the next change is written to
+        self.__count = 0
+        self.__last_time = 0.0
+        self.__lock = threading.Lock()
+
+        # Interned field names and string values.
+        self.__names = []
+        self.__name_ids = {}
+        self.__strings = []
+        self.__string_ids = {}
+
+    def __len__(self):
+        return self.__count
+
+    def attach(self, store):
+        """
+        Starts recording every change made to a StateStore.
+        """
+        store.add_listener(self.record)
+
+    def detach(self, store):
+        """
+        Stops recording changes made to a StateStore.
+        """
+        store.remove_listener(self.record)
+
+    def record(self, field, old, new, when=None):
+        """
+        Records a change; this is the StateStore listener.
+        """
+        if field in self.exclude: return
+        with self.__lock:
+            if isinstance(new, dict) or isinstance(old, dict):
+                old = old or {}
+                new = new or {}
+                for key in set(old.keys()) | set(new.keys()):
+                    if old.get(key) != new.get(key):
+                        self._append('%s[%s]' % (field, key), new.get(key),
+                                     when)
+            else:
+                self._append(field, new, when)
+
+    def _append(self, name, value, when):
+        """
+        Writes one change at the head of the ring buffer.
+        """
+        # Timestamps never go backwards, so they can be searched.
+        if when is None: when = time()
+        when = max(when, self.__last_time)
+        self.__last_time = when
+
+        name_id = self.__name_ids.get(name)
+        if name_id is None:
+            name_id = self.__name_ids[name] = len(self.__names)
+            self.__names.append(name)
+
+        kind, number = self._encode(value)
+        index = self.__next
+        self.__times[index] = when
+        self.__fields[index] = name_id
+        self.__kinds[index] = kind
+        self.__values[index] = number
+        self.__next = (index + 1) % self.capacity
+        if self.__count < self.capacity: self.__count += 1
+
+    def _encode(self, value):
+        """
+        Returns the kind and numeric representation of a value.
+        """
+        if value is None: return NONE, 0.0
+        if isinstance(value, bool): return BOOLEAN, float(value)
+        if isinstance(value, (int, long)): return INTEGER, float(value)
+        if isinstance(value, float): return FLOAT, value
+        if isinstance(value, basestring):
+            string_id = self.__string_ids.get(value)
+            if string_id is None:
+                if len(self.__strings) >= self.max_strings: return OTHER, 0.0
+                string_id = self.__string_ids[value] = len(self.__strings)
+                self.__strings.append(value)
+            return STRING, float(string_id)
+        return OTHER, 0.0
+
+    def _decode(self, index):
+        """
+        Returns the value stored at a (physical) index.
+        """
+        kind = self.__kinds[index]
+        number = self.__values[index]
+        if kind == BOOLEAN: return bool(number)
+        if kind == INTEGER: return int(number)
+        if kind == FLOAT: return number
+        if kind == STRING: return self.__strings[int(number)]
+        return None
+
+    def _index(self, position):
+        """
+        Converts a position (0 for the oldest change held) to a physical
+        index into the arrays.
+        """
+        return (self.__next - self.__count + position) % self.capacity
+
+    def _position_after(self, when, inclusive=False):
+        """
+        Returns the position of the first change made after (or, if
+        inclusive, at or after) when.
+        """
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            changed = self.__times[self._index(middle)]
+            if changed < when or (changed == when and not inclusive):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def value_at(self, field, when, default=None):
+        """
+        Returns the value a field had at the given time, or default if no
+        change to it is held from before then.
+        """
+        name_id = self.__name_ids.get(field)
+        if name_id is None: return default
+        with self.__lock:
+            position = self._position_after(when)
+            while position > 0:
+                position -= 1
+                index = self._index(position)
+                if self.__fields[index] == name_id: return self._decode(index)
+        return default
+
+    def changes(self, start=None, end=None, fields=None):
+        """
+        Returns the changes made between start and end (inclusive; either may
+        be None for no limit) as a list of (time, field, value) tuples, oldest
+        first, optionally only for the named fields.
+        """
+        name_ids = None
+        if fields is not None:
+            name_ids = set([self.__name_ids[field] for field in fields
+                            if field in self.__name_ids])
+
+        with self.__lock:
+            if start is None: first = 0
+            else: first = self._position_after(start, inclusive=True)
+            if end is None: last = self.__count
+            else: last = self._position_after(end)
+
+            result = []
+            for position in xrange(first, last):
+                index = self._index(position)
+                name_id = self.__fields[index]
+                if name_ids is not None and name_id not in name_ids: continue
+                result.append((self.__times[index], self.__names[name_id],
+                               self._decode(index)))
+        return result
+
+    def series(self, field, start, end, buckets=100):
+        """
+        Downsamples a field to the given number of equal time buckets between
+        start and end; returns a list of (bucket start, value) tuples, the
+        value being the one in effect at the end of each bucket.
+        """
+        width = float(end - start) / buckets
+        value = self.value_at(field, start)
+        bucket_ends = [start + width * (bucket + 1) for bucket in
+                       range(buckets)]
+        result = []
+        bucket = 0
+        for when, name, new in self.changes(start, end, [field]):
+            while bucket < buckets and when > bucket_ends[bucket]:
+                result.append((bucket_ends[bucket] - width, value))
+                bucket += 1
+            value = new
+        while bucket < buckets:
+            result.append((bucket_ends[bucket] - width, value))
+            bucket += 1
+        return result
@@ -0,0 +1,245 @@
+"""
+Load and fault-injection harness: runs many concurrent clients against one
+SimulatedAmplifier and reports throughput, latency and how far the clients'
+idea of the state has drifted from the truth.
+
+Clients either each run on their own thread with a normal (blocking)
+Azur650R, or all share a single thread and use write-behind mode, issuing
+commands without waiting for replies (the library's equivalent of an event
+loop, as Python 2 has no asyncio). In both cases every client has its own
+Azur650R on the same simulated port, like several processes sharing one
+serial device.
+
+Run it from the command line, e.g.:
+
+    python -m azur650.loadtest --clients 8 --duration 10 --drop-byte 0.01
+"""
+
+# Python modules
+import random
+import sys
+import threading
+from optparse import OptionParser
+from time import sleep, time
+
+# Local modules
+from command import Azur650R
+from simulator import Faults, SimulatedAmplifier
+
+
+# Fields compared between the clients and the simulated amplifier.
+compared_fields = ('power_state', 'volume', 'mute_state', 'osd_on',
+                   'active_input')
+
+# The operations clients pick from at random: the method and arguments used
+# in blocking mode, and the command sent in write-behind mode.
+operations = (
+    ('volume_up', (), ('1', '02')),
+    ('volume_down', (), ('1', '03')),
+    ('set_mute', (True,), ('1', '11', '01')),
+    ('set_mute', (False,), ('1', '11', '00')),
+    ('input_select', ('01',), ('2', '01', '01')),
+    ('input_select', ('07',), ('2', '01', '07')),
+    ('show_osd', (), ('1', '13')),
+    ('hide_osd', (), ('1', '14')),
+    ('get_protocol_version', (), ('5', '02')),
+)
+
+# Seconds a client waits before trying again after losing the connection.
+reconnect_time = 0.05
+
+
+def percentile(values, fraction):
+    """
+    Returns the given percentile (as a fraction) of a sorted list.
+    """
+    if not values: return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Client(object):
+    """
+    One simulated user of the amplifier, recording what happens.
+    """
+
+    def __init__(self, port, seed):
+        self.amp = Azur650R(port)
+        self.random = random.Random(seed)
+        self.latencies = []
+        self.errors = {} # Exception class name -> count
+
+    def error(self, exception):
+        name = exception.__class__.__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+        if isinstance(exception, IOError): sleep(reconnect_time)
+
+    def run_blocking(self, deadline):
+        """
+        Issues operations one after another until the deadline.
+        """
+        while time() < deadline:
+            method, arguments, command = self.random.choice(operations)
+            started = time()
+            try:
+                getattr(self.amp, method)(*arguments)
+            except Exception, exception:
+                self.error(exception)
+            else:
+                self.latencies.append(time() - started)
+
+
+def run_threads(clients, duration):
+    """
+    Runs each client on its own thread for duration seconds.
+    """
+    deadline = time() + duration
+    threads = [threading.Thread(target=client.run_blocking, args=(deadline,))
+               for client in clients]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+
+def run_write_behind(clients, duration, outstanding=4):
+    """
+    Drives every client from this thread in write-behind mode, keeping up
+    to outstanding commands in flight per client.
+    """
+    for client in clients:
+        client.amp.enable_write_behind(
+            lambda handle, client=client: client.error(handle.error),
+            reply_timeout=1.0)
+
+    deadline = time() + duration
+    in_flight = dict([(client, []) for client in clients])
+    while time() < deadline:
+        for client in clients:
+            # Collect what has finished.
+            for handle in list(in_flight[client]):
+                if handle.done():
+                    in_flight[client].remove(handle)
+                    if handle.error is None:
+                        client.latencies.append(time() - handle.sent)
+            if len(in_flight[client]) >= outstanding: continue
+
+            method, arguments, command = client.random.choice(operations)
+            try:
+                in_flight[client].append(client.amp._cmd(*command))
+            except Exception, exception:
+                client.error(exception)
+
+    for client in clients:
+        client.amp.disable_write_behind(timeout=2)
+
+
+def divergence(clients, amplifier):
+    """
+    Returns, for each compared field, how many clients hold a value which
+    differs from the simulated amplifier's (clients which don't know the
+    value at all aren't counted).
+    """
+    truth = amplifier.state()
+    states = [client.amp.get_state() for client in clients]
+    result = {}
+    for field in compared_fields:
+        result[field] = len([state for state in states
+                             if state[field] is not None and
+                                state[field] != truth[field]])
+    return result
+
+
+def run(clients=4, duration=5.0, mode='threads', faults=None, seed=None):
+    """
+    Runs a load test and returns a report (a dictionary); see
+    format_report().
+    """
+    amplifier = SimulatedAmplifier(faults)
+    generator = random.Random(seed)
+    clients = [Client(amplifier.open_port(), generator.random())
+               for client in range(clients)]
+
+    started = time()
+    if mode == 'threads': run_threads(clients, duration)
+    elif mode == 'write-behind': run_write_behind(clients, duration)
+    else: raise ValueError("Unknown mode '%s'" % mode)
+    elapsed = time() - started
+
+    latencies = []
+    errors = {}
+    for client in clients:
+        latencies.extend(client.latencies)
+        for name, count in client.errors.items():
+            errors[name] = errors.get(name, 0) + count
+    latencies.sort()
+
+    return {
+        'mode': mode,
+        'clients': len(clients),
+        'elapsed': elapsed,
+        'operations': len(latencies),
+        'errors': errors,
+        'commands_received': amplifier.commands,
+        'throughput': len(latencies) / elapsed,
+        'latency': {
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies and latencies[-1] or None,
+        },
+        'divergence': divergence(clients, amplifier),
+    }
+
+
+def format_report(report):
+    """
+    Formats a report from run() as text.
+    """
+    lines = [
+        "%(mode)s, %(clients)s clients, %(elapsed).1fs" % report,
+        "operations:  %(operations)s completed (%(throughput).1f/s), "
+        "%(commands_received)s commands received" % report,
+    ]
+    latency = report['latency']
+    if latency['p50'] is not None:
+        lines.append("latency:     p50 %.1fms, p90 %.1fms, p99 %.1fms, "
+                     "max %.1fms" % (latency['p50'] * 1000,
+                                     latency['p90'] * 1000,
+                                     latency['p99'] * 1000,
+                                     latency['max'] * 1000))
+    errors = ', '.join(['%s %s' % (name, count) for name, count in
+                        sorted(report['errors'].items())]) or 'none'
+    lines.append("errors:      %s" % errors)
+    divergence = ', '.join(['%s %s' % (field, count) for field, count in
+                            sorted(report['divergence'].items())])
+    lines.append("divergence:  %s (clients out of step, by field)" % \
+                 divergence)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('-c', '--clients', type='int', default=4)
+    parser.add_option('-d', '--duration', type='float', default=5.0,
+                      help="seconds [default: %default]")
+    parser.add_option('-m', '--mode', default='threads',
+                      choices=['threads', 'write-behind'],
+                      help="threads or write-behind [default: %default]")
+    parser.add_option('--seed', type='int', default=None)
+    for fault in ('drop-byte', 'delay', 'duplicate', 'error', 'disconnect'):
+        parser.add_option('--%s' % fault, type='float', default=0.0,
+                          help="probability of %s faults" % fault)
+    options, args = parser.parse_args(argv)
+
+    faults = Faults(drop_byte=options.drop_byte, delay=options.delay,
+                    duplicate=options.duplicate, error=options.error,
+                    disconnect=options.disconnect, seed=options.seed)
+    report = run(options.clients, options.duration, options.mode, faults,
+                 options.seed)
+    print format_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
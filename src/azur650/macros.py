@@ -0,0 +1,165 @@
+"""
+Macros: fixed sequences of commands, such as OSD navigation, which are
+validated and encoded once and then sent with a single write.
+
+A macro is written as a comma-separated list of steps, each a command name
+from the protocol table (with spaces or underscores) or one of the shorter
+aliases below, followed by its data if it takes any:
+
+    macros = parse_macros('''
+        osd: osd on, down, down, right, enter
+        movie: power on, input 01, stereo mode 00
+    ''')
+    amp.run_macro(macros['movie'])
+"""
+
+# Local modules
+import protocol
+from command import CommandDataError
+
+
+# Short names for steps: step -> (command name, data).
+aliases = {
+    'up': ('osd_cursor_up', None),
+    'down': ('osd_cursor_down', None),
+    'left': ('osd_cursor_left', None),
+    'right': ('osd_cursor_right', None),
+    'enter': ('osd_enter', None),
+    'osd on': ('show_osd', None),
+    'osd off': ('hide_osd', None),
+    'power on': ('power', '1'),
+    'power off': ('power', '0'),
+    'mute on': ('mute', '01'),
+    'mute off': ('mute', '00'),
+    'sub on': ('sub_on', None),
+    'sub off': ('sub_off', None),
+    'input': ('input_select', None),
+    'stereo mode': ('stereo_mode', None),
+    'preset': ('tuner_select_preset', None),
+    'band': ('tuner_select_band', None),
+    'lfe trim': ('set_lfe_trim', None),
+}
+
+
+def expected_reply(command):
+    """
+    Returns the reply expected to a (group, number[, data]) command: the
+    reply group and number, followed by the reply data where it can be
+    predicted (see protocol.Command.predict).
+    """
+    spec = protocol.by_code[tuple(command[:2])]
+    if spec.predict is None: return spec.reply
+    data = spec.predict(len(command) > 2 and command[2] or None)
+    if not data: return spec.reply
+    return spec.reply + (data,)
+
+
+def is_expected(reply, expected):
+    """
+    Returns True if a reply (as returned by Azur650R._exchange, or None) is
+    the one expected (see expected_reply).
+    """
+    if reply is None or tuple(reply[:2]) != expected[:2]: return False
+    if len(expected) < 3: return True
+    return len(reply) > 2 and reply[2].strip() == expected[2]
+
+
+class Macro(object):
+    """
+    A compiled macro: the commands, encoded as one string ready to write,
+    and the reply expected to each.
+    """
+
+    def __init__(self, name, steps, commands):
+        self.name = name
+        self.steps = tuple(steps) # The step each command came from
+        self.commands = tuple(commands)
+        self.encoded = ''.join(['#%s\r' % ','.join(command)
+                                for command in self.commands])
+        self.replies = tuple([expected_reply(command)
+                              for command in self.commands])
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __repr__(self):
+        return '<Macro %s: %s>' % (self.name, ', '.join(self.steps))
+
+    def unanswered(self, replies):
+        """
+        Returns the steps whose reply (in replies, as returned by
+        Azur650R._exchange) is missing or isn't the one expected; where the
+        reply data can be predicted, it must match too, so that another reply
+        in the same group (such as the input reported on power on) isn't
+        taken for it.
+        """
+        return [step for step, expected, reply in
+                zip(self.steps, self.replies, replies)
+                if not is_expected(reply, expected)]
+
+
+def compile_step(step):
+    """
+    Returns the (group, number[, data]) command for one step, raising
+    KeyError if there is no such command, or CommandDataError if its data
+    isn't valid.
+    """
+    words = step.lower().split()
+    if not words: raise KeyError("Empty step")
+    name, data = aliases.get(' '.join(words), (None, None))
+    if name is None:
+        for phrase, data in ((words, None), (words[:-1], words[-1])):
+            phrase = ' '.join(phrase)
+            if phrase in aliases and aliases[phrase][1] is None:
+                name = aliases[phrase][0]
+            elif phrase.replace(' ', '_') in protocol.by_name:
+                name = phrase.replace(' ', '_')
+            if name is not None: break
+        else:
+            raise KeyError("Unknown step '%s'" % step)
+
+    spec = protocol.by_name[name]
+    # Allow '3' for '03', etc.
+    if data is not None and data.isdigit() and spec.data is not None and \
+       data not in spec.data and '%02d' % int(data) in spec.data:
+        data = '%02d' % int(data)
+    if not spec.accepts(data):
+        if data is None:
+            raise CommandDataError("Step '%s' needs data" % step)
+        raise CommandDataError("Invalid data in step '%s'" % step)
+    if data is None: return (spec.group, spec.number)
+    return (spec.group, spec.number, data)
+
+
+def compile_macro(name, steps):
+    """
+    Compiles a macro from its steps, given as a list or a comma-separated
+    string.
+    """
+    if isinstance(steps, basestring): steps = steps.split(',')
+    steps = [step.strip() for step in steps if step.strip()]
+    commands = []
+    for step in steps:
+        try:
+            commands.append(compile_step(step))
+        except (KeyError, ValueError), exception:
+            raise exception.__class__("Macro '%s': %s" % (name,
+                                      exception.args[0]))
+    return Macro(name, steps, commands)
+
+
+def parse_macros(text):
+    """
+    Compiles the macros defined in text, one per line as "name: steps";
+    blank lines and lines starting with '#' are ignored. Returns a
+    dictionary of Macros by name.
+    """
+    macros = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'): continue
+        if ':' not in line:
+            raise ValueError("Expected 'name: steps', got '%s'" % line)
+        name, steps = line.split(':', 1)
+        macros[name.strip()] = compile_macro(name.strip(), steps)
+    return macros
@@ -0,0 +1,146 @@
+"""
+Write pacing. The 650R handles one command at a time and has room to hold
+only a little of what arrives meanwhile; commands written faster than that are
+silently dropped. A Pacer keeps an Azur650R within the limits: a minimum gap
+between commands, and a maximum number of commands awaiting their reply.
+
+The limits are best measured rather than guessed; calibrate() finds them for
+the amplifier (or simulator) at hand, and the result can be saved as a
+profile and loaded next time:
+
+    pacer = calibrate(amp)
+    pacer.save('/var/lib/azur650/pacing.json')
+    ...
+    amp = Azur650R('/dev/ttyS0', pacer=Pacer.load(path))
+"""
+
+# Python modules
+import json
+import threading
+from time import sleep, time
+
+
+class Pacer(object):
+    """
+    Spaces out commands by at least gap seconds, and limits how many may be
+    awaiting a reply at once (max_outstanding; None for no limit).
+    """
+
+    def __init__(self, gap=0.0, max_outstanding=None):
+        self.gap = gap
+        self.max_outstanding = max_outstanding
+        self.__next = 0 # Earliest time the next command may be written
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Pacer gap=%.4fs max_outstanding=%s>' % (self.gap,
+                                                       self.max_outstanding)
+
+    def allows(self, outstanding):
+        """
+        Returns True if another command may be sent while outstanding
+        commands are awaiting their reply.
+        """
+        return self.max_outstanding is None or \
+               outstanding < self.max_outstanding
+
+    def delay(self):
+        """
+        Returns how long until the next command may be written.
+        """
+        return max(0.0, self.__next - time())
+
+    def pace(self):
+        """
+        Claims the next slot for writing a command, waiting for it if
+        necessary; call this just before each write.
+        """
+        with self.__lock:
+            now = time()
+            slot = max(now, self.__next)
+            self.__next = slot + self.gap
+        if slot > now: sleep(slot - now)
+
+    def as_dict(self):
+        return {'gap': self.gap, 'max_outstanding': self.max_outstanding}
+
+    def save(self, path):
+        """
+        Saves the limits as a JSON profile.
+        """
+        profile = open(path, 'w')
+        try:
+            json.dump(self.as_dict(), profile, indent=2, sort_keys=True)
+        finally:
+            profile.close()
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns a Pacer with the limits saved in a JSON profile.
+        """
+        profile = open(path)
+        try:
+            limits = json.load(profile)
+        finally:
+            profile.close()
+        return cls(float(limits['gap']), limits.get('max_outstanding'))
+
+
+def _lost(amp, pacer, command, count):
+    """
+    Sends count copies of command in a burst under the given pacer; returns
+    how many went unanswered.
+    """
+    previous = amp.pacer
+    amp.pacer = pacer
+    try:
+        replies = amp._exchange([command] * count)
+    finally:
+        amp.pacer = previous
+    sleep(0.2) # Let any late replies drain before the next burst.
+    amp._drain()
+    return replies.count(None)
+
+
+def calibrate(amp, command=('5', '02'), count=20, max_gap=0.25,
+              resolution=0.002, margin=1.25):
+    """
+    Measures the limits of the amplifier connected to amp (an Azur650R) by
+    sending bursts of count harmless commands (by default, asking for the
+    protocol version), and returns a Pacer for them:
+
+    * max_outstanding is the largest number of commands which can be left
+      awaiting a reply, sent back to back, without any being lost;
+    * gap is the smallest spacing (found to within resolution seconds) at
+      which a burst sent without waiting for replies loses nothing, times
+      margin for safety.
+
+    Either limit is None (or 0 for the gap) if the amplifier never lost
+    anything; if even max_gap seconds is too fast, IOError is raised.
+    """
+    # How many can be outstanding at once?
+    max_outstanding = None
+    if _lost(amp, Pacer(), command, count):
+        low, high = 1, count
+        while low < high:
+            window = (low + high + 1) // 2
+            if _lost(amp, Pacer(max_outstanding=window), command, count):
+                high = window - 1
+            else:
+                low = window
+        max_outstanding = low
+
+    # How closely can commands be spaced with nothing waited for?
+    gap = 0.0
+    if max_outstanding is not None:
+        if _lost(amp, Pacer(max_gap), command, count):
+            raise IOError("Commands are lost even %ss apart" % max_gap)
+        low, high = 0.0, max_gap
+        while high - low > resolution:
+            middle = (low + high) / 2
+            if _lost(amp, Pacer(middle), command, count): low = middle
+            else: high = middle
+        gap = high * margin
+
+    return Pacer(gap, max_outstanding)
@@ -0,0 +1,191 @@
+"""
+The 650R serial protocol as data: every command the amplifier accepts, the
+data it takes, the reply it sends back, and what that reply means.
+
+Azur650R checks each command against this table before writing it, so a bad
+group, number or data value fails straight away instead of after a round trip
+to the amplifier (which only says which part was wrong). The table also tells
+Azur650R (and the fleet table) how to decode the replies which simply set one
+state field, tells write-behind mode which replies can be predicted, and lets
+any command be sent by name:
+
+    amp.command('input_select', '03')
+"""
+
+
+def level(data):
+    """
+    Decodes a signed level, e.g. "+ 4", " 0" or "-30".
+    """
+    return int(data.replace(' ', ''))
+
+def flag(data):
+    """
+    Decodes a '0'/'1' reply as a boolean.
+    """
+    return {'0': False, '1': True}[data]
+
+def quarters(data):
+    """
+    Decodes a '0' to '4' reply as 0.0 to 1.0 (the dynamic range).
+    """
+    value = int(data)
+    if not 0 <= value <= 4: raise ValueError(data)
+    return value * 0.25
+
+def always(value):
+    """
+    Returns a decoder for replies which always mean the same thing.
+    """
+    return lambda data: value
+
+def text(data):
+    """
+    Decodes a reply holding a string (e.g. an input ID or DSP mode), without
+    padding; there must be one.
+    """
+    if not data.strip(): raise ValueError("Missing data")
+    return data.strip()
+
+def unpadded(data):
+    """
+    Predicts the reply data for commands which echo their data without the
+    leading zero (e.g. mute: '01' is confirmed as '1').
+    """
+    return str(int(data))
+
+def same(data):
+    return data or ''
+
+def selected_input(data):
+    """
+    Predicts the reply to selecting an input: its ID, except that the tuner
+    is selected as '00' but reported as '09'.
+    """
+    if data == '00': return '09'
+    return data
+
+def padded(values):
+    """
+    Returns the values 0 to values - 1 as two-digit strings.
+    """
+    return tuple(['%02d' % value for value in range(values)])
+
+
+class Command(object):
+    """
+    One command: its name (the Azur650R method that sends it, where there is
+    one), group, number and the data values it accepts (None if it takes no
+    data). The reply is in group + 5 with the same number; field and decode
+    say which state field the reply data sets, and predict (if the reply can
+    be known in advance) turns the command data into the reply data.
+    Idempotent commands have the same effect however many times they are
+    sent.
+    """
+
+    def __init__(self, name, group, number, data=None, idempotent=False,
+                 field=None, decode=None, predict=None):
+        self.name = name
+        self.group = group
+        self.number = number
+        self.data = data
+        self.idempotent = idempotent
+        self.field = field
+        self.decode = decode
+        self.predict = predict
+        self.reply = (str(int(group) + 5), number)
+
+    def __repr__(self):
+        return '<Command %s (%s,%s)>' % (self.name, self.group, self.number)
+
+    def accepts(self, data):
+        """
+        Returns True if the command may be sent with the given data.
+        """
+        if self.data is None: return data is None
+        return data is not None and str(data) in self.data
+
+
+commands = (
+    # Group 1: Amplifier commands
+    Command('power', '1', '01', ('0', '1'), True, 'power_state', flag, same),
+    Command('volume_up', '1', '02', field='volume', decode=level),
+    Command('volume_down', '1', '03', field='volume', decode=level),
+    Command('bass_up', '1', '04', field='bass', decode=level),
+    Command('bass_down', '1', '05', field='bass', decode=level),
+    Command('treble_up', '1', '06', field='treble', decode=level),
+    Command('treble_down', '1', '07', field='treble', decode=level),
+    Command('sub_on', '1', '08', None, True, 'subwoofer', always(True), same),
+    Command('sub_off', '1', '09', None, True, 'subwoofer', always(False),
+            same),
+    Command('set_lfe_trim', '1', '10', tuple([str(n) for n in range(11)]),
+            True, 'lfe_trim', lambda data: -1 * int(data), same),
+    Command('mute', '1', '11', ('00', '01'), True, 'mute_state', flag,
+            unpadded),
+    Command('set_dynamic_range', '1', '12', padded(5), True, 'dynamic_range',
+            quarters, unpadded),
+    Command('show_osd', '1', '13', None, True, 'osd_on', always(True), same),
+    Command('hide_osd', '1', '14', None, True, 'osd_on', always(False),
+            same),
+    Command('osd_cursor_up', '1', '15'),
+    Command('osd_cursor_down', '1', '16'),
+    Command('osd_cursor_left', '1', '17'),
+    Command('osd_cursor_right', '1', '18'),
+    Command('osd_enter', '1', '19'),
+    Command('lip_sync_decrease', '1', '20', field='lip_sync', decode=level),
+    Command('lip_sync_increase', '1', '21', field='lip_sync', decode=level),
+
+    # Group 2: Source commands
+    Command('input_select', '2', '01', padded(11), True, 'active_input',
+            text, selected_input),
+    Command('input_select_previous', '2', '02', field='active_input',
+            decode=text),
+    Command('input_select_next', '2', '03', field='active_input',
+            decode=text),
+    Command('set_audio_source_for_input', '2', '04', padded(3), True,
+            predict=unpadded),
+    Command('set_video_source_for_input', '2', '05', padded(4), True,
+            predict=unpadded),
+
+    # Group 3: Tuner commands
+    Command('tuner_preset_up', '3', '01', field='tuner_preset', decode=text),
+    Command('tuner_preset_down', '3', '02', field='tuner_preset',
+            decode=text),
+    # The preset numbers are filled in from Azur650R.tuner_preset_count.
+    Command('tuner_select_preset', '3', '03', (), True, 'tuner_preset', text,
+            same),
+    Command('tuner_frequency_up', '3', '04', field='tuner_frequency',
+            decode=text),
+    Command('tuner_frequency_down', '3', '05', field='tuner_frequency',
+            decode=text),
+    Command('tuner_select_band', '3', '06', padded(2), True, 'tuner_band',
+            text, unpadded),
+    Command('get_tuner_frequency', '3', '07', None, True, 'tuner_frequency',
+            text),
+    Command('tuner_mode', '3', '08', padded(2), True, 'tuner_mode', text,
+            unpadded),
+
+    # Group 4: Audio processing commands
+    Command('stereo_mode', '4', '01', padded(2), True, 'stereo_audio_mode',
+            text, same),
+    Command('next_digital_processing_mode', '4', '02',
+            field='signal_processing_mode', decode=text),
+    Command('next_codec', '4', '03', field='signal_codec', decode=text),
+    Command('get_digital_processing_mode', '4', '04', None, True,
+            'signal_processing_mode', text),
+    Command('get_codec', '4', '05', None, True, 'signal_codec', text),
+
+    # Group 5: Version commands
+    Command('get_main_software_version', '5', '01', None, True,
+            'main_software_version', text),
+    Command('get_protocol_version', '5', '02', None, True,
+            'protocol_version', text),
+)
+
+# Lookups: by name, by (group, number), and by reply (group, number).
+by_name = dict([(command.name, command) for command in commands])
+by_code = dict([((command.group, command.number), command)
+                for command in commands])
+by_reply = dict([(command.reply, command) for command in commands])
+
+groups = frozenset([command.group for command in commands])
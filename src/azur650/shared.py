@@ -0,0 +1,287 @@
+"""
+Sharing one amplifier between several processes (cron jobs, a user
+interface, a watcher...), each with its own Azur650R; see
+Azur650R.enable_sharing().
+
+Each exchange on the serial port is made holding an advisory lock (flock)
+on a lock file, so processes never interleave their frames. The state is
+published to a small memory-mapped file after each exchange which changed it,
+and picked up by the other processes before their next exchange, so every
+process knows what any of them has learnt, and a new process starts with the
+state the others have built up instead of from nothing. Processes which only
+watch the state (and so make no exchanges of their own) can have it checked
+for changes every so often instead.
+
+The state file begins with a sequence number and the length of the state
+(as JSON) which follows. The sequence number is odd while the state is being
+written (by the process holding the lock) and is increased again afterwards,
+so readers can tell if what they read was torn, and retry.
+
+As whoever can write the state file can feed state to every process sharing
+it, the files are kept in a directory of the user's own (see
+private_directory), are never opened through a symbolic link, and must belong
+to the user; so only processes of the same user can share an amplifier.
+"""
+
+# Python modules
+import errno
+import fcntl
+import json
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import threading
+from time import sleep
+
+
+# Sequence number and length of the state, at the start of the state file.
+header = struct.Struct('<QI')
+
+
+def private_directory():
+    """
+    Returns a directory of the user's own for files which mustn't be open
+    to other users: $XDG_RUNTIME_DIR if set, otherwise one in the temporary
+    directory, which is created if need be. Raises IOError if the directory
+    could belong to (or be written by) anyone else.
+    """
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not directory:
+        directory = os.path.join(tempfile.gettempdir(),
+                                 'azur650-%d' % os.getuid())
+        try:
+            os.mkdir(directory, 0700)
+        except OSError, exception:
+            if exception.errno != errno.EEXIST: raise
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+       info.st_mode & 0022:
+        raise IOError("'%s' isn't a directory of the user's own" % directory)
+    return directory
+
+
+def default_path(port):
+    """
+    Returns the default path (before '.lock' or '.state') for sharing the
+    named serial port, in the user's own directory (see private_directory).
+    """
+    name = 'azur650-%s' % str(port).strip('/').replace('/', '-')
+    return os.path.join(private_directory(), name)
+
+
+def open_private(path):
+    """
+    Opens a file for reading and writing, creating it (readable by the user
+    alone) if need be, and returns the file descriptor. Raises an error
+    rather than follow a symbolic link, and IOError if the file belongs to
+    another user or isn't a regular file.
+    """
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0600)
+    try:
+        info = os.fstat(descriptor)
+        if not stat.S_ISREG(info.st_mode):
+            raise IOError("'%s' isn't a regular file" % path)
+        if info.st_uid != os.getuid():
+            raise IOError("'%s' belongs to another user" % path)
+    except:
+        os.close(descriptor)
+        raise
+    return descriptor
+
+
+def plain(value):
+    """
+    Returns a value loaded from JSON with its unicode strings (including
+    dictionary keys) converted to plain strings, as Azur650R keeps them.
+    """
+    if isinstance(value, unicode): return str(value)
+    if isinstance(value, list): return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return dict([(plain(key), plain(item)) for key, item in
+                     value.items()])
+    return value
+
+
+class PortLock(object):
+    """
+    An advisory lock on a file, shared between processes; within a process
+    it is re-entrant, and excludes other threads as well.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__descriptor = open_private(path)
+        self.__lock = threading.RLock()
+        self.__depth = 0
+
+    def acquire(self):
+        self.__lock.acquire()
+        if self.__depth == 0:
+            try:
+                fcntl.flock(self.__descriptor, fcntl.LOCK_EX)
+            except:
+                self.__lock.release()
+                raise
+        self.__depth += 1
+
+    def release(self):
+        self.__depth -= 1
+        if self.__depth == 0:
+            fcntl.flock(self.__descriptor, fcntl.LOCK_UN)
+        self.__lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.release()
+        return False
+
+    def close(self):
+        os.close(self.__descriptor)
+
+
+class SharedStateFile(object):
+    """
+    The memory-mapped state file. Only the process holding the port lock
+    may write(); anyone may read().
+    """
+
+    def __init__(self, path, size=65536):
+        descriptor = open_private(path)
+        try:
+            size = max(size, os.fstat(descriptor).st_size)
+            os.ftruncate(descriptor, size)
+            self.__map = mmap.mmap(descriptor, size)
+        finally:
+            os.close(descriptor)
+        self.path = path
+        self.size = size
+
+    def sequence(self):
+        """
+        Returns the sequence number, which changes whenever the state does.
+        """
+        return header.unpack_from(self.__map, 0)[0]
+
+    def read(self):
+        """
+        Returns the sequence number and the state (None if no state has been
+        written yet, or if it stays half-written, as when a writer died).
+        """
+        for attempt in range(1000):
+            sequence, length = header.unpack_from(self.__map, 0)
+            if sequence % 2: continue # Being written
+            data = self.__map[header.size:header.size + length]
+            if header.unpack_from(self.__map, 0)[0] != sequence: continue
+            if not length: return sequence, None
+            return sequence, plain(json.loads(data))
+        return sequence, None
+
+    def write(self, state):
+        """
+        Replaces the state; returns the new sequence number.
+        """
+        data = json.dumps(state, sort_keys=True)
+        if header.size + len(data) > self.size:
+            raise ValueError("The state doesn't fit in '%s'" % self.path)
+        sequence, length = header.unpack_from(self.__map, 0)
+        if sequence % 2: sequence += 1 # A writer died half way through
+        header.pack_into(self.__map, 0, sequence + 1, length)
+        self.__map[header.size:header.size + len(data)] = data
+        header.pack_into(self.__map, 0, sequence + 2, len(data))
+        return sequence + 2
+
+    def close(self):
+        self.__map.close()
+
+
+class SharedSession(object):
+    """
+    Context manager wrapped around each exchange in shared mode: takes the
+    port lock, picks up any state published by other processes, and on the
+    way out publishes the state if this process has changed it.
+
+    If watch is given, a thread also checks every watch seconds for state
+    published by other processes, and picks it up.
+    """
+
+    def __init__(self, store, path, watch=None):
+        self.store = store
+        self.lock = PortLock('%s.lock' % path)
+        try:
+            self.file = SharedStateFile('%s.state' % path)
+        except:
+            self.lock.close()
+            raise
+        self.__seen = None # Sequence number of the state last loaded
+        self.__changed = False
+        store.add_listener(self._state_changed)
+        with self.lock: self._load()
+
+        self.__watching = watch is not None
+        self.__watcher = None
+        if self.__watching:
+            self.__watcher = threading.Thread(target=self._watch,
+                                              args=(watch,))
+            self.__watcher.setDaemon(True)
+            self.__watcher.start()
+
+    def _watch(self, interval):
+        """
+        Body of the watcher thread.
+        """
+        while self.__watching:
+            sleep(interval)
+            if self.__watching and self.file.sequence() != self.__seen:
+                with self: pass
+
+    def _state_changed(self, field, old, new):
+        self.__changed = True
+
+    def _load(self):
+        sequence, state = self.file.read()
+        if state is not None: self.store.update(state)
+        self.__seen = sequence
+        self.__changed = False
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            if self.file.sequence() != self.__seen: self._load()
+        except:
+            self.lock.release()
+            raise
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        try:
+            if self.__changed:
+                self.__seen = self.file.write(self.store.snapshot())
+                self.__changed = False
+        finally:
+            self.lock.release()
+        return False
+
+    def close(self):
+        self.__watching = False
+        if self.__watcher is not None: self.__watcher.join()
+        with self.lock:
+            self.store.remove_listener(self._state_changed)
+            self.file.close()
+        self.lock.close()
+
+
+class NotShared(object):
+    """
+    Stands in for a SharedSession when not in shared mode, doing nothing.
+    """
+
+    def __enter__(self): return self
+
+    def __exit__(self, exception_type, exception, traceback): return False
+
+not_shared = NotShared()
@@ -0,0 +1,443 @@
+"""
+A simulated Azur 650R, for testing clients without the hardware.
+
+SimulatedAmplifier models the amplifier's state and replies (as understood
+from the serial protocol), and SimulatedSerial is a stand-in for a pyserial
+port connected to it, which can be passed to Azur650R in place of a port
+name:
+
+    amplifier = SimulatedAmplifier()
+    amp = Azur650R(amplifier.open_port())
+
+Several ports may be opened on the same amplifier; like several processes
+opening the same serial device, they share one receive buffer, so whichever
+reads first gets the bytes. Faults (lost bytes, delayed, duplicated or error
+replies, and disconnects) can be injected with a Faults instance.
+
+Like the real amplifier, the simulation can be given a processing time per
+command (command_time) and room to hold only a few commands which arrive
+while it is busy (command_buffer); anything arriving faster is silently
+dropped. See pacing.py for keeping within those limits. It can also take a
+while (warm_up_time) to answer anything after being switched on.
+"""
+
+# Python modules
+import random
+import threading
+from time import time
+
+
+class SimulatedDisconnect(IOError):
+    """
+    Raised when writing to a SimulatedSerial while it is disconnected
+    """
+    pass
+
+
+class Faults(object):
+    """
+    Probabilities (from 0 to 1) of faults occurring, per reply or command.
+    """
+
+    def __init__(self, drop_byte=0.0, delay=0.0, delay_time=0.2,
+                 duplicate=0.0, error=0.0, disconnect=0.0,
+                 disconnect_time=0.5, seed=None):
+        self.drop_byte = drop_byte # A byte of the reply goes missing
+        self.delay = delay # The reply is held back by delay_time seconds
+        self.delay_time = delay_time
+        self.duplicate = duplicate # The reply is sent twice
+        self.error = error # The command is rejected as invalid data
+        self.disconnect = disconnect # The line goes dead for disconnect_time
+        self.disconnect_time = disconnect_time
+        self.random = random.Random(seed)
+
+    def happens(self, probability):
+        return probability > 0 and self.random.random() < probability
+
+
+class SimulatedAmplifier(object):
+    """
+    The amplifier end of the simulation; holds the true state.
+    """
+
+    inputs = ('09', '01', '02', '03', '04', '05', '06', '07', '08', '10')
+    processing_modes = ('Stereo', 'PLII Movie', 'PLII Music', 'Neo:6 Cinema',
+                        'Neo:6 Music', 'DSP')
+    codecs = ('PCM', 'Dolby Digital', 'DTS')
+    presets = {1: '87.50', 2: '95.80', 3: '101.10', 5: '104.30', 8: '1089'}
+
+    def __init__(self, faults=None, reply_time=0.01, main_version='1.3',
+                 protocol_version='1.0', command_time=0.0, command_buffer=1,
+                 warm_up_time=0.0):
+        """
+        Creates a simulated amplifier which replies reply_time seconds after
+        handling each command (about the time the reply takes to send at
+        9600 baud). Handling a command takes command_time seconds, during
+        which up to command_buffer further commands are held; any more are
+        dropped without a reply. For warm_up_time seconds after power on,
+        commands are ignored.
+        """
+        self.faults = faults or Faults()
+        self.reply_time = reply_time
+        self.main_version = main_version
+        self.protocol_version = protocol_version
+        self.command_time = command_time
+        self.command_buffer = command_buffer
+        self.warm_up_time = warm_up_time
+        self.commands = 0 # Number of commands received
+        self.dropped = 0 # Number of commands dropped for arriving too fast
+
+        self.power_state = False
+        self.volume = -40
+        self.bass = 0
+        self.treble = 0
+        self.subwoofer = True
+        self.lfe_trim = 0
+        self.mute_state = False
+        self.osd_on = False
+        self.lip_sync = 0
+        self.active_input = '01'
+        self.audio_source_for_input = dict([(input_id, '0') for input_id in
+                                            self.inputs if input_id != '10'])
+        self.video_source_for_input = dict(self.audio_source_for_input)
+        self.tuner_band = '0'
+        self.tuner_frequency = '87.50'
+        self.tuner_preset = '01'
+        self.tuner_mode = '1'
+        self.stereo_audio_mode = '00'
+        self.processing_mode = 0
+        self.codec = 0
+
+        self.__lock = threading.Condition()
+        self.__output = [] # (time due, bytes) waiting to be read
+        self.__received = '' # Partial command
+        self.__disconnected_until = 0
+        self.__busy_until = 0 # When the last command accepted is handled
+        self.__warm_at = 0 # When it starts answering after power on
+
+    def open_port(self, timeout=0.08):
+        """
+        Returns a new SimulatedSerial connected to this amplifier.
+        """
+        return SimulatedSerial(self, timeout)
+
+    def state(self):
+        """
+        Returns the true state, in the same form as Azur650R.get_state().
+        """
+        return {
+            'power_state': self.power_state,
+            'volume': self.volume,
+            'bass': self.bass,
+            'treble': self.treble,
+            'subwoofer': self.subwoofer,
+            'mute_state': self.mute_state,
+            'osd_on': self.osd_on,
+            'lip_sync': self.lip_sync,
+            'active_input': self.active_input,
+            'audio_source_for_input': dict(self.audio_source_for_input),
+            'video_source_for_input': dict(self.video_source_for_input),
+            'tuner_band': self.tuner_band,
+            'tuner_frequency': self.tuner_frequency,
+            'tuner_preset': self.tuner_preset,
+            'stereo_audio_mode': self.stereo_audio_mode,
+            'signal_processing_mode':
+                self.processing_modes[self.processing_mode],
+            'signal_codec': self.codecs[self.codec],
+        }
+
+    # Serial line ------------------------------------------------------------
+
+    def _receive(self, data):
+        """
+        Accepts bytes written to any port; each complete command is handled
+        and its reply queued.
+        """
+        with self.__lock:
+            if time() < self.__disconnected_until:
+                raise SimulatedDisconnect("The amplifier is disconnected")
+            self.__received += data
+            while '\r' in self.__received:
+                command, self.__received = self.__received.split('\r', 1)
+                self.commands += 1
+
+                # Is it ready, and is there room for the command?
+                now = time()
+                if now < self.__warm_at:
+                    self.dropped += 1
+                    continue
+                start = max(now, self.__busy_until)
+                if start - now > self.command_time * self.command_buffer:
+                    self.dropped += 1
+                    continue
+                self.__busy_until = start + self.command_time
+
+                self._queue(self._reply_to(command), self.__busy_until)
+                if self.faults.happens(self.faults.disconnect):
+                    self.__disconnected_until = time() + \
+                                                self.faults.disconnect_time
+                    self.__received = ''
+                    break
+
+    def _queue(self, reply, handled):
+        """
+        Queues the reply to a command handled at the given time, applying any
+        faults.
+        """
+        faults = self.faults
+        due = handled + self.reply_time
+        if faults.happens(faults.delay): due += faults.delay_time
+        if faults.happens(faults.drop_byte):
+            position = faults.random.randrange(len(reply))
+            reply = reply[:position] + reply[position + 1:]
+        self.__output.append((due, reply))
+        if faults.happens(faults.duplicate):
+            self.__output.append((due, reply))
+        self.__output.sort(key=lambda item: item[0])
+        self.__lock.notifyAll()
+
+    def _send(self, size, timeout):
+        """
+        Returns up to size bytes of replies, waiting up to timeout seconds
+        for them to be due, like a pyserial read().
+        """
+        deadline = time() + (timeout or 0)
+        result = ''
+        with self.__lock:
+            while len(result) < size:
+                now = time()
+                if self.__output and self.__output[0][0] <= now:
+                    due, reply = self.__output.pop(0)
+                    wanted = size - len(result)
+                    result += reply[:wanted]
+                    if len(reply) > wanted:
+                        self.__output.insert(0, (due, reply[wanted:]))
+                    continue
+                if now >= deadline: break
+                wait = deadline - now
+                if self.__output: wait = min(wait, self.__output[0][0] - now)
+                self.__lock.wait(max(wait, 0.001))
+        return result
+
+    def _waiting(self):
+        """
+        Returns the number of bytes which could be read now.
+        """
+        with self.__lock:
+            now = time()
+            return sum([len(reply) for due, reply in self.__output
+                        if due <= now])
+
+    # Protocol ---------------------------------------------------------------
+
+    def _reply_to(self, command):
+        """
+        Handles a command (without the trailing carriage return), returning
+        the reply (or replies) to send.
+        """
+        if not command.startswith('#'): return '#11,01\r'
+        parts = command[1:].split(',')
+        group, number = parts[0], (parts[1:] or [''])[0]
+        data = len(parts) > 2 and parts[2] or None
+
+        handler = getattr(self, '_group_%s' % group, None)
+        if handler is None: return '#11,01\r'
+        if self.faults.happens(self.faults.error): return '#11,03\r'
+        try:
+            replies = handler(number, data)
+        except (KeyError, ValueError, TypeError):
+            return '#11,03\r'
+        if replies is None: return '#11,02\r'
+
+        reply_group = str(int(group) + 5)
+        if isinstance(replies, str): replies = [(number, replies)]
+        return ''.join([self._format(reply_group, reply_number, reply_data)
+                        for reply_number, reply_data in replies])
+
+    def _format(self, group, number, data):
+        """
+        Formats one reply; the 'input' reply (sent on power on) is the
+        current input.
+        """
+        if number == 'input': return '#7,01,%s\r' % self.active_input
+        if data is None: return '#%s,%s\r' % (group, number)
+        return '#%s,%s,%s\r' % (group, number, data)
+
+    def _step(self, value, step, minimum, maximum):
+        value += step
+        if value < minimum or value > maximum: raise ValueError(value)
+        return value
+
+    def _group_1(self, number, data):
+        """
+        Amplifier commands
+        """
+        if number == '01':
+            power_state = {'0': False, '1': True}[data]
+            if power_state and not self.power_state:
+                self.__warm_at = time() + self.warm_up_time
+            self.power_state = power_state
+            return [('input', None), ('01', data)]
+        if number in ('02', '03'):
+            step = number == '02' and 1 or -1
+            self.volume = max(-90, min(0, self.volume + step))
+            return str(self.volume)
+        if number in ('04', '05'):
+            step = number == '04' and 1 or -1
+            self.bass = self._step(self.bass, step, -10, 10)
+            return str(self.bass)
+        if number in ('06', '07'):
+            step = number == '06' and 2 or -2
+            self.treble = self._step(self.treble, step, -10, 10)
+            if self.treble > 0: return '+ %s' % self.treble
+            if self.treble < 0: return '- %s' % -self.treble
+            return ' 0'
+        if number in ('08', '09'):
+            self.subwoofer = number == '08'
+            return [(number, None)]
+        if number == '10':
+            if not 0 <= int(data) <= 10: raise ValueError(data)
+            self.lfe_trim = int(data)
+            return data
+        if number == '11':
+            self.mute_state = {'00': False, '01': True}[data]
+            return str(int(data))
+        if number in ('13', '14'):
+            self.osd_on = number == '13'
+            return [(number, None)]
+        if number in ('15', '16', '17', '18', '19'):
+            return [(number, None)]
+        if number in ('20', '21'):
+            step = number == '21' and 10 or -10
+            self.lip_sync = self._step(self.lip_sync, step, 0, 200)
+            return str(self.lip_sync)
+
+    def _group_2(self, number, data):
+        """
+        Source commands
+        """
+        if number == '01':
+            if data == '00': data = '09'
+            if data not in self.inputs: raise ValueError(data)
+            self.active_input = data
+            return data
+        if number in ('02', '03'):
+            step = number == '03' and 1 or -1
+            index = self.inputs.index(self.active_input) + step
+            self.active_input = self.inputs[index % len(self.inputs)]
+            return self.active_input
+        if number == '04':
+            if int(data) > 2: raise ValueError(data)
+            self.audio_source_for_input[self.active_input] = str(int(data))
+            return str(int(data))
+        if number == '05':
+            if int(data) > 3: raise ValueError(data)
+            self.video_source_for_input[self.active_input] = str(int(data))
+            return str(int(data))
+
+    def _group_3(self, number, data):
+        """
+        Tuner commands
+        """
+        if number in ('01', '02', '03'):
+            if number == '03':
+                preset = int(data)
+                if preset not in self.presets: raise ValueError(data)
+            else:
+                presets = sorted(self.presets.keys())
+                index = 0
+                if self.tuner_preset is not None and \
+                   int(self.tuner_preset) in presets:
+                    index = presets.index(int(self.tuner_preset))
+                    index += number == '01' and 1 or -1
+                preset = presets[index % len(presets)]
+            self.tuner_preset = '%02d' % preset
+            self.tuner_frequency = self.presets[preset]
+            self.tuner_band = float(self.tuner_frequency) < 200 and '0' or '1'
+            return self.tuner_preset
+        if number in ('04', '05'):
+            sign = number == '04' and 1 or -1
+            if self.tuner_band == '0':
+                frequency = float(self.tuner_frequency) + sign * 0.05
+                self.tuner_frequency = '%.2f' % frequency
+            else:
+                frequency = int(self.tuner_frequency) + sign * 9
+                self.tuner_frequency = '%d' % frequency
+            self.tuner_preset = None
+            return self.tuner_frequency
+        if number == '06':
+            band = str(int(data))
+            if band not in ('0', '1'): raise ValueError(data)
+            if band != self.tuner_band:
+                self.tuner_band = band
+                self.tuner_frequency = band == '0' and '87.50' or '531'
+                self.tuner_preset = None
+            return band
+        if number == '07':
+            return self.tuner_frequency
+        if number == '08':
+            self.tuner_mode = {'00': '0', '01': '1'}[data]
+            return self.tuner_mode
+
+    def _group_4(self, number, data):
+        """
+        Audio processing commands
+        """
+        if number == '01':
+            if data not in ('00', '01'): raise ValueError(data)
+            self.stereo_audio_mode = data
+            return data
+        if number == '02':
+            self.processing_mode += 1
+            self.processing_mode %= len(self.processing_modes)
+        if number == '03':
+            self.codec = (self.codec + 1) % len(self.codecs)
+        if number in ('02', '04'):
+            return self.processing_modes[self.processing_mode]
+        if number in ('03', '05'):
+            return self.codecs[self.codec]
+
+    def _group_5(self, number, data):
+        """
+        Version commands
+        """
+        if number == '01': return self.main_version
+        if number == '02': return self.protocol_version
+
+
+class SimulatedSerial(object):
+    """
+    A pyserial-like port connected to a SimulatedAmplifier.
+    """
+
+    def __init__(self, amplifier, timeout=0.08):
+        self.amplifier = amplifier
+        self.timeout = timeout
+        self.port = 'simulated'
+        self.bytes_written = 0
+        self.__open = True
+
+    def write(self, data):
+        if not self.__open: raise IOError("Port not open")
+        self.amplifier._receive(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def read(self, size=1):
+        if not self.__open: raise IOError("Port not open")
+        return self.amplifier._send(size, self.timeout)
+
+    def inWaiting(self):
+        return self.amplifier._waiting()
+
+    def flush(self):
+        pass
+
+    def open(self):
+        self.__open = True
+
+    def close(self):
+        self.__open = False
+
+    def isOpen(self):
+        return self.__open
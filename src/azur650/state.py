@@ -0,0 +1,217 @@
+"""
+An observable store for the state of an amplifier. Azur650R keeps all of its
+state fields here; anything interested in changes (e.g. a user interface) can
+subscribe to the fields it displays instead of polling the properties.
+
+Changes are delivered to each subscriber on its own thread, coalesced over a
+short window: a burst of changes (such as a volume ramp) arrives as a single
+batch holding each field's value before the burst and after it. While a
+subscriber is busy handling one batch, further changes are merged into the
+next, so a slow subscriber never holds up the amplifier or other subscribers,
+and its backlog can never grow beyond one batch.
+"""
+
+# Python modules
+import sys
+import threading
+import traceback
+from copy import deepcopy
+from time import time
+
+
+class Subscription(object):
+    """
+    A subscriber's registration with a StateStore; see StateStore.subscribe.
+    """
+
+    def __init__(self, callback, fields, window):
+        self.callback = callback
+        self.fields = fields
+        self.window = window
+        self.delivered = 0 # Number of batches delivered
+        self.coalesced = 0 # Number of changes merged into another
+        self.__pending = {} # Field -> [value before, value after]
+        self.__first_change = None
+        self.__active = True
+        self.__condition = threading.Condition()
+        self.__thread = threading.Thread(target=self._deliver)
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def _notify(self, field, old, new):
+        """
+        Queues a change for delivery, merging it with any undelivered change
+        to the same field.
+        """
+        if self.fields is not None and field not in self.fields: return
+        with self.__condition:
+            if field in self.__pending:
+                self.__pending[field][1] = new
+                self.coalesced += 1
+            else:
+                self.__pending[field] = [old, new]
+            if self.__first_change is None:
+                self.__first_change = time()
+                self.__condition.notify()
+
+    def _deliver(self):
+        """
+        Body of the delivery thread.
+        """
+        while True:
+            with self.__condition:
+                while self.__active and not self.__pending:
+                    self.__condition.wait()
+                if not self.__pending: return
+
+                # Let the window fill up before delivering.
+                while self.__active:
+                    remaining = self.__first_change + self.window - time()
+                    if remaining <= 0: break
+                    self.__condition.wait(remaining)
+
+                batch = self.__pending
+                self.__pending = {}
+                self.__first_change = None
+
+            # Changes which cancelled out aren't changes.
+            changes = dict([(field, (old, new))
+                            for field, (old, new) in batch.items()
+                            if old != new])
+            if not changes: continue
+            try:
+                self.callback(changes)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+            self.delivered += 1
+
+    def cancel(self):
+        """
+        Stops deliveries; anything still pending is delivered first.
+        """
+        with self.__condition:
+            self.__active = False
+            self.__condition.notify()
+        if threading.currentThread() is not self.__thread:
+            self.__thread.join()
+
+
+class StateStore(object):
+    """
+    Holds the values of a fixed set of state fields, and notifies subscribers
+    when they change.
+    """
+
+    def __init__(self, fields, values=None):
+        """
+        Creates a store for the named fields, all initially None. Values may
+        be any mapping to keep the values in (by default a new dictionary).
+        """
+        if values is None: values = {}
+        for field in fields: values.setdefault(field, None)
+        self.fields = tuple(fields)
+        self.__values = values
+        self.__lock = threading.RLock()
+        self.__subscriptions = []
+        self.__listeners = []
+        self.__updated = {} # Field -> when it was last set (see updated())
+
+    def __getitem__(self, field):
+        return self.__values[field]
+
+    def __setitem__(self, field, value):
+        self.set(field, value)
+
+    def set(self, field, value):
+        """
+        Sets a field, notifying subscribers if the value has changed.
+        """
+        with self.__lock:
+            old = self.__values[field]
+            self.__values[field] = value
+            self.__updated[field] = time()
+            if old != value:
+                for listener in self.__listeners:
+                    listener(field, old, value)
+                for subscription in self.__subscriptions:
+                    subscription._notify(field, old, value)
+
+    def set_item(self, field, key, value):
+        """
+        Sets a single item of a dictionary field. The dictionary is replaced
+        rather than changed in place, so subscribers can tell the old value
+        from the new one.
+        """
+        with self.__lock:
+            values = dict(self.__values[field] or {})
+            values[key] = value
+            self.set(field, values)
+
+    def snapshot(self):
+        """
+        Returns a copy of every field as a dictionary.
+        """
+        with self.__lock:
+            return deepcopy(dict([(field, self.__values[field])
+                                  for field in self.fields]))
+
+    def update(self, values):
+        """
+        Sets several fields from a dictionary; unknown fields are ignored.
+        The values are taken to be restored rather than current, so the
+        fields count as never having been updated.
+        """
+        with self.__lock:
+            for field in self.fields:
+                if field in values:
+                    self.set(field, deepcopy(values[field]))
+                    del self.__updated[field]
+
+    def updated(self, field):
+        """
+        Returns when the field was last set (whether or not its value
+        changed), or None if it never has been since it was restored.
+        """
+        return self.__updated.get(field)
+
+    def subscribe(self, callback, fields=None, window=0.1):
+        """
+        Registers callback to be told about changes to the named fields (or
+        to all fields, if fields is None). The callback is given a dictionary
+        mapping each changed field to its (old, new) values, and is called
+        at most once per window (seconds); see the module documentation.
+        Returns a Subscription, which can be passed to unsubscribe().
+        """
+        if fields is not None:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise KeyError("Unknown fields: %s" % ', '.join(unknown))
+            fields = frozenset(fields)
+        subscription = Subscription(callback, fields, window)
+        with self.__lock:
+            self.__subscriptions.append(subscription)
+        return subscription
+
+    def add_listener(self, listener):
+        """
+        Registers listener to be called as listener(field, old, new) for
+        every change, straight away and on the thread making the change. Keep
+        listeners quick; subscribe() is better for anything that isn't.
+        """
+        with self.__lock:
+            self.__listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Removes a listener added with add_listener().
+        """
+        with self.__lock:
+            self.__listeners.remove(listener)
+
+    def unsubscribe(self, subscription):
+        """
+        Cancels a subscription.
+        """
+        with self.__lock:
+            self.__subscriptions.remove(subscription)
+        subscription.cancel()
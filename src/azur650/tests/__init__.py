@@ -0,0 +1,50 @@
+"""
+Tests, run against the simulated amplifier (see simulator.py); no hardware
+or pyserial is needed:
+
+    python setup.py test
+
+or, from the src directory:
+
+    python -m unittest discover -s azur650/tests -t .
+"""
+
+# Local modules
+from azur650.command import Azur650R
+from azur650.simulator import SimulatedAmplifier, SimulatedSerial
+
+
+def simulated(**options):
+    """
+    Returns a SimulatedAmplifier (created with the given options) and an
+    Azur650R connected to it.
+    """
+    amplifier = SimulatedAmplifier(**options)
+    return amplifier, Azur650R(amplifier.open_port())
+
+
+class ScriptedSerial(SimulatedSerial):
+    """
+    A SimulatedSerial which can be told to swallow writes (so they are never
+    answered), to slip extra bytes in front of the replies (such as damaged
+    frames), or to fail every read, as a port which has gone would.
+    """
+
+    def __init__(self, amplifier, timeout=0.08):
+        SimulatedSerial.__init__(self, amplifier, timeout)
+        self.swallow = 0 # Number of writes to swallow
+        self.inject = '' # Bytes to return before the next replies
+        self.broken = False
+
+    def write(self, data):
+        if self.swallow:
+            self.swallow -= 1
+            return len(data)
+        return SimulatedSerial.write(self, data)
+
+    def read(self, size=1):
+        if self.broken: raise IOError("The port has gone")
+        if self.inject:
+            data, self.inject = self.inject[:size], self.inject[size:]
+            return data
+        return SimulatedSerial.read(self, size)
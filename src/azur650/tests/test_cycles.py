@@ -0,0 +1,67 @@
+"""
+Selecting DSP modes and CODECs, which can only be cycled through.
+"""
+
+# Python modules
+import unittest
+
+# Local modules
+from azur650.tests import simulated
+
+
+class CycleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier, self.amp = simulated()
+        self.amp.input_select('01') # Cycles are learned for each input
+
+    def sent(self, method, *args):
+        """
+        Calls a method, returning its result and the number of commands it
+        sent.
+        """
+        before = self.amplifier.commands
+        result = getattr(self.amp, method)(*args)
+        return result, self.amplifier.commands - before
+
+    def mode(self):
+        return self.amplifier.processing_modes[self.amplifier.processing_mode]
+
+    def test_learned_once(self):
+        self.amp.set_digital_processing_mode('DSP')
+        self.assertEqual(self.mode(), 'DSP')
+        cycles = self.amp.get_state()['processing_mode_cycles']
+        self.assertEqual(cycles, {'01/PCM': [
+            'Stereo', 'PLII Movie', 'PLII Music', 'Neo:6 Cinema',
+            'Neo:6 Music', 'DSP']})
+
+        # From then on: the mode and CODEC asked for, then the steps.
+        self.assertEqual(self.sent('set_digital_processing_mode',
+                                   'PLII Music'), ('PLII Music', 2 + 3))
+        self.assertEqual(self.mode(), 'PLII Music')
+        self.assertEqual(self.sent('set_digital_processing_mode',
+                                   'PLII Music'), ('PLII Music', 2))
+
+    def test_codec(self):
+        self.assertEqual(self.amp.set_codec('DTS'), 'DTS')
+        self.assertEqual(self.amplifier.codec, 2)
+        self.assertEqual(self.sent('set_codec', 'PCM'), ('PCM', 2 + 1))
+
+    def test_unreachable(self):
+        self.assertRaises(ValueError, self.amp.set_digital_processing_mode,
+                          'THX')
+        self.assertEqual(self.mode(), 'Stereo')
+
+    def test_relearned(self):
+        # A cached cycle which is out of date (as when the modes on offer
+        # change) is learned again when the check at the end fails.
+        self.amp.state.set_item('processing_mode_cycles', '01/PCM',
+                                ['Stereo', 'DSP', 'PLII Movie'])
+        self.assertEqual(self.amp.set_digital_processing_mode('DSP'), 'DSP')
+        self.assertEqual(self.mode(), 'DSP')
+        self.assertEqual(len(self.amp.get_state()['processing_mode_cycles']
+                             ['01/PCM']), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+The daemon and the azur650 command.
+"""
+
+# Python modules
+from cStringIO import StringIO
+import os
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+# Local modules
+import azur650
+from azur650 import cli
+from azur650.daemon import Azur650Daemon, DaemonClient, DaemonError, \
+                           default_socket
+from azur650.tests import simulated
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environment = dict(os.environ)
+        os.environ['XDG_RUNTIME_DIR'] = self.directory
+        os.environ.pop('AZUR650_SOCKET', None)
+        self.amplifier, amp = simulated()
+        self.server = Azur650Daemon(amp)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.client = DaemonClient.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ.clear()
+        os.environ.update(self.environment)
+        shutil.rmtree(self.directory)
+
+    def run_cli(self, *argv):
+        """
+        Runs the azur650 command, returning the exit status and what it
+        wrote to stdout and stderr.
+        """
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            status = cli.main(list(argv))
+            return status, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_commands(self):
+        self.assertEqual(self.client.call('volume_up'), '-39')
+        self.assertEqual(self.client.call('volume'), -39)
+        self.client.call('command', 'mute', '01')
+        self.assertTrue(self.client.call('get_state')['mute_state'])
+
+    def test_not_available(self):
+        path = os.path.join(self.directory, 'model.json')
+        for method, args in (('save_step_model', [path]),
+                             ('disconnect', []),
+                             ('_cmd', ['1', '02']),
+                             ('enable_sharing', [path]),
+                             ('volume', [1])):
+            self.assertRaises(DaemonError, self.client.call, method, *args)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.amplifier.commands, 0)
+
+    def test_socket(self):
+        path = os.path.join(self.directory, 'azur650.sock')
+        self.assertEqual(self.server.server_address, path)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0600)
+        os.environ['AZUR650_SOCKET'] = '/somewhere/else.sock'
+        self.assertEqual(default_socket(), '/somewhere/else.sock')
+
+    def test_not_a_socket(self):
+        path = os.path.join(self.directory, 'planted.sock')
+        open(path, 'w').close()
+        self.assertRaises(IOError, DaemonClient.connect, path)
+
+    @unittest.skipUnless(os.getuid() == 0, "Needs to give files away")
+    def test_other_users_socket(self):
+        path = os.path.join(self.directory, 'planted.sock')
+        planted = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            planted.bind(path)
+            planted.listen(1)
+            os.chown(path, 12345, 12345)
+            self.assertRaises(IOError, DaemonClient.connect, path)
+            self.assertRaises(IOError, Azur650Daemon, None, path)
+        finally:
+            planted.close()
+
+    def test_unknown_state(self):
+        # The daemon hasn't heard from the amplifier yet.
+        status, output, errors = self.run_cli('volume')
+        self.assertEqual((status, output), (1, ''))
+        self.assertEqual(errors, "azur650: The volume isn't known\n")
+        status, output, errors = self.run_cli('status')
+        self.assertEqual(status, 0)
+        self.assertTrue('volume: unknown\n' in output)
+        self.client.call('volume_up')
+        self.assertEqual(self.run_cli('volume'), (0, '-39\n', ''))
+
+
+class DirectClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier, amp = simulated()
+        self.amplifier.volume = -30
+        self.amplifier.active_input = '07'
+        self.client = cli.DirectClient(self.amplifier.open_port())
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_volume(self):
+        self.assertEqual(cli.run(self.client, 'volume', []), '-30')
+        self.assertEqual(self.amplifier.volume, -30)
+        self.assertEqual(cli.run(self.client, 'volume', ['up']), '-29')
+
+    def test_input(self):
+        self.assertEqual(cli.run(self.client, 'input', []), '07 CD')
+        self.assertEqual(self.amplifier.active_input, '07')
+        self.assertEqual(cli.run(self.client, 'input', ['aux']), '06 Aux')
+
+    def test_status(self):
+        lines = cli.run(self.client, 'status', []).splitlines()
+        for line in ('volume: -30', 'active_input: 07',
+                     'signal_codec: PCM', 'protocol_version: 1.0',
+                     'power_state: unknown'):
+            self.assertTrue(line in lines, line)
+
+    def test_port_error(self):
+        def unavailable(serial_port):
+            raise IOError("Could not open port %s" % serial_port)
+        direct_client, cli.DirectClient = cli.DirectClient, unavailable
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            status = cli.main(['--direct', '--port', '/dev/nothing',
+                               'volume'])
+            message = sys.stderr.getvalue()
+        finally:
+            cli.DirectClient = direct_client
+            sys.stderr = stderr
+        self.assertEqual(status, 1)
+        self.assertEqual(message,
+                         'azur650: Could not open port /dev/nothing\n')
+
+    def test_imports(self):
+        # Starting the command shouldn't load the gateway or pyserial.
+        check = ('import sys, azur650.cli; '
+                 'print [name for name in ("serial", "BaseHTTPServer") '
+                 'if name in sys.modules]')
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+                                        os.path.abspath(azur650.__file__)))
+        output = subprocess.Popen([sys.executable, '-c', check],
+                                  stdout=subprocess.PIPE,
+                                  env=environment).communicate()[0]
+        self.assertEqual(output.strip(), '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
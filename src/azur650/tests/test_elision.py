@@ -0,0 +1,97 @@
+"""
+Skipping commands whose effect is already in fresh state.
+"""
+
+# Python modules
+import os
+import shutil
+import tempfile
+from time import sleep
+import unittest
+
+# Local modules
+from azur650.command import Azur650R
+from azur650.tests import simulated
+
+
+class ElisionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier, self.amp = simulated()
+        self.amp.enable_elision()
+
+    def test_repeated(self):
+        self.amp.set_mute(True)
+        self.amp.input_select('00')
+        commands = self.amplifier.commands
+        self.assertTrue(self.amp.set_mute(True))
+        self.amp.input_select('00')
+        self.assertEqual(self.amplifier.commands, commands)
+        self.assertEqual(self.amp.elided, 2)
+        self.assertEqual(self.amp.active_input, ('09', 'Tuner'))
+
+    def test_changed(self):
+        self.amp.set_mute(True)
+        commands = self.amplifier.commands
+        self.amp.set_mute(False)
+        self.assertEqual(self.amplifier.commands, commands + 1)
+        self.assertFalse(self.amplifier.mute_state)
+
+    def test_stale(self):
+        self.amp.enable_elision(freshness=0.1)
+        self.amp.set_mute(True)
+        sleep(0.2)
+        commands = self.amplifier.commands
+        self.amp.set_mute(True)
+        self.assertEqual(self.amplifier.commands, commands + 1)
+
+    def test_field_freshness(self):
+        self.amp.enable_elision(fields={'mute_state': 0})
+        self.amp.set_mute(True)
+        self.amp.input_select('03')
+        commands = self.amplifier.commands
+        self.amp.set_mute(True)
+        self.amp.input_select('03')
+        self.assertEqual(self.amplifier.commands, commands + 1)
+
+    def test_forced(self):
+        self.amp.set_mute(True)
+        # Muted on the front panel; the state doesn't know.
+        self.amplifier.mute_state = False
+        commands = self.amplifier.commands
+        with self.amp.forced():
+            self.amp.set_mute(True)
+        self.assertEqual(self.amplifier.commands, commands + 1)
+        self.assertTrue(self.amplifier.mute_state)
+
+    def test_restored(self):
+        self.amp.set_mute(True)
+        state = self.amp.get_state()
+        amplifier, amp = simulated()
+        amp.set_state(state)
+        amp.enable_elision()
+        amp.set_mute(True)
+        self.assertEqual(amplifier.commands, 1)
+        self.assertTrue(amplifier.mute_state)
+
+    def test_shared(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'amplifier')
+        other = Azur650R(self.amplifier.open_port())
+        try:
+            self.amp.enable_sharing(path)
+            self.amp.set_mute(True)
+            other.enable_sharing(path)
+            other.enable_elision()
+            self.assertTrue(other.get_state()['mute_state'])
+            commands = self.amplifier.commands
+            other.set_mute(True)
+            self.assertEqual(self.amplifier.commands, commands + 1)
+        finally:
+            self.amp.disable_sharing()
+            other.disable_sharing()
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
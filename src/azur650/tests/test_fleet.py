@@ -0,0 +1,72 @@
+"""
+Amplifiers keeping their state in a FleetStateTable.
+"""
+
+# Python modules
+import unittest
+
+# Local modules
+from azur650.command import Azur650R
+from azur650.simulator import SimulatedAmplifier
+
+try:
+    from azur650.fleet import FleetStateTable
+except ImportError: # No NumPy
+    FleetStateTable = None
+
+
+@unittest.skipIf(FleetStateTable is None, "Needs NumPy")
+class FleetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = FleetStateTable()
+        self.rows = [self.table.add_row(name) for name in 'abc']
+        self.amplifier = SimulatedAmplifier()
+        self.amp = Azur650R(self.amplifier.open_port(),
+                            state_values=self.table.row(self.rows[1]))
+        self.changes = []
+        self.amp.state.add_listener(
+            lambda field, old, new: self.changes.append((field, old, new)))
+
+    def test_replies(self):
+        self.amp.volume_up()
+        self.assertEqual(self.table.get(self.rows[1], 'volume'), -39)
+        self.assertEqual(self.changes, [('volume', None, -39)])
+
+    def test_bulk_replies(self):
+        self.table.apply_replies(self.rows, [('6', '02', '-20'),
+                                             ('6', '02', '-21'),
+                                             ('6', '11', '1')])
+        self.assertEqual(self.changes, [('volume', None, -21)])
+        self.assertEqual(self.amp.volume, -21)
+        self.assertEqual(self.table.get(self.rows[0], 'volume'), -20)
+        self.assertEqual(self.table.find(volume__lt=-20), [self.rows[1]])
+
+    def test_undecodable_replies(self):
+        self.table.apply_replies(self.rows, [('6', '02', ''),
+                                             ('6', '11', '7'),
+                                             ('6', '11', '1')])
+        self.assertEqual(self.changes, [])
+        self.assertEqual(self.table.get(self.rows[2], 'mute_state'), True)
+
+    def test_strings(self):
+        self.table.set(self.rows[0], 'active_input', '01')
+        self.table.set(self.rows[2], 'active_input', '07')
+        self.assertEqual(list(self.table.find(active_input='07')),
+                         [self.rows[2]])
+        self.assertEqual(list(self.table.find(active_input__ne='07')),
+                         [self.rows[0]])
+        # Never stored, so every row where the input is known differs.
+        self.assertEqual(list(self.table.find(active_input__ne='05')),
+                         [self.rows[0], self.rows[2]])
+        self.assertEqual(list(self.table.find(active_input='05')), [])
+        self.assertEqual(list(self.table.find(active_input__in=['05', '01'])),
+                         [self.rows[0]])
+        for op in ('lt', 'le', 'gt', 'ge'):
+            self.assertRaises(ValueError, self.table.mask,
+                              **{'active_input__' + op: '01'})
+        self.assertRaises(ValueError, self.table.mask, volume__like=-20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+The HTTP gateway: cached state with ETags, long polls and commands.
+"""
+
+# Python modules
+import httplib
+import json
+import threading
+from time import sleep, time
+import unittest
+
+# Local modules
+from azur650.gateway import Gateway
+from azur650.tests import simulated
+
+
+class GatewayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier, self.amp = simulated()
+        self.amp.volume_up()
+        self.server = Gateway(self.amp, ('127.0.0.1', 0))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, method, path, body=None, headers={}):
+        """
+        Makes a request on a new connection, returning the status, the
+        headers and the body (read in full, so that the connection closes
+        cleanly).
+        """
+        connection = httplib.HTTPConnection(*self.server.server_address)
+        try:
+            if body is not None: body = json.dumps(body)
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), \
+                   response.read()
+        finally:
+            connection.close()
+
+    def test_state(self):
+        status, headers, body = self.request('GET', '/state')
+        self.assertEqual(status, 200)
+        self.assertTrue(headers.get('etag'))
+        self.assertEqual(json.loads(body)['volume'], -39)
+
+    def test_not_modified(self):
+        etag = self.request('GET', '/state')[1]['etag']
+        commands = self.amplifier.commands
+        status, headers, body = self.request('GET', '/state',
+                                             headers={'If-None-Match': etag})
+        self.assertEqual((status, headers['etag'], body), (304, etag, ''))
+        self.assertEqual(self.amplifier.commands, commands)
+
+    def test_etag_changes(self):
+        etag = self.request('GET', '/state')[1]['etag']
+        status, headers, body = self.request('POST', '/volume',
+                                             {'step': 'up'})
+        self.assertEqual((status, json.loads(body)), (200, {'result': '-38'}))
+        status, headers, body = self.request('GET', '/state',
+                                             headers={'If-None-Match': etag})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers['etag'], etag)
+        self.assertEqual(json.loads(body)['volume'], -38)
+
+    def test_long_poll(self):
+        etag = self.request('GET', '/state')[1]['etag']
+        def change():
+            sleep(0.3)
+            self.server.call('set_mute', [True])
+        thread = threading.Thread(target=change)
+        thread.start()
+        started = time()
+        status, headers, body = self.request('GET', '/state?wait=10',
+                                             headers={'If-None-Match': etag})
+        thread.join()
+        self.assertTrue(time() - started < 5)
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)['mute_state'])
+
+    def test_long_poll_timeout(self):
+        etag = self.request('GET', '/state')[1]['etag']
+        started = time()
+        status, headers, body = self.request('GET', '/state?wait=0.3',
+                                             headers={'If-None-Match': etag})
+        self.assertTrue(time() - started >= 0.3)
+        self.assertEqual((status, headers['etag']), (304, etag))
+
+    def test_errors(self):
+        self.assertEqual(self.request('GET', '/nothing')[0], 404)
+        self.assertEqual(self.request('GET', '/state?wait=soon')[0], 400)
+        self.assertEqual(self.request('POST', '/volume', {'step': 'x'})[0],
+                         400)
+        self.assertEqual(self.request('POST', '/mute', {})[0], 400)
+        status, headers, body = self.request('POST', '/command',
+                                             {'name': 'no_such_command'})
+        self.assertEqual(status, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+The bounded history of state changes.
+"""
+
+# Python modules
+import unittest
+
+# Local modules
+from azur650.history import StateHistory
+from azur650.tests import simulated
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = StateHistory(capacity=8, max_strings=3)
+        # The volume changes every 10 seconds from 100 on, the input at 125.
+        for step in range(6):
+            if step == 3: self.history.record('active_input', None, '01', 125)
+            self.history.record('volume', None, -40 + step, 100 + step * 10)
+
+    def test_value_at(self):
+        history = self.history
+        self.assertEqual(history.value_at('volume', 99), None)
+        self.assertEqual(history.value_at('volume', 99, -90), -90)
+        self.assertEqual(history.value_at('volume', 100), -40)
+        self.assertEqual(history.value_at('volume', 119.9), -39)
+        self.assertEqual(history.value_at('volume', 120), -38)
+        self.assertEqual(history.value_at('volume', 1000), -35)
+        self.assertEqual(history.value_at('active_input', 125), '01')
+        self.assertEqual(history.value_at('bass', 1000), None)
+
+    def test_changes(self):
+        history = self.history
+        self.assertEqual(history.changes(120, 130),
+                         [(120, 'volume', -38), (125, 'active_input', '01'),
+                          (130, 'volume', -37)])
+        self.assertEqual(history.changes(120, 120), [(120, 'volume', -38)])
+        self.assertEqual(history.changes(120.5, 124.5), [])
+        self.assertEqual(history.changes(140, fields=['volume']),
+                         [(140, 'volume', -36), (150, 'volume', -35)])
+        self.assertEqual(len(history.changes()), 7)
+        self.assertEqual(history.changes(fields=['bass']), [])
+
+    def test_wraparound(self):
+        history = self.history
+        for step in range(3):
+            history.record('mute_state', None, bool(step % 2), 200 + step)
+        self.assertEqual(len(history), 8)
+        changes = history.changes()
+        self.assertEqual(changes[0], (120, 'volume', -38))
+        self.assertEqual(changes[-1], (202, 'mute_state', False))
+        # The first two changes have been overwritten.
+        self.assertEqual(history.value_at('volume', 115), None)
+        self.assertEqual(history.value_at('volume', 120), -38)
+        self.assertEqual(history.changes(100, 120), [(120, 'volume', -38)])
+
+    def test_series(self):
+        # Each bucket has the value at its end, including a change made
+        # exactly then.
+        self.assertEqual(self.history.series('volume', 95, 155, 6),
+                         [(95, -40), (105, -39), (115, -38), (125, -37),
+                          (135, -36), (145, -35)])
+        self.assertEqual(self.history.series('volume', 80, 120, 2),
+                         [(80, -40), (100, -38)])
+        self.assertEqual(self.history.series('volume', 60, 80, 2),
+                         [(60, None), (70, None)])
+
+    def test_strings(self):
+        history = StateHistory(max_strings=2)
+        for when, mode in enumerate(('Stereo', 'DSP', 'Stereo', 'PLII')):
+            history.record('signal_processing_mode', None, mode, when)
+        self.assertEqual([value for when, field, value in
+                          history.changes()], ['Stereo', 'DSP', 'Stereo',
+                                               None])
+
+    def test_values(self):
+        history = StateHistory(exclude=['step_model'])
+        history.record('mute_state', None, True, 1)
+        history.record('dynamic_range', None, 0.5, 2)
+        history.record('step_model', None, {'volume': {}}, 3)
+        history.record('audio_source_for_input', {'01': '0', '02': '1'},
+                       {'01': '2', '02': '1'}, 4)
+        history.record('volume', -40, None, 5)
+        self.assertEqual(history.changes(),
+                         [(1, 'mute_state', True), (2, 'dynamic_range', 0.5),
+                          (4, 'audio_source_for_input[01]', '2'),
+                          (5, 'volume', None)])
+
+    def test_time_never_goes_back(self):
+        self.history.record('bass', None, 2, 50)
+        self.assertEqual(self.history.changes()[-1], (150, 'bass', 2))
+
+
+class AmplifierHistoryTest(unittest.TestCase):
+
+    def test_attached(self):
+        amplifier, amp = simulated()
+        history = StateHistory()
+        history.attach(amp.state)
+        amp.volume_up()
+        amp.set_mute(True)
+        history.detach(amp.state)
+        amp.volume_up()
+        self.assertEqual([(field, value) for when, field, value in
+                          history.changes()],
+                         [('volume', -39), ('mute_state', True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
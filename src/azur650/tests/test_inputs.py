@@ -0,0 +1,81 @@
+"""
+Configuring the sources of several inputs at once.
+"""
+
+# Python modules
+import unittest
+
+# Local modules
+from azur650.command import Azur650R
+from azur650.simulator import SimulatedAmplifier
+from azur650.tests import simulated
+
+
+class StubbornAmplifier(SimulatedAmplifier):
+    """
+    Accepts any audio source, but stays on analogue.
+    """
+
+    def _group_2(self, number, data):
+        if number == '04': data = '00'
+        return SimulatedAmplifier._group_2(self, number, data)
+
+
+class InputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier, self.amp = simulated()
+        self.amp.input_select('01')
+
+    def configure(self, sources):
+        """
+        Calls configure_inputs, returning its result and the number of
+        commands it sent.
+        """
+        before = self.amplifier.commands
+        result = self.amp.configure_inputs(sources)
+        return result, self.amplifier.commands - before
+
+    def test_configure(self):
+        sources = {'01': ('02', '03'), '02': ('01', None), '03': (None, 2)}
+        result, sent = self.configure(sources)
+        self.assertEqual(result, {'01': ('2', '3'), '02': ('1', None),
+                                  '03': (None, '2')})
+        # Both sources of the active input, select and set for each of the
+        # others, then back to the active input.
+        self.assertEqual(sent, 7)
+        self.assertEqual(self.amplifier.active_input, '01')
+        self.assertEqual(self.amplifier.audio_source_for_input['01'], '2')
+        self.assertEqual(self.amplifier.video_source_for_input['03'], '2')
+
+        # Nothing left to do
+        self.assertEqual(self.configure(sources), ({}, 0))
+        self.assertEqual(self.configure({'02': ('01', '01')}),
+                         ({'02': ('1', '1')}, 3))
+        self.assertEqual(self.amplifier.video_source_for_input['02'], '1')
+
+    def test_unknown_input(self):
+        amplifier, amp = simulated()
+        amplifier.active_input = '04'
+        amp.configure_inputs({'05': ('01', None)})
+        self.assertEqual(amplifier.active_input, '04')
+        self.assertEqual(amplifier.audio_source_for_input['05'], '1')
+
+    def test_not_applied(self):
+        amplifier = StubbornAmplifier()
+        amp = Azur650R(amplifier.open_port())
+        amp.input_select('01')
+        self.assertRaises(IOError, amp.configure_inputs,
+                          {'02': ('02', None)})
+        self.assertEqual(amplifier.active_input, '01')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.amp.configure_inputs,
+                          {'02': ('05', None)})
+        self.assertRaises(TypeError, self.amp.configure_inputs,
+                          {'10': ('01', None)})
+        self.assertEqual(self.amplifier.commands, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Checking the replies to macros.
+"""
+
+# Python modules
+import unittest
+
+# Local modules
+from azur650.macros import compile_macro, expected_reply, parse_macros
+from azur650.tests import simulated
+
+
+class MacroTest(unittest.TestCase):
+
+    def setUp(self):
+        self.macros = parse_macros('''
+            movie: power on, input 01, stereo mode 00
+            tuner: input 00, mute on
+        ''')
+
+    def test_expected_replies(self):
+        self.assertEqual(self.macros['movie'].replies,
+                         (('6', '01', '1'), ('7', '01', '01'),
+                          ('9', '01', '00')))
+        self.assertEqual(expected_reply(('2', '01', '00')),
+                         ('7', '01', '09'))
+
+    def test_reply_to_power_on(self):
+        # Power on reports the input selected, in the same group as the
+        # reply to selecting one.
+        movie = self.macros['movie']
+        self.assertEqual(movie.unanswered([('6', '01', '1'),
+                                           ('7', '01', '05'),
+                                           ('9', '01', '00')]), ['input 01'])
+        self.assertEqual(movie.unanswered([('6', '01', '1'),
+                                           ('7', '01', '01'),
+                                           ('9', '01', '00')]), [])
+        self.assertEqual(movie.unanswered([('6', '01', '1'), None,
+                                           ('9', '01', '00')]), ['input 01'])
+
+    def test_run(self):
+        amplifier, amp = simulated()
+        amplifier.active_input = '05'
+        amp.run_macro(self.macros['tuner'])
+        self.assertEqual(amplifier.active_input, '09')
+        self.assertTrue(amplifier.mute_state)
+        osd = compile_macro('osd', 'osd on, down, right, enter')
+        self.assertEqual(len(amp.run_macro(osd)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
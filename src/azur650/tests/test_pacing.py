@@ -0,0 +1,64 @@
+"""
+Pacing writes so that a slow amplifier doesn't drop commands.
+"""
+
+# Python modules
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from azur650.command import Azur650R
+from azur650.pacing import Pacer, calibrate
+from azur650.simulator import SimulatedAmplifier
+
+
+class PacingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier = SimulatedAmplifier(command_time=0.02,
+                                            command_buffer=1)
+        self.amp = Azur650R(self.amplifier.open_port())
+
+    def burst(self, count=10):
+        """
+        Asks for the protocol version count times at once, returning how
+        many commands the amplifier dropped.
+        """
+        dropped = self.amplifier.dropped
+        self.amp._exchange([('5', '02')] * count)
+        return self.amplifier.dropped - dropped
+
+    def test_unpaced(self):
+        self.assertTrue(self.burst() > 0)
+
+    def test_calibrated(self):
+        pacer = calibrate(self.amp, count=10, max_gap=0.1, resolution=0.005)
+        self.assertEqual(pacer.max_outstanding, 2)
+        self.assertTrue(0 < pacer.gap < 0.1, pacer)
+        self.amp.pacer = pacer
+        self.assertEqual(self.burst(), 0)
+
+    def test_limits(self):
+        pacer = Pacer(max_outstanding=2)
+        self.assertTrue(pacer.allows(1))
+        self.assertFalse(pacer.allows(2))
+        self.assertTrue(Pacer().allows(100))
+        self.assertEqual(Pacer(0.5).delay(), 0.0)
+
+    def test_profile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'pacing.json')
+            Pacer(0.025, 2).save(path)
+            pacer = Pacer.load(path)
+            self.assertEqual((pacer.gap, pacer.max_outstanding), (0.025, 2))
+            Pacer(0.01).save(path)
+            self.assertEqual(Pacer.load(path).max_outstanding, None)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Commands sent while the amplifier warms up after being switched on, however
+it was switched on.
+"""
+
+# Python modules
+import httplib
+import json
+import threading
+from time import time
+import unittest
+
+# Local modules
+from azur650.gateway import Gateway
+from azur650.macros import compile_macro
+from azur650.tests import simulated
+
+
+class PowerOnTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier, self.amp = simulated(warm_up_time=0.5)
+        self.amplifier.active_input = '05'
+
+    def test_power_on(self):
+        self.amp.power_on()
+        self.amp.input_select('02')
+        self.assertEqual(self.amplifier.active_input, '02')
+
+    def test_power_command(self):
+        self.amp.command('power', '1')
+        self.amp.input_select('02')
+        self.assertEqual(self.amplifier.active_input, '02')
+
+    def test_macro(self):
+        macro = compile_macro('movie', 'power on, input 01, mute on')
+        self.amp.run_macro(macro)
+        self.assertEqual(self.amplifier.active_input, '01')
+        self.assertTrue(self.amplifier.mute_state)
+
+    def test_write_behind(self):
+        self.amp.enable_write_behind()
+        try:
+            self.amp.command('power', '1')
+            self.amp.input_select('03').wait(5)
+        finally:
+            self.amp.disable_write_behind()
+        self.assertEqual(self.amplifier.active_input, '03')
+
+    def test_already_on(self):
+        self.amp.power_on()
+        self.amp.input_select('02')
+        started = time()
+        self.amp.power_on()
+        self.amp.input_select('06')
+        self.assertTrue(time() - started < self.amplifier.warm_up_time)
+        self.assertEqual(self.amplifier.active_input, '06')
+
+    def test_gateway(self):
+        server = Gateway(self.amp, ('127.0.0.1', 0))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        try:
+            for path, request in (('/command', {'name': 'power',
+                                                'data': '1'}),
+                                  ('/input', {'input': '02'})):
+                connection = httplib.HTTPConnection(*server.server_address)
+                try:
+                    connection.request('POST', path, json.dumps(request))
+                    response = connection.getresponse()
+                    response.read() # So that the connection closes cleanly
+                    self.assertEqual(response.status, 200)
+                finally:
+                    connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(self.amplifier.active_input, '02')
+
+
+if __name__ == '__main__':
+    unittest.main()
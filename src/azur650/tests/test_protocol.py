@@ -0,0 +1,64 @@
+"""
+Replies decoded as the protocol table says.
+"""
+
+# Python modules
+import unittest
+
+# Local modules
+from azur650 import protocol
+from azur650.command import Azur650R
+from azur650.tests import simulated
+
+
+class ReplyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier, self.amp = simulated()
+
+    def test_state_follows_amplifier(self):
+        amp = self.amp
+        amp.power_on()
+        amp.volume_up()
+        amp.set_bass(4)
+        amp.set_treble(-2)
+        amp.sub_off()
+        amp.set_mute(True)
+        amp.show_osd()
+        amp.lip_sync_increase()
+        amp.input_select('03')
+        amp.set_audio_source_for_input('01')
+        amp.command('stereo_mode', '01')
+        amp.next_digital_processing_mode()
+        amp.get_codec()
+        amp.input_select('00')
+        amp.tuner_select_preset('02')
+        amp.tuner_select_band('1')
+        truth = self.amplifier.state()
+        state = amp.get_state()
+        for field in sorted(truth.keys()):
+            if field not in ('tuner_frequency', 'audio_source_for_input',
+                             'video_source_for_input'):
+                self.assertEqual(state[field], truth[field], field)
+        self.assertEqual(state['audio_source_for_input']['03'], '1')
+        self.assertEqual(amp.get_main_software_version(),
+                         self.amplifier.main_version)
+
+    def test_undecodable_data(self):
+        self.amp.set_mute(True)
+        self.amp.get_digital_processing_mode()
+        for reply in (('6', '11', ''), ('6', '11', '7'), ('9', '04', ''),
+                      ('6',)):
+            self.amp._parse_response(reply)
+        self.assertEqual(self.amp.mute, True)
+        self.assertEqual(self.amp.signal_processing_mode, 'Stereo')
+
+    def test_preset_numbers(self):
+        presets = protocol.by_name['tuner_select_preset'].data
+        self.assertEqual(len(presets), Azur650R.tuner_preset_count)
+        self.assertEqual(presets[0], '01')
+        self.assertEqual(presets[-1], '%02d' % Azur650R.tuner_preset_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Shared mode: the files through which processes share the state.
+"""
+
+# Python modules
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+# Local modules
+from azur650 import shared
+from azur650.command import Azur650R
+from azur650.tests import simulated
+
+
+class SharedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.runtime = os.environ.get('XDG_RUNTIME_DIR')
+        os.environ['XDG_RUNTIME_DIR'] = self.directory
+        self.amplifier, self.amp = simulated()
+
+    def tearDown(self):
+        self.amp.disable_sharing()
+        if self.runtime is None: os.environ.pop('XDG_RUNTIME_DIR', None)
+        else: os.environ['XDG_RUNTIME_DIR'] = self.runtime
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_sharing(self):
+        self.amp.enable_sharing()
+        self.amp.volume_up()
+        watcher = Azur650R(self.amplifier.open_port())
+        watcher.enable_sharing()
+        try:
+            self.assertEqual(watcher.volume, -39)
+        finally:
+            watcher.disable_sharing()
+        for name in ('azur650-simulated.lock', 'azur650-simulated.state'):
+            mode = os.stat(self.path(name)).st_mode
+            self.assertEqual(stat.S_IMODE(mode), 0600)
+
+    def test_default_directory(self):
+        del os.environ['XDG_RUNTIME_DIR']
+        tempdir, tempfile.tempdir = tempfile.tempdir, self.directory
+        try:
+            path = shared.default_path('/dev/ttyS0')
+        finally:
+            tempfile.tempdir = tempdir
+        directory = os.path.dirname(path)
+        self.assertEqual(os.path.dirname(directory), self.directory)
+        self.assertEqual(stat.S_IMODE(os.stat(directory).st_mode), 0700)
+        self.assertEqual(os.path.basename(path), 'azur650-dev-ttyS0')
+
+    def test_open_directory(self):
+        os.chmod(self.directory, 0777)
+        self.assertRaises(IOError, shared.default_path, '/dev/ttyS0')
+
+    def test_symbolic_link(self):
+        open(self.path('target'), 'w').close()
+        os.symlink(self.path('target'), self.path('planted.state'))
+        self.assertRaises((IOError, OSError), self.amp.enable_sharing,
+                          self.path('planted'))
+        self.assertEqual(os.path.getsize(self.path('target')), 0)
+
+    @unittest.skipUnless(os.getuid() == 0, "Needs to give files away")
+    def test_other_users_file(self):
+        open(self.path('planted.state'), 'w').close()
+        os.chown(self.path('planted.state'), 12345, 12345)
+        self.assertRaises(IOError, self.amp.enable_sharing,
+                          self.path('planted'))
+
+
+if __name__ == '__main__':
+    unittest.main()
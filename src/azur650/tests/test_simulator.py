@@ -0,0 +1,116 @@
+"""
+The simulated amplifier, and the load test harness built on it.
+"""
+
+# Python modules
+from cStringIO import StringIO
+import threading
+import unittest
+
+# Local modules
+from azur650 import command, loadtest
+from azur650.simulator import Faults, SimulatedAmplifier
+
+
+def exchange(port, data, size=100):
+    """
+    Writes data to a simulated port and returns what comes back.
+    """
+    port.write(data)
+    return port.read(size)
+
+
+class SimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier = SimulatedAmplifier()
+        self.port = self.amplifier.open_port()
+
+    def test_replies(self):
+        self.assertEqual(exchange(self.port, '#1,02\r'), '#6,02,-39\r')
+        self.assertEqual(exchange(self.port, '#1,01,1\r'),
+                         '#7,01,01\r#6,01,1\r')
+        self.assertEqual(exchange(self.port, '#2,01,03\r'), '#7,01,03\r')
+        self.assertEqual(self.amplifier.state()['active_input'], '03')
+        self.assertEqual(exchange(self.port, '#1,11,07\r'), '#11,03\r')
+        self.assertEqual(exchange(self.port, '#0,01\r'), '#11,01\r')
+
+    def test_shared_buffer(self):
+        other = self.amplifier.open_port()
+        self.port.write('#1,02\r')
+        self.assertEqual(other.read(100), '#6,02,-39\r')
+        self.assertEqual(self.port.read(100), '')
+
+    def test_command_buffer(self):
+        amplifier = SimulatedAmplifier(command_time=0.05, command_buffer=1)
+        replies = exchange(amplifier.open_port(0.3), '#1,02\r' * 4, 100)
+        self.assertEqual(amplifier.dropped, 2)
+        self.assertEqual(replies.count('\r'), 2)
+
+    def test_warm_up(self):
+        amplifier = SimulatedAmplifier(warm_up_time=0.3)
+        port = amplifier.open_port()
+        exchange(port, '#1,01,1\r')
+        self.assertEqual(exchange(port, '#5,02\r'), '')
+        self.assertEqual(amplifier.dropped, 1)
+
+    def test_faults(self):
+        amplifier = SimulatedAmplifier(Faults(error=1.0))
+        self.assertEqual(exchange(amplifier.open_port(), '#1,02\r'),
+                         '#11,03\r')
+        amplifier = SimulatedAmplifier(Faults(duplicate=1.0))
+        self.assertEqual(exchange(amplifier.open_port(), '#1,02\r'),
+                         '#6,02,-39\r' * 2)
+        amplifier = SimulatedAmplifier(Faults(drop_byte=1.0))
+        self.assertEqual(len(exchange(amplifier.open_port(), '#1,02\r')),
+                         len('#6,02,-39\r') - 1)
+
+
+class LoadTest(unittest.TestCase):
+
+    def setUp(self):
+        # Damaged replies are reported on stderr; keep them out of the way.
+        self.stderr, command.stderr = command.stderr, StringIO()
+
+    def tearDown(self):
+        command.stderr = self.stderr
+
+    def run_load(self, mode='threads', **faults):
+        return loadtest.run(1, 0.5, mode, Faults(seed=1, **faults), seed=1)
+
+    def test_no_faults(self):
+        for mode in ('threads', 'write-behind'):
+            report = self.run_load(mode)
+            self.assertTrue(report['operations'] > 0)
+            self.assertEqual(report['errors'], {})
+            self.assertEqual(sum(report['divergence'].values()), 0)
+
+    def test_error_replies(self):
+        report = self.run_load(error=1.0)
+        self.assertEqual(report['operations'], 0)
+        self.assertTrue(report['errors']['CommandDataError'] > 0)
+
+    def test_damaged_replies(self):
+        # Clients which never get a clean reply can't keep up.
+        report = self.run_load(drop_byte=1.0)
+        self.assertTrue(sum(report['divergence'].values()) > 0)
+
+    def test_write_behind_finishes(self):
+        reports = []
+        faults = Faults(drop_byte=0.05, seed=1)
+        runner = threading.Thread(target=lambda: reports.append(
+            loadtest.run(2, 1.0, 'write-behind', faults, seed=1)))
+        runner.setDaemon(True)
+        runner.start()
+        runner.join(20)
+        self.assertFalse(runner.isAlive(), "The load test hung")
+        self.assertTrue(reports[0]['operations'] > 0)
+
+    def test_report(self):
+        text = loadtest.format_report(self.run_load())
+        self.assertTrue(text.startswith('threads, 1 clients'))
+        self.assertTrue('errors:      none' in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+The observable state store.
+"""
+
+# Python modules
+from cStringIO import StringIO
+import sys
+import threading
+from time import sleep
+import unittest
+
+# Local modules
+from azur650.state import StateStore
+from azur650.tests import simulated
+
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = StateStore(['volume', 'mute_state', 'sources'])
+        self.batches = []
+
+    def subscribe(self, fields=None, window=10.0):
+        return self.store.subscribe(self.batches.append, fields, window)
+
+    def test_coalesced(self):
+        subscription = self.subscribe()
+        for level in range(-40, -19):
+            self.store['volume'] = level
+        self.store['mute_state'] = True
+        self.store.unsubscribe(subscription)
+        self.assertEqual(self.batches, [{'volume': (None, -20),
+                                         'mute_state': (None, True)}])
+        self.assertEqual(subscription.delivered, 1)
+        self.assertEqual(subscription.coalesced, 20)
+
+    def test_window(self):
+        subscription = self.subscribe(window=0.05)
+        self.store['volume'] = -40
+        sleep(0.2)
+        self.store['volume'] = -39
+        self.store['volume'] = -38
+        self.store.unsubscribe(subscription)
+        self.assertEqual(self.batches, [{'volume': (None, -40)},
+                                        {'volume': (-40, -38)}])
+
+    def test_cancelled_out(self):
+        self.store['volume'] = -40
+        subscription = self.subscribe()
+        self.store['volume'] = -39
+        self.store['volume'] = -40
+        self.store.unsubscribe(subscription)
+        self.assertEqual(self.batches, [])
+
+    def test_fields(self):
+        subscription = self.subscribe(['mute_state'])
+        self.store['volume'] = -40
+        self.store['mute_state'] = False
+        self.store.unsubscribe(subscription)
+        self.assertEqual(self.batches, [{'mute_state': (None, False)}])
+        self.assertRaises(KeyError, self.subscribe, ['loudness'])
+
+    def test_cancel_delivers(self):
+        subscription = self.subscribe()
+        self.store['volume'] = -40
+        self.assertEqual(self.batches, [])
+        subscription.cancel()
+        self.assertEqual(self.batches, [{'volume': (None, -40)}])
+
+    def test_slow_subscriber(self):
+        # Changes made while a batch is being handled go in the next one.
+        busy = threading.Event()
+        carry_on = threading.Event()
+        def slow(changes):
+            self.batches.append(changes)
+            busy.set()
+            carry_on.wait(5)
+        subscription = self.store.subscribe(slow, window=0)
+        self.store['volume'] = -40
+        busy.wait(5)
+        for level in range(-39, -29):
+            self.store['volume'] = level
+        carry_on.set()
+        self.store.unsubscribe(subscription)
+        self.assertEqual(self.batches, [{'volume': (None, -40)},
+                                        {'volume': (-40, -30)}])
+
+    def test_failing_subscriber(self):
+        def failing(changes):
+            self.batches.append(changes)
+            raise ValueError(changes)
+        subscription = self.store.subscribe(failing, window=0)
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.store['volume'] = -40
+            sleep(0.1)
+            self.store['volume'] = -30
+            self.store.unsubscribe(subscription)
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(len(self.batches), 2)
+
+    def test_listeners(self):
+        changes = []
+        listener = lambda field, old, new: changes.append((field, old, new))
+        self.store.add_listener(listener)
+        self.store['volume'] = -40
+        self.store['volume'] = -40
+        self.store.set_item('sources', '01', '2')
+        self.store.remove_listener(listener)
+        self.store['volume'] = -30
+        self.assertEqual(changes, [('volume', None, -40),
+                                   ('sources', None, {'01': '2'})])
+
+    def test_restored(self):
+        self.store['volume'] = -40
+        self.assertTrue(self.store.updated('volume') is not None)
+        self.store.update({'volume': -30, 'loudness': 1})
+        self.assertEqual(self.store['volume'], -30)
+        self.assertEqual(self.store.updated('volume'), None)
+        self.assertEqual(self.store.snapshot(), {'volume': -30,
+                                                 'mute_state': None,
+                                                 'sources': None})
+
+
+class AmplifierStateTest(unittest.TestCase):
+
+    def test_volume_ramp(self):
+        amplifier, amp = simulated()
+        amp.set_volume(-40)
+        batches = []
+        subscription = amp.state.subscribe(batches.append, ['volume'],
+                                           window=0.2)
+        amp.set_volume(-20)
+        amp.state.unsubscribe(subscription)
+        self.assertTrue(len(batches) < 20)
+        self.assertEqual(batches[0]['volume'][0], -40)
+        self.assertEqual(batches[-1]['volume'][1], -20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Stepping controls to a level (set_volume() and friends), and the step model
+learnt from it, when the amplifier isn't where it was last seen.
+"""
+
+# Python modules
+import unittest
+
+# Local modules
+from azur650.tests import simulated
+
+
+class StepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.amplifier, self.amp = simulated()
+        self.amp.set_volume(-35)
+        self.amp.set_volume(-30)
+
+    def up_from(self, level):
+        return self.amp.get_step_model()['volume']['up'].get(str(level))
+
+    def test_set_volume(self):
+        self.assertEqual(self.amplifier.volume, -30)
+        self.assertEqual(self.up_from(-31), -30)
+
+    def test_knob_turned(self):
+        # Someone turns the knob; the next step isn't one to learn from.
+        self.amplifier.volume = -25
+        self.assertEqual(self.amp.volume_up(), '-24')
+        self.assertTrue(self.up_from(-30) in (None, -29))
+
+    def test_stale_level(self):
+        self.amplifier.volume = -25
+        self.amp.state['volume'] = -30
+        self.assertEqual(self.amp.set_volume(-27), -27)
+        self.assertEqual(self.amplifier.volume, -27)
+        self.assertTrue(self.up_from(-30) in (None, -29))
+
+    def test_unusual_step_needs_agreement(self):
+        # As when the reply to a step in between was lost
+        self.amp._record_step('volume', True, -30, -28)
+        self.assertEqual(self.up_from(-30), None)
+        self.amp._record_step('volume', True, -30, -28)
+        self.assertEqual(self.up_from(-30), -28)
+
+    def test_wrong_step_model(self):
+        # A model which puts the level out of reach: nothing is sent, and
+        # the level the amplifier is left at is returned, not the target.
+        model = self.amp.get_step_model()
+        model['volume']['up']['-30'] = -24
+        self.amp.state['step_model'] = model
+        commands = self.amplifier.commands
+        self.assertEqual(self.amp.set_volume(-27), -30)
+        self.assertEqual(self.amplifier.volume, -30)
+        self.assertEqual(self.amplifier.commands, commands)
+
+    def test_step_of_two(self):
+        self.assertEqual(self.amp.set_treble(4), 4)
+        for level, reached, steps in ((3, 4, 0), (-1, 0, 2), (-1, 0, 0),
+                                      (-3, -2, 1), (10, 10, 6)):
+            commands = self.amplifier.commands
+            self.assertEqual(self.amp.set_treble(level), reached)
+            self.assertEqual(self.amplifier.treble, reached)
+            self.assertEqual(self.amplifier.commands - commands, steps)
+
+
+if __name__ == '__main__':
+    unittest.main()
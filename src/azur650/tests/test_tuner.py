@@ -0,0 +1,73 @@
+"""
+The tuner's preset index, and tuning with it.
+"""
+
+# Python modules
+import unittest
+
+# Local modules
+from azur650.tests import simulated
+
+
+class TunerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Scanning is slow, so it is done once and the state re-used.
+        amplifier, amp = simulated()
+        amp.input_select('00')
+        amp.tuner_select_preset(3)
+        cls.presets = amp.scan_tuner_presets()
+        cls.preset = amplifier.tuner_preset
+        cls.state = amp.get_state()
+
+    def setUp(self):
+        self.amplifier, self.amp = simulated()
+        self.amplifier.active_input = '09'
+        self.amplifier.tuner_preset = '03'
+        self.amplifier.tuner_frequency = '101.10'
+        self.amp.set_state(self.state)
+
+    def sent(self, method, *args):
+        """
+        Calls a method, returning its result and the number of commands it
+        sent.
+        """
+        before = self.amplifier.commands
+        result = getattr(self.amp, method)(*args)
+        return result, self.amplifier.commands - before
+
+    def test_scan(self):
+        # Empty presets are left out, and the preset selected is restored.
+        self.assertEqual(self.presets, {'01': '87.50', '02': '95.80',
+                                        '03': '101.10', '05': '104.30',
+                                        '08': '1089'})
+        self.assertEqual(self.preset, '03')
+        self.assertEqual(self.state['tuner_presets'], self.presets)
+
+    def test_tune_to_preset(self):
+        self.assertEqual(self.sent('tune', '104.3'), ('104.30', 1))
+        self.assertEqual(self.amplifier.tuner_preset, '05')
+
+    def test_tune_from_preset(self):
+        self.assertEqual(self.sent('tune', '95.9'), ('95.90', 3))
+        self.assertEqual(self.amplifier.tuner_frequency, '95.90')
+        self.assertEqual(self.sent('tune', '1107'), ('1107', 3))
+        self.assertEqual(self.amplifier.tuner_band, '1')
+
+    def test_tune_from_current(self):
+        self.assertEqual(self.sent('tune', '101.0'), ('101.00', 2))
+        self.assertEqual(self.amplifier.tuner_preset, None)
+        self.assertEqual(self.sent('tune', '100.9'), ('100.90', 2))
+
+    def test_without_index(self):
+        amplifier, amp = simulated()
+        self.assertEqual(amp.tune('88.0'), '88.00')
+        self.assertEqual(amplifier.tuner_frequency, '88.00')
+
+    def test_off_the_grid(self):
+        self.assertRaises(ValueError, self.amp.tune, '101.12')
+
+
+if __name__ == '__main__':
+    unittest.main()
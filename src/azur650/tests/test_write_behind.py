@@ -0,0 +1,67 @@
+"""
+Write-behind mode against replies which are damaged, never come, or stop
+coming altogether.
+"""
+
+# Python modules
+from cStringIO import StringIO
+import sys
+import unittest
+
+# Local modules
+from azur650 import command
+from azur650.command import Azur650R
+from azur650.simulator import SimulatedAmplifier
+from azur650.tests import ScriptedSerial
+
+
+class WriteBehindTest(unittest.TestCase):
+
+    def setUp(self):
+        # Damaged replies are reported on stderr; keep them out of the way.
+        self.stderr, command.stderr = command.stderr, StringIO()
+        self.amplifier = SimulatedAmplifier()
+        self.port = ScriptedSerial(self.amplifier)
+        self.amp = Azur650R(self.port)
+        self.failed = []
+        self.amp.enable_write_behind(self.failed.append, reply_timeout=0.3)
+
+    def tearDown(self):
+        self.amp.disable_write_behind(timeout=2)
+        command.stderr = self.stderr
+
+    def test_damaged_frames(self):
+        self.port.inject = '#6\r\r#\r#6,02\r'
+        self.assertEqual(self.amp.command('volume_up').wait(2),
+                         ('6', '02', '-39'))
+        self.assertEqual(self.amp.command('volume_up').wait(2),
+                         ('6', '02', '-38'))
+        self.assertEqual(self.amp.volume, -38)
+        self.assertEqual(self.failed, [])
+
+    def test_unanswered_command_times_out(self):
+        self.port.swallow = 1
+        handle = self.amp.command('mute', '01')
+        self.assertTrue(self.amp.mute) # Assumed straight away...
+        self.assertRaises(IOError, handle.wait, 2)
+        self.assertFalse(self.amp.mute) # ...and rolled back
+        self.assertEqual(self.failed, [handle])
+        self.assertEqual(self.amp.command('volume_up').wait(2),
+                         ('6', '02', '-39'))
+
+    def test_reader_stops(self):
+        self.port.swallow = 1
+        handle = self.amp.command('mute', '01')
+        self.port.broken = True
+        stderr, sys.stderr = sys.stderr, StringIO() # The thread's traceback
+        try:
+            self.assertRaises(IOError, handle.wait, 2)
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(self.failed, [handle])
+        self.assertFalse(self.amp.mute)
+        self.assertRaises(IOError, self.amp.command, 'volume_up')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+"""
+Optional structured tracing. Give an Azur650R a Tracer and every public call
+becomes a span, with a child span for each exchange on the serial line
+recording the bytes written, the time spent waiting for the reply, the frames
+parsed and whether the read timed out:
+
+    tracer = Tracer(ChromeTraceExporter('/tmp/azur650.trace'))
+    amp = Azur650R('/dev/ttyS0', tracer=tracer)
+    amp.set_volume(-30)
+    tracer.close()
+
+Spans are exported as they finish, either as JSON lines (JSONLinesExporter)
+or as Chrome trace events (ChromeTraceExporter; open the file in
+chrome://tracing or Perfetto).
+"""
+
+# Python modules
+import json
+import os
+import threading
+from functools import wraps
+from itertools import count
+from time import time
+
+
+class Span(object):
+    """
+    A timed operation, with attributes describing it.
+    """
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.span_id = tracer._next_id()
+        self.thread = threading.currentThread().ident
+        self.start = None
+        self.end = None
+
+    def set(self, name, value):
+        """
+        Sets (or replaces) an attribute.
+        """
+        self.attributes[name] = value
+
+    def __enter__(self):
+        self.start = time()
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.end = time()
+        if exception is not None:
+            self.set('error', '%s: %s' % (exception_type.__name__, exception))
+        self.tracer._pop(self)
+        return False
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent and self.parent.span_id or None,
+            'thread': self.thread,
+            'start': self.start,
+            'duration': self.end - self.start,
+            'attributes': self.attributes,
+        }
+
+
+class NullSpan(object):
+    """
+    Stands in for a Span when there is no tracer, doing nothing.
+    """
+
+    def set(self, name, value): pass
+
+    def __enter__(self): return self
+
+    def __exit__(self, exception_type, exception, traceback): return False
+
+null_span = NullSpan()
+
+
+class Tracer(object):
+    """
+    Creates spans, keeping track of the current span on each thread, and
+    hands finished spans to an exporter.
+    """
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.__local = threading.local()
+        self.__ids = count(1)
+        self.__lock = threading.Lock()
+
+    def _next_id(self):
+        with self.__lock:
+            return self.__ids.next()
+
+    def _stack(self):
+        if not hasattr(self.__local, 'stack'): self.__local.stack = []
+        return self.__local.stack
+
+    def _push(self, span):
+        self._stack().append(span)
+
+    def _pop(self, span):
+        stack = self._stack()
+        if stack and stack[-1] is span: stack.pop()
+        self.exporter.export(span)
+
+    def span(self, name, **attributes):
+        """
+        Returns a new span (use it in a with statement), a child of the
+        current span on this thread, if any.
+        """
+        stack = self._stack()
+        return Span(self, name, stack and stack[-1] or None, attributes)
+
+    def close(self):
+        """
+        Closes the exporter.
+        """
+        self.exporter.close()
+
+
+class JSONLinesExporter(object):
+    """
+    Writes each span as a line of JSON (see Span.as_dict).
+    """
+
+    def __init__(self, path):
+        self.__file = open(path, 'a')
+        self.__lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.as_dict(), default=repr)
+        with self.__lock:
+            self.__file.write('%s\n' % line)
+            self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+class ChromeTraceExporter(object):
+    """
+    Writes spans as Chrome trace events ('complete' events, in the JSON array
+    format, which is valid to read even before close() is called).
+    """
+
+    def __init__(self, path):
+        self.__file = open(path, 'w')
+        self.__file.write('[\n')
+        self.__first = True
+        self.__lock = threading.Lock()
+
+    def export(self, span):
+        event = json.dumps({
+            'name': span.name,
+            'ph': 'X',
+            'ts': span.start * 1e6,
+            'dur': (span.end - span.start) * 1e6,
+            'pid': os.getpid(),
+            'tid': span.thread,
+            'args': span.attributes,
+        }, default=repr)
+        with self.__lock:
+            if not self.__first: self.__file.write(',\n')
+            self.__first = False
+            self.__file.write(event)
+            self.__file.flush()
+
+    def close(self):
+        self.__file.write('\n]\n')
+        self.__file.close()
+
+
+def traced(method):
+    """
+    Wraps a public Azur650R method so that calls to it are spans, when the
+    instance has a tracer.
+    """
+    name = 'Azur650R.%s' % method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        tracer = self.tracer
+        if tracer is None: return method(self, *args, **kwargs)
+        with tracer.span(name, args=args) as span:
+            result = method(self, *args, **kwargs)
+            span.set('result', result)
+            return result
+    return wrapper